@@ -1,38 +1,109 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from pathlib import Path
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
+import hashlib
+import json
 import os
+import time
+from cache import TTLCache
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost: BCRYPT_ROUNDS overrides the value recorded by calibrate_bcrypt.py
+BCRYPT_COST_FILE = Path(__file__).parent / "bcrypt_cost.json"
+DEFAULT_BCRYPT_ROUNDS = 12
+
+def load_bcrypt_rounds() -> int:
+    """Return the target bcrypt cost for this machine."""
+    if os.environ.get("BCRYPT_ROUNDS"):
+        return int(os.environ["BCRYPT_ROUNDS"])
+    try:
+        with open(BCRYPT_COST_FILE) as f:
+            return int(json.load(f)["rounds"])
+    except (OSError, ValueError, KeyError):
+        return DEFAULT_BCRYPT_ROUNDS
+
+BCRYPT_ROUNDS = load_bcrypt_rounds()
+
+# Password hashing. Pinning min and max rounds to the target makes
+# needs_update() flag hashes made at any other cost.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 # JWT settings
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+
+# Memoized verification results, keyed by token digest and evicted at "exp"
+TOKEN_CACHE_ENABLED = os.environ.get("JWT_CACHE_ENABLED", "true").lower() == "true"
+TOKEN_CACHE_MAX_SIZE = int(os.environ.get("JWT_CACHE_MAX_SIZE", "10000"))
+token_cache = TTLCache(maxsize=TOKEN_CACHE_MAX_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+def set_token_cache_enabled(enabled: bool):
+    """Turn JWT verification memoization on or off (e.g. for benchmarks)."""
+    global TOKEN_CACHE_ENABLED
+    TOKEN_CACHE_ENABLED = enabled
+    if not enabled:
+        token_cache.clear()
+
+def token_cache_stats() -> dict:
+    """Return JWT cache counters for monitoring."""
+    return {"enabled": TOKEN_CACHE_ENABLED, **token_cache.stats()}
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash."""
     return pwd_context.verify(plain_password, hashed_password)
 
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password and return a replacement hash if its cost is off target."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
 def get_password_hash(password: str) -> str:
     """Generate password hash."""
     return pwd_context.hash(password)
 
+def hash_secret_token(token: str) -> str:
+    """Digest an opaque secret (refresh or reset token) for storage."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create JWT access token."""
     to_encode = data.copy()
+    now = datetime.utcnow()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
+        expire = now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire, "iat": now})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str) -> Optional[dict]:
     """Verify JWT token and return payload."""
+    if not TOKEN_CACHE_ENABLED:
+        return _decode_token(token)
+    
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return dict(payload)
+    
+    payload = _decode_token(token)
+    if payload is not None:
+        # Never keep a token past its expiry
+        remaining = payload.get("exp", 0) - time.time()
+        if remaining > 0:
+            token_cache.set(digest, payload, ttl=remaining)
+        return dict(payload)
+    return None
+
+def _decode_token(token: str) -> Optional[dict]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         return payload
@@ -0,0 +1,80 @@
+"""
+Backfill the customer snapshot on existing orders.
+
+Orders created at checkout carry `customer` (id, name, email, phone), so
+order views no longer join against `users`. This fills the snapshot in on
+older orders in batches: one `$in` query for the batch's users and one
+bulk_write per chunk. Only orders without a snapshot are touched, so the
+script is safe to re-run and resumes naturally after an interruption.
+
+Usage:
+    python backfill_order_customers.py [--batch-size 1000]
+"""
+import argparse
+import asyncio
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from loaders import CUSTOMER_PROJECTION, customer_snapshot
+
+
+async def backfill_customers(db, batch_size: int) -> int:
+    """Embed customer snapshots on orders missing one; returns orders updated."""
+    last_id = None
+    updated = 0
+
+    while True:
+        query = {"customer": None}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        orders = await db.orders.find(
+            query, {"_id": 1, "user_id": 1, "phone": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not orders:
+            break
+
+        user_ids = list({order["user_id"] for order in orders})
+        users = await db.users.find({"id": {"$in": user_ids}}, CUSTOMER_PROJECTION).to_list(len(user_ids))
+        by_id = {user["id"]: user for user in users}
+
+        ops = []
+        for order in orders:
+            snapshot = customer_snapshot(by_id.get(order["user_id"]), order.get("phone"))
+            if snapshot is not None:
+                # Guard so a snapshot written meanwhile is not overwritten
+                ops.append(UpdateOne({"_id": order["_id"], "customer": None}, {"$set": {"customer": snapshot}}))
+        if ops:
+            result = await db.orders.bulk_write(ops, ordered=False)
+            updated += result.modified_count
+
+        last_id = orders[-1]["_id"]
+        print(f"   {updated} orders updated so far")
+
+    return updated
+
+
+async def main(batch_size: int):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        updated = await backfill_customers(db, batch_size)
+        print(f"✅ {updated} orders now carry a customer snapshot")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill customer snapshots on orders")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("🧾 Backfilling order customer snapshots...")
+    print("=" * 50)
+    asyncio.run(main(args.batch_size))
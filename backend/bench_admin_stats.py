@@ -0,0 +1,109 @@
+"""
+Benchmark /api/admin/stats query strategies on a synthetic orders collection.
+
+Compares the original sequential round trips (the order total, one count
+per status in ORDER_STATUSES, users, products, revenue), a single
+aggregation over orders, and the incrementally maintained stats document
+used now. Runs against a throwaway database (<DB_NAME>_bench) that is
+dropped afterwards unless --keep is given.
+
+Usage:
+    python bench_admin_stats.py --orders 200000 --runs 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from indexes import ensure_indexes
+from order_stats import ORDER_STATUSES, compute_admin_stats, read_admin_stats, reconcile_order_stats
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+async def seed(db, count: int, batch_size: int = 10000):
+    """Insert `count` synthetic orders plus a few users and products."""
+    for collection in ("orders", "users", "products"):
+        await db[collection].drop()
+    now = datetime.utcnow()
+    for start in range(0, count, batch_size):
+        batch = []
+        for _ in range(min(batch_size, count - start)):
+            total = random.randint(1, 10) * 6000
+            batch.append({
+                "id": str(uuid.uuid4()),
+                "user_id": str(uuid.uuid4()),
+                "status": random.choice(ORDER_STATUSES),
+                "total": total,
+                "created_at": now - timedelta(minutes=random.randint(0, 525600)),
+            })
+        await db.orders.insert_many(batch, ordered=False)
+    await db.users.insert_many([
+        {"id": str(uuid.uuid4()), "email": f"bench_{i}@example.com"} for i in range(1000)
+    ])
+    await db.products.insert_many([{"id": str(uuid.uuid4())} for _ in range(50)])
+    # Same indexes as production, so the per-status counts are index-backed
+    await ensure_indexes(db)
+    await reconcile_order_stats(db)
+
+
+async def sequential_stats(db) -> dict:
+    """The original implementation: one round trip per figure."""
+    result = {"orders": {"total": await db.orders.count_documents({})}}
+    for status in ORDER_STATUSES:
+        result["orders"][status] = await db.orders.count_documents({"status": status})
+    result["users"] = await db.users.count_documents({})
+    result["products"] = await db.products.count_documents({})
+    revenue = await db.orders.aggregate([
+        {"$match": {"status": "livree"}},
+        {"$group": {"_id": None, "total_revenue": {"$sum": "$total"}}}
+    ]).to_list(1)
+    result["revenue"] = revenue[0]["total_revenue"] if revenue else 0
+    return result
+
+
+async def time_it(fn, db, runs: int) -> list:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await fn(db)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+async def main(orders: int, runs: int, keep: bool):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[f"{os.environ['DB_NAME']}_bench"]
+    try:
+        print(f"🌱 Seeding {orders} synthetic orders...")
+        await seed(db, orders)
+
+        for name, fn in [("sequential (8 round trips)", sequential_stats),
+                         ("single aggregation", compute_admin_stats),
+                         ("stats document point read", read_admin_stats)]:
+            await fn(db)  # warm up
+            timings = await time_it(fn, db, runs)
+            print(f"   {name:28s} median {statistics.median(timings):8.1f} ms   "
+                  f"max {max(timings):8.1f} ms")
+    finally:
+        if not keep:
+            await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark admin stats strategies")
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database")
+    args = parser.parse_args()
+    asyncio.run(main(args.orders, args.runs, args.keep))
@@ -0,0 +1,108 @@
+"""
+Benchmark checkout throughput on a single hot product.
+
+Runs the same burst of concurrent checkouts, each for 1 to --max-quantity
+units, twice against one product: first with all stock in `products.stock`, then with the stock
+spread over sharded counters (see inventory.py). Runs against a throwaway
+database (<DB_NAME>_bench) that is dropped afterwards unless --keep is
+given. Use a replica set to measure the transactional path; on a standalone
+mongod the non-transactional fallback is measured. The path is printed with
+the results, so run it once against each and compare.
+
+Usage:
+    python bench_hot_sku.py --checkouts 2000 --concurrency 200 --shards 16 --max-quantity 3
+    python bench_hot_sku.py --mongo-url mongodb://localhost:27018
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from checkout import InsufficientStockError, place_order
+from database import supports_transactions
+from indexes import ensure_indexes
+from inventory import add_sharded_stock, set_stock_shards, shard_count_cache
+
+
+async def seed(db, stock: int) -> str:
+    """Reset the collections checkout touches and insert one hot product."""
+    for collection in ("products", "orders", "carts", "stock_shards", "inventory_ledger", "reservations"):
+        await db[collection].drop()
+    await ensure_indexes(db)
+    product_id = str(uuid.uuid4())
+    await db.products.insert_one({"id": product_id, "name": "Total 12kg", "price": 6000, "stock": stock})
+    shard_count_cache.clear()
+    return product_id
+
+
+async def run_burst(client, db, product_id: str, checkouts: int, concurrency: int, max_quantity: int) -> dict:
+    """Fire `checkouts` orders of 1..max_quantity units with at most `concurrency` in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    outcome = {"placed": 0, "units": 0, "rejected": 0}
+    rng = random.Random(42)
+    quantities = [rng.randint(1, max_quantity) for _ in range(checkouts)]
+
+    async def one(i):
+        async with semaphore:
+            order = {
+                "id": str(uuid.uuid4()),
+                "user_id": f"bench-{i}",
+                "items": [{"product_id": product_id, "quantity": quantities[i]}],
+            }
+            try:
+                await place_order(client, db, order)
+                outcome["placed"] += 1
+                outcome["units"] += quantities[i]
+            except InsufficientStockError:
+                outcome["rejected"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(checkouts)))
+    outcome["seconds"] = time.perf_counter() - start
+    return outcome
+
+
+async def main(checkouts: int, concurrency: int, shards: int, max_quantity: int, keep: bool, mongo_url: str):
+    client = AsyncIOMotorClient(mongo_url, maxPoolSize=max(100, concurrency))
+    db = client[f"{os.environ['DB_NAME']}_bench"]
+    try:
+        transactional = await supports_transactions(client)
+        print(f"📦 {'replica set, transactional' if transactional else 'standalone, guarded fallback'} checkout path")
+        for label, shard_count in [("single counter", 0), (f"{shards} shards", shards)]:
+            product_id = await seed(db, stock=checkouts)
+            if shard_count:
+                await set_stock_shards(db, product_id, shard_count)
+
+            print(f"🛒 {label}: {checkouts} checkouts, {concurrency} concurrent...")
+            outcome = await run_burst(client, db, product_id, checkouts, concurrency, max_quantity)
+            product = (await add_sharded_stock(db, [await db.products.find_one({"id": product_id})]))[0]
+            print(f"   {label:16s} {outcome['placed'] / outcome['seconds']:8.1f} orders/s   "
+                  f"placed {outcome['placed']} ({outcome['units']} units), rejected {outcome['rejected']}, "
+                  f"stock left {product['stock']}")
+            if outcome["units"] + product["stock"] != checkouts or product["stock"] < 0:
+                print(f"   ⚠️  {label}: units sold + stock left != {checkouts}, stock was lost or oversold")
+    finally:
+        if not keep:
+            await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark checkout throughput on one hot product")
+    parser.add_argument("--checkouts", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--shards", type=int, default=16)
+    parser.add_argument("--max-quantity", type=int, default=3, help="Units per order, 1 to this")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL"), help="Defaults to MONGO_URL")
+    args = parser.parse_args()
+    asyncio.run(main(args.checkouts, args.concurrency, args.shards, args.max_quantity, args.keep, args.mongo_url))
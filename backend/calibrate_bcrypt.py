@@ -0,0 +1,76 @@
+"""
+Calibrate the bcrypt cost for this machine.
+
+Measures hash latency at a range of costs and records the highest cost
+whose median latency stays inside the login budget. The result is written
+to bcrypt_cost.json, which auth.py reads at startup (BCRYPT_ROUNDS in the
+environment still takes precedence). Existing hashes are moved to the new
+cost transparently on their owner's next successful login.
+
+Usage:
+    python calibrate_bcrypt.py --budget-ms 250
+"""
+import argparse
+import json
+import platform
+import statistics
+import time
+from datetime import datetime
+
+from passlib.hash import bcrypt
+
+from auth import BCRYPT_COST_FILE
+
+
+def measure(rounds: int, samples: int) -> float:
+    """Return the median hash latency in milliseconds at a given cost."""
+    hasher = bcrypt.using(rounds=rounds)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash("calibration-password")
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(budget_ms: float, min_rounds: int, max_rounds: int, samples: int) -> dict:
+    """Pick the highest cost whose median latency fits inside the budget."""
+    measurements = {}
+    target = min_rounds
+    for rounds in range(min_rounds, max_rounds + 1):
+        latency = measure(rounds, samples)
+        measurements[str(rounds)] = round(latency, 2)
+        print(f"   cost {rounds:2d}: {latency:8.1f} ms")
+        if latency > budget_ms:
+            # Each extra round doubles the cost; no point measuring further.
+            break
+        target = rounds
+
+    return {
+        "rounds": target,
+        "budget_ms": budget_ms,
+        "measurements_ms": measurements,
+        "host": platform.node(),
+        "calibrated_at": datetime.utcnow().isoformat()
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate bcrypt cost for this machine")
+    parser.add_argument("--budget-ms", type=float, default=250, help="Max median hash latency")
+    parser.add_argument("--min-rounds", type=int, default=10)
+    parser.add_argument("--max-rounds", type=int, default=15)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--dry-run", action="store_true", help="Measure without writing the result")
+    args = parser.parse_args()
+
+    print(f"⏱  Calibrating bcrypt cost (budget {args.budget_ms:.0f} ms)...")
+    print("=" * 50)
+    result = calibrate(args.budget_ms, args.min_rounds, args.max_rounds, args.samples)
+    print(f"\n✅ Target cost: {result['rounds']}")
+
+    if not args.dry_run:
+        with open(BCRYPT_COST_FILE, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"   Recorded in {BCRYPT_COST_FILE}")
+        print("   Restart the API to apply; existing hashes are upgraded on next login.")
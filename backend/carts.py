@@ -0,0 +1,266 @@
+"""Atomic cart line mutations.
+
+A cart line is identified by (product_id, size). Each mutation is a single
+update on the cart document: `$inc`/`$set` on the matching line through an
+array filter, `$push` guarded by the line not existing yet, or `$pull`. No
+cart is read back and rewritten, so concurrent taps can't overwrite each
+other's changes.
+
+Batches of edits (PATCH /api/cart) run as one pipeline update with a `$set`
+stage per operation, so the whole batch lands atomically.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from checkout import order_quantities
+from inventory import add_sharded_stock
+from reservations import available_stock, held_quantities
+
+
+class CartLineNotFoundError(Exception):
+    """A `set` operation targeted a line that isn't in the cart."""
+
+
+def _line(product_id: str, size: str) -> dict:
+    return {"product_id": product_id, "size": size}
+
+
+def _line_filters(product_id: str, size: str) -> list:
+    return [{"line.product_id": product_id, "line.size": size}]
+
+
+async def add_cart_item(db, user_id: str, item: dict) -> str:
+    """Add `item` to the user's cart, or bump the quantity of the same line.
+
+    Returns the cart id. Creates the cart on first use.
+    """
+    line = _line(item["product_id"], item["size"])
+    projection = {"_id": 0, "id": 1}
+    # A concurrent add of the same line can make the push guard miss and the
+    # upsert collide with the existing cart; the retry then takes the $inc path.
+    for _ in range(3):
+        cart = await db.carts.find_one_and_update(
+            {"user_id": user_id, "items": {"$elemMatch": line}},
+            {"$inc": {"items.$[line].quantity": item["quantity"]}, "$set": {"updated_at": datetime.utcnow()}},
+            array_filters=_line_filters(item["product_id"], item["size"]),
+            projection=projection
+        )
+        if cart:
+            return cart["id"]
+        try:
+            cart = await db.carts.find_one_and_update(
+                {"user_id": user_id, "items": {"$not": {"$elemMatch": line}}},
+                {
+                    "$push": {"items": item},
+                    "$set": {"updated_at": datetime.utcnow()},
+                    "$setOnInsert": {"id": str(uuid.uuid4())}
+                },
+                projection=projection,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            return cart["id"]
+        except DuplicateKeyError:
+            continue
+    raise RuntimeError("Cart update kept conflicting")
+
+
+async def set_cart_item_quantity(db, user_id: str, product_id: str, size: str, quantity: int) -> bool:
+    """Set a line's quantity, removing it when quantity <= 0. False if no such line."""
+    if quantity <= 0:
+        return await remove_cart_item(db, user_id, product_id, size)
+    result = await db.carts.update_one(
+        {"user_id": user_id, "items": {"$elemMatch": _line(product_id, size)}},
+        {"$set": {"items.$[line].quantity": quantity, "updated_at": datetime.utcnow()}},
+        array_filters=_line_filters(product_id, size)
+    )
+    return result.matched_count > 0
+
+
+async def remove_cart_item(db, user_id: str, product_id: str, size: str) -> bool:
+    """Remove a line from the cart. False if no such line."""
+    line = _line(product_id, size)
+    result = await db.carts.update_one(
+        {"user_id": user_id, "items": {"$elemMatch": line}},
+        {"$pull": {"items": line}, "$set": {"updated_at": datetime.utcnow()}}
+    )
+    return result.matched_count > 0
+
+
+def _is_line(product_id: str, size: str) -> dict:
+    """Aggregation test for `$$this` being the (product_id, size) line."""
+    return {"$and": [
+        {"$eq": ["$$this.product_id", {"$literal": product_id}]},
+        {"$eq": ["$$this.size", {"$literal": size}]}
+    ]}
+
+
+def _operation_stage(op: dict, product: Optional[dict]) -> dict:
+    """One `$set` stage rewriting `items` for a single set/add/remove operation.
+
+    Only `add` creates a missing line; `set` only changes a line that is
+    already there (see `required_lines`).
+    """
+    items = {"$ifNull": ["$items", []]}
+    is_line = _is_line(op["product_id"], op["size"])
+
+    if op["op"] == "remove":
+        return {"$set": {"items": {"$filter": {"input": items, "cond": {"$not": [is_line]}}}}}
+
+    quantity = {"$literal": op["quantity"]}
+    if op["op"] == "add":
+        quantity = {"$add": ["$$this.quantity", quantity]}
+    updated = {"$map": {"input": items, "in": {
+        "$cond": [is_line, {"$mergeObjects": ["$$this", {"quantity": quantity}]}, "$$this"]
+    }}}
+    if op["op"] == "set":
+        return {"$set": {"items": updated}}
+
+    new_line = {"$literal": [{
+        "product_id": op["product_id"],
+        "product_name": product["name"],
+        "product_image": product["image_url"],
+        "quantity": op["quantity"],
+        "size": op["size"],
+        "price": product["price"]
+    }]}
+    has_line = {"$anyElementTrue": [{"$map": {"input": items, "in": is_line}}]}
+    return {"$set": {"items": {"$cond": [has_line, updated, {"$concatArrays": [items, new_line]}]}}}
+
+
+def required_lines(operations: List[dict]) -> List[dict]:
+    """Lines the cart must already hold for every `set` in the batch to apply.
+
+    A `set` after an `add` of the same line in the batch needs nothing from
+    the stored cart. Raises CartLineNotFoundError for a `set` on a line an
+    earlier operation removed.
+    """
+    present, removed, required = set(), set(), {}
+    for op in operations:
+        key = (op["product_id"], op["size"])
+        if op["op"] == "remove":
+            present.discard(key)
+            removed.add(key)
+        elif op["op"] == "add":
+            present.add(key)
+        elif key not in present:
+            if key in removed:
+                raise CartLineNotFoundError(f"{key[0]} ({key[1]}) is not in the cart")
+            required[key] = _line(*key)
+            present.add(key)
+    return list(required.values())
+
+
+def cart_update_pipeline(operations: List[dict], products: Dict[str, dict]) -> list:
+    """Pipeline applying `operations` in order, then dropping empty lines.
+
+    Values from the request are wrapped in $literal so a product id or size
+    starting with "$" is never read as a field path.
+    """
+    pipeline = [_operation_stage(op, products.get(op["product_id"])) for op in operations]
+    pipeline.append({"$set": {
+        "items": {"$filter": {"input": {"$ifNull": ["$items", []]}, "cond": {"$gt": ["$$this.quantity", 0]}}},
+        "id": {"$ifNull": ["$id", {"$literal": str(uuid.uuid4())}]},
+        "updated_at": "$$NOW"
+    }})
+    return pipeline
+
+
+async def apply_cart_operations(db, user_id: str, operations: List[dict], products: Dict[str, dict]) -> Optional[dict]:
+    """Apply set/add/remove operations to the cart in one atomic write; returns the new cart.
+
+    `products` maps product_id to its current document for every add
+    operation, used when the line isn't in the cart yet. Raises
+    CartLineNotFoundError if a `set` targets a line the cart doesn't hold,
+    like PUT /api/cart/items does. Only a batch with an `add` creates the
+    cart; otherwise None is returned when there is no cart.
+    """
+    lines = required_lines(operations)
+    query = {"user_id": user_id}
+    if lines:
+        query["$and"] = [{"items": {"$elemMatch": line}} for line in lines]
+    upsert = any(op["op"] == "add" for op in operations) and not lines
+    pipeline = cart_update_pipeline(operations, products)
+    for attempt in range(2):
+        try:
+            cart = await db.carts.find_one_and_update(
+                query,
+                pipeline,
+                projection={"_id": 0},
+                upsert=upsert,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Another request created the cart first; apply to that one
+            if attempt:
+                raise
+            continue
+        if cart is None and lines:
+            raise CartLineNotFoundError("A line to set is not in the cart")
+        return cart
+
+
+async def reprice_cart_items(db, items: List[dict], user_id: Optional[str] = None) -> Tuple[List[dict], List[dict]]:
+    """Check cart lines against current products with a single `$in` query.
+
+    Returns (lines, changes). `lines` carry current names, images and prices
+    and drop products that no longer exist. `changes` has one entry per line
+    whose product was removed, whose price changed, or whose product lacks
+    stock for the quantity in the cart. Stock held by other customers
+    doesn't count; with `user_id`, that user's own holds do.
+    """
+    quantities = order_quantities(items)
+    found = await db.products.find(
+        {"id": {"$in": list(quantities)}},
+        {"_id": 0, "id": 1, "name": 1, "image_url": 1, "price": 1, "stock": 1, "reserved": 1, "stock_shards": 1}
+    ).to_list(len(quantities))
+    products = {p["id"]: p for p in await add_sharded_stock(db, found)}
+    held = await held_quantities(db, user_id) if user_id else {}
+
+    lines, changes = [], []
+    for item in items:
+        change = {"product_id": item["product_id"], "size": item["size"], "product_name": item["product_name"]}
+        product = products.get(item["product_id"])
+        if product is None:
+            changes.append({**change, "change": "removed"})
+            continue
+
+        lines.append({
+            **item,
+            "product_name": product["name"],
+            "product_image": product["image_url"],
+            "price": product["price"]
+        })
+        if product["price"] != item["price"]:
+            changes.append({**change, "change": "price", "old_price": item["price"], "price": product["price"]})
+        available = available_stock(product, held.get(item["product_id"], 0))
+        if available < quantities[item["product_id"]]:
+            changes.append({**change, "change": "stock", "available": max(available, 0)})
+    return lines, changes
+
+
+def cart_totals(cart: Optional[dict]) -> dict:
+    """Shape a cart document into the /api/cart response."""
+    if not cart:
+        return {
+            "id": None,
+            "items": [],
+            "subtotal": 0,
+            "delivery_fee": 3500,
+            "total": 3500
+        }
+
+    # Calculate totals (all in XAF - integers)
+    subtotal = sum(item["price"] * item["quantity"] for item in cart.get("items", []))
+    delivery_fee = 3500  # 3,500 FCFA
+    return {
+        "id": cart.get("id"),
+        "items": cart.get("items", []),
+        "subtotal": subtotal,
+        "delivery_fee": delivery_fee,
+        "total": subtotal + delivery_fee
+    }
@@ -0,0 +1,174 @@
+"""Checkout: turn a cart into an order without overselling.
+
+Stock for every product in the cart is decremented in one bulk_write. Each
+update is guarded so that stock not held by other customers, plus the
+customer's own hold (see reservations.py), covers the quantity. A product
+that can't cover the order is simply not matched and the checkout is
+rejected. The same update turns the hold into a decrement by subtracting
+it from `reserved`. Hot products with sharded stock (see inventory.py)
+are taken from their shards first, one or several, and that update only
+covers what the shards didn't; units the customer holds always come from
+the pool, where holds are kept.
+
+On a replica set (or mongos) the stock decrement, order insert and cart
+delete run in one transaction: a shortfall aborts it and nothing is
+written. A standalone mongod has no transactions, so the fallback tags each
+decremented product with the order id and, on a shortfall, uses the tag to
+restore exactly the decrements that applied. A crash midway through the
+fallback can still leave stock decremented without an order; run a replica
+set in production.
+"""
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from database import transactions_enabled
+from inventory import (
+    add_sharded_stock, pool_quantities, return_to_shards, sale_entries, shard_counts, take_from_shards
+)
+from reservations import (
+    available_at_least, available_stock, claim_held_quantities, held_quantities,
+    release_user_reservations, unclaim_held_quantities
+)
+
+
+class InsufficientStockError(Exception):
+    """Raised when one or more cart items exceed available stock."""
+
+    def __init__(self, products: List[dict]):
+        self.product_ids = [p["id"] for p in products]
+        names = ", ".join(p.get("name") or p["id"] for p in products)
+        super().__init__(f"Insufficient stock for: {names}")
+
+
+def order_quantities(items: List[dict]) -> Dict[str, int]:
+    """Total quantity per product; one product may appear in several sizes."""
+    quantities: Dict[str, int] = {}
+    for item in items:
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    return quantities
+
+
+async def _short_products(db, quantities: Dict[str, int], held: Dict[str, int], attempted: List[str]) -> List[dict]:
+    """Products whose stock, net of other customers' holds, can't cover the quantity.
+
+    Call it once the failed checkout's writes are undone. If stock freed up
+    in the meantime and nothing looks short, the `attempted` products whose
+    decrement missed are reported instead.
+    """
+    products = await db.products.find(
+        {"id": {"$in": list(quantities)}},
+        {"_id": 0, "id": 1, "name": 1, "stock": 1, "reserved": 1, "stock_shards": 1}
+    ).to_list(len(quantities))
+    found = {p["id"]: p for p in await add_sharded_stock(db, products)}
+
+    short = [
+        found.get(pid, {"id": pid}) for pid, qty in quantities.items()
+        if available_stock(found.get(pid, {}), held.get(pid, 0)) < qty
+    ]
+    return short or [found.get(pid, {"id": pid}) for pid in attempted]
+
+
+def _shard_quantities(quantities: Dict[str, int], held: Dict[str, int]) -> Dict[str, int]:
+    """What may come from shards: held units sit in the pool, so they're taken there."""
+    return {pid: qty - held.get(pid, 0) for pid, qty in quantities.items()}
+
+
+def _stock_update(product_id: str, quantity: int, held: int, extra: Optional[dict] = None) -> UpdateOne:
+    """Guarded decrement of `quantity`, consuming `held` units of our own hold."""
+    query = {"id": product_id, **available_at_least(quantity, held)}
+    inc = {"stock": -quantity}
+    if held:
+        query["reserved"] = {"$gte": held}
+        inc["reserved"] = -held
+    return UpdateOne(query, {"$inc": inc, **(extra or {})})
+
+
+async def _place_in_transaction(client, db, order_doc: dict, quantities: Dict[str, int], counts: Dict[str, int]):
+    user_id = order_doc["user_id"]
+    attempt = {}
+
+    async def write(session):
+        held = await held_quantities(db, user_id, session=session)
+        held = {pid: qty for pid, qty in held.items() if pid in quantities}
+        taken = await take_from_shards(db, _shard_quantities(quantities, held), counts, session=session)
+        pool = pool_quantities(quantities, taken)
+        attempt.update(held=held, pool=pool)
+        if pool:
+            ops = [_stock_update(pid, qty, held.get(pid, 0)) for pid, qty in pool.items()]
+            result = await db.products.bulk_write(ops, ordered=False, session=session)
+            if result.modified_count < len(ops):
+                # Raising aborts the transaction, undoing the decrements that applied
+                raise InsufficientStockError([{"id": pid} for pid in pool])
+        await db.orders.insert_one(order_doc, session=session)
+        await db.inventory_ledger.insert_many(sale_entries(order_doc["id"], quantities, taken), session=session)
+        await db.carts.delete_one({"user_id": user_id}, session=session)
+        if held:
+            await db.reservations.delete_many(
+                {"user_id": user_id, "product_id": {"$in": list(held)}, "release_id": None},
+                session=session
+            )
+
+    async with await client.start_session() as session:
+        try:
+            # with_transaction retries transient write conflicts between checkouts
+            await session.with_transaction(write)
+        except InsufficientStockError:
+            # Now that the transaction is aborted, stock reads show what is really free
+            raise InsufficientStockError(
+                await _short_products(db, quantities, attempt["held"], list(attempt["pool"]))
+            ) from None
+
+
+async def _place_without_transaction(db, order_doc: dict, quantities: Dict[str, int], counts: Dict[str, int]):
+    user_id = order_doc["user_id"]
+    tag = order_doc["id"]
+    # Claimed holds are ours alone: the release job can't free them under us
+    claim_id = f"checkout:{tag}"
+    held = await claim_held_quantities(db, user_id, list(quantities), claim_id)
+    taken = await take_from_shards(db, _shard_quantities(quantities, held), counts)
+    pool = pool_quantities(quantities, taken)
+
+    if pool:
+        result = await db.products.bulk_write([
+            _stock_update(pid, qty, held.get(pid, 0), {"$push": {"stock_holds": tag}})
+            for pid, qty in pool.items()
+        ], ordered=False)
+
+        if result.modified_count < len(pool):
+            # Only products carrying our tag were decremented; give their stock back
+            await db.products.bulk_write([
+                UpdateOne(
+                    {"id": pid, "stock_holds": tag},
+                    {"$inc": {"stock": qty, "reserved": held.get(pid, 0)}, "$pull": {"stock_holds": tag}}
+                )
+                for pid, qty in pool.items()
+            ], ordered=False)
+            await return_to_shards(db, taken)
+            await unclaim_held_quantities(db, claim_id)
+            raise InsufficientStockError(await _short_products(db, quantities, held, list(pool)))
+
+    await db.orders.insert_one(order_doc)
+    await db.inventory_ledger.insert_many(sale_entries(order_doc["id"], quantities, taken))
+    if pool:
+        await db.products.update_many({"stock_holds": tag}, {"$pull": {"stock_holds": tag}})
+    if held:
+        await db.reservations.delete_many({"release_id": claim_id})
+    await db.carts.delete_one({"user_id": user_id})
+
+
+async def place_order(client, db, order_doc: dict, use_transaction: Optional[bool] = None):
+    """Reserve stock, save the order and clear the cart, all or nothing.
+
+    Raises InsufficientStockError, with nothing written, if any item is short.
+    """
+    quantities = order_quantities(order_doc["items"])
+    counts = await shard_counts(db, list(quantities))
+    if use_transaction is None:
+        use_transaction = await transactions_enabled(client)
+    if use_transaction:
+        await _place_in_transaction(client, db, order_doc, quantities, counts)
+    else:
+        await _place_without_transaction(db, order_doc, quantities, counts)
+    # Holds on products the customer dropped from the cart are no longer needed
+    await release_user_reservations(db, order_doc["user_id"])
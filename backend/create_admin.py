@@ -14,6 +14,7 @@ import os
 from dotenv import load_dotenv
 from pathlib import Path
 import uuid
+from datetime import datetime
 from passlib.context import CryptContext
 
 ROOT_DIR = Path(__file__).parent
@@ -52,7 +53,7 @@ async def create_admin_user():
             "address": "Yaoundé, Cameroun",
             "state": "Centre",
             "language": "fr",
-            "created_at": "2026-01-01T00:00:00"
+            "created_at": datetime(2026, 1, 1)
         }
         
         await db.users.insert_one(admin_user)
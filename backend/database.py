@@ -0,0 +1,141 @@
+"""MongoDB client construction and connection pool monitoring."""
+from typing import Optional
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from metrics import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+# Comma-separated, e.g. "zstd,snappy,zlib"; empty disables wire compression
+MONGO_COMPRESSORS = os.environ.get("MONGO_COMPRESSORS", "")
+
+# Resolved on first use; the deployment topology doesn't change at runtime
+_transactions_available: Optional[bool] = None
+
+
+class PoolCheckoutListener(monitoring.ConnectionPoolListener):
+    """Records how long operations wait to check a connection out of the pool.
+
+    Motor runs each operation on an executor thread, and the "started" and
+    "checked out" events for a checkout fire on the same thread, so a
+    thread-local start time pairs them up.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self.wait = LatencyStats()
+        self.checked_out = 0
+        self.failed = 0
+        self.timeouts = 0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            self.wait.record((time.perf_counter() - started) * 1000)
+            self._local.started = None
+        self.checked_out += 1
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        self.failed += 1
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            self.timeouts += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        """Return checkout wait times and pool usage for monitoring."""
+        return {
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "min_pool_size": MONGO_MIN_POOL_SIZE,
+            "in_use": self.checked_out,
+            "checkout_failures": self.failed,
+            "checkout_timeouts": self.timeouts,
+            "checkout_wait": self.wait.stats(),
+        }
+
+
+pool_listener = PoolCheckoutListener()
+
+
+def create_mongo_client(mongo_url: str) -> AsyncIOMotorClient:
+    """Build the Motor client with pool settings taken from the environment."""
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "event_listeners": [pool_listener],
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return AsyncIOMotorClient(mongo_url, **options)
+
+
+async def warm_up_pool(client: AsyncIOMotorClient, connections: Optional[int] = None):
+    """Open pool connections up front so the first requests don't pay for them.
+
+    The first ping also fails fast if the server is unreachable, before the
+    worker starts accepting traffic.
+    """
+    await client.admin.command("ping")
+    connections = MONGO_MIN_POOL_SIZE if connections is None else connections
+    if connections > 1:
+        # Concurrent pings force the pool to open that many sockets.
+        await asyncio.gather(*(client.admin.command("ping") for _ in range(connections)))
+
+
+async def supports_transactions(client: AsyncIOMotorClient) -> bool:
+    """True when connected to a replica set or mongos, where transactions work.
+
+    A standalone mongod rejects transactions, so callers fall back to
+    non-transactional writes there.
+    """
+    hello = await client.admin.command("hello")
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+
+async def transactions_enabled(client: AsyncIOMotorClient) -> bool:
+    """supports_transactions, checked once per process."""
+    global _transactions_available
+    if _transactions_available is None:
+        _transactions_available = await supports_transactions(client)
+        if not _transactions_available:
+            logger.warning("MongoDB is standalone; multi-document writes run without transactions")
+    return _transactions_available
@@ -2,12 +2,25 @@ from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from datetime import datetime
 import os
 from auth import verify_token
-from models import User
+from cache import TTLCache
+from models import User, TokenUser
+from revocation import revocation_list
 
 security = HTTPBearer()
 
+# Process-local cache of authenticated users, keyed by the JWT "sub" claim.
+# Saves a users-collection read and a Pydantic validation per request.
+USER_CACHE_TTL_SECONDS = float(os.environ.get("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_SIZE = int(os.environ.get("USER_CACHE_MAX_SIZE", "10000"))
+user_cache = TTLCache(maxsize=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+def invalidate_cached_user(user_id: str):
+    """Drop a user from the auth cache after their document changes."""
+    user_cache.invalidate(user_id)
+
 # Database dependency will be set in server.py
 _db: Optional[AsyncIOMotorDatabase] = None
 
@@ -25,29 +38,41 @@ def get_db() -> AsyncIOMotorDatabase:
         )
     return _db
 
-async def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncIOMotorDatabase = Depends(get_db)
-) -> User:
-    """Get current authenticated user from JWT token."""
-    token = credentials.credentials
+async def revoke_user_tokens(db: AsyncIOMotorDatabase, user_id: str):
+    """Invalidate every token issued to a user so far (role or password change)."""
+    # Token iat has whole seconds; a token issued later in this second must still pass
+    cutoff = datetime.utcnow().replace(microsecond=0)
+    await db.users.update_one({"id": user_id}, {"$set": {"tokens_valid_after": cutoff}})
+    revocation_list.add(user_id, cutoff)
+    invalidate_cached_user(user_id)
+
+async def _get_token_payload(token: str, db: AsyncIOMotorDatabase) -> dict:
+    """Verify a bearer token and check it against the revocation list."""
     payload = verify_token(token)
     
-    if payload is None:
+    if payload is None or payload.get("sub") is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    user_id: str = payload.get("sub")
-    if user_id is None:
+    await revocation_list.refresh_if_stale(db)
+    if revocation_list.is_revoked(payload["sub"], payload.get("iat")):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
+            detail="Token has been revoked",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    return payload
+
+async def _load_user(db: AsyncIOMotorDatabase, user_id: str) -> User:
+    """Load a user through the process-local cache."""
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+    
     user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
     if user_doc is None:
         raise HTTPException(
@@ -56,4 +81,30 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    user_cache.set(user_id, user)
+    return user
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+) -> User:
+    """Get current authenticated user from JWT token."""
+    payload = await _get_token_payload(credentials.credentials, db)
+    return await _load_user(db, payload["sub"])
+
+async def get_token_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+) -> TokenUser:
+    """Get the caller's identity and role from signed token claims only.
+    
+    Tokens issued before role claims existed fall back to a user lookup.
+    """
+    payload = await _get_token_payload(credentials.credentials, db)
+    
+    if payload.get("role") is None:
+        user = await _load_user(db, payload["sub"])
+        return TokenUser(id=user.id, name=user.name, role=user.role)
+    
+    return TokenUser(id=payload["sub"], name=payload.get("name", ""), role=payload["role"])
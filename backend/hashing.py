@@ -0,0 +1,98 @@
+"""Async password hashing backed by a bounded worker pool.
+
+bcrypt is deliberately slow; running it inline in an async handler blocks
+the event loop for every other request on the worker. This module runs
+hashing in a thread (or process) pool and rejects new work once too many
+jobs are waiting, so a login burst degrades into fast 503s instead of a
+stalled worker.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+import asyncio
+import os
+import time
+
+from auth import verify_password, verify_and_update_password, get_password_hash
+from metrics import LatencyStats
+
+HASH_POOL_KIND = os.environ.get("HASH_POOL_KIND", "thread")  # "thread" or "process"
+HASH_POOL_WORKERS = int(os.environ.get("HASH_POOL_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE_MAX = int(os.environ.get("HASH_QUEUE_MAX", "64"))
+
+
+class HashQueueFullError(Exception):
+    """Raised when the hashing pool already has too many pending jobs."""
+
+
+class PasswordHasher:
+    """Runs password hashing and verification off the event loop."""
+
+    def __init__(self, kind: str = "thread", workers: int = 2, max_queue: int = 64):
+        if kind not in ("thread", "process"):
+            raise ValueError("HASH_POOL_KIND must be 'thread' or 'process'")
+        self.kind = kind
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self.rejected = 0
+        self.latency = LatencyStats()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="pwd-hash"
+                )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        # Jobs beyond the worker count sit in the executor queue; cap the total.
+        if self._pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HashQueueFullError()
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+            self.latency.record((time.perf_counter() - start) * 1000)
+
+    async def hash(self, password: str) -> str:
+        """Hash a password in the worker pool."""
+        return await self._run(get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against a hash in the worker pool."""
+        return await self._run(verify_password, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str):
+        """Verify a password and return (valid, new_hash_or_None) in the worker pool."""
+        return await self._run(verify_and_update_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        """Stop the worker pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        """Return queue depth, rejections and latency for monitoring."""
+        return {
+            "pool_kind": self.kind,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self._pending, self.workers),
+            "queue_depth": max(self._pending - self.workers, 0),
+            "rejected": self.rejected,
+            "latency": self.latency.stats(),
+        }
+
+
+password_hasher = PasswordHasher(
+    kind=HASH_POOL_KIND, workers=HASH_POOL_WORKERS, max_queue=HASH_QUEUE_MAX
+)
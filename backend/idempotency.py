@@ -0,0 +1,101 @@
+"""Idempotency keys for non-repeatable POSTs.
+
+A client sends an `Idempotency-Key` header with a request and reuses it
+when retrying. The first request claims the key by inserting a pending
+row; the unique (user_id, key) index makes the claim atomic. Once the
+handler succeeds its response is stored on the row, and later requests
+with the same key get that response back without running the handler.
+
+A duplicate that arrives while the first is still running polls the row
+until the result is stored. If the handler fails, the row is deleted so
+the client can retry. Rows expire through a TTL index on `created_at`.
+"""
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Tuple
+import asyncio
+import hashlib
+import json
+import os
+
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+# How long a duplicate waits for the first request before giving up
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "10"))
+# A pending row older than this is assumed abandoned (worker crashed) and can be taken over
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "60"))
+POLL_INTERVAL_SECONDS = 0.1
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(body: dict) -> str:
+    """Digest of the request body, to catch a key reused for a different request."""
+    return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode()).hexdigest()
+
+
+async def _claim(db, user_id: str, key: str, fingerprint: str) -> bool:
+    """Insert the pending row, or take over an abandoned one. False if someone holds it."""
+    now = datetime.utcnow()
+    try:
+        await db.idempotency_keys.insert_one({
+            "user_id": user_id,
+            "key": key,
+            "fingerprint": fingerprint,
+            "status": "pending",
+            "created_at": now
+        })
+        return True
+    except DuplicateKeyError:
+        pass
+    taken = await db.idempotency_keys.find_one_and_update(
+        {
+            "user_id": user_id,
+            "key": key,
+            "fingerprint": fingerprint,
+            "status": "pending",
+            "created_at": {"$lt": now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}
+        },
+        {"$set": {"created_at": now}}
+    )
+    return taken is not None
+
+
+async def run_idempotent(
+    db, user_id: str, key: str, body: dict, handler: Callable[[], Awaitable[dict]]
+) -> Tuple[dict, bool]:
+    """Run `handler` once per (user, key); returns (response, replayed)."""
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+    fingerprint = request_fingerprint(body)
+    deadline = asyncio.get_running_loop().time() + IDEMPOTENCY_WAIT_SECONDS
+
+    while True:
+        if await _claim(db, user_id, key, fingerprint):
+            break
+        row = await db.idempotency_keys.find_one({"user_id": user_id, "key": key})
+        if row is None:
+            # The first request failed and released the key; claim it ourselves
+            continue
+        if row["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if row["status"] == "done":
+            return row["response"], True
+        if asyncio.get_running_loop().time() >= deadline:
+            raise HTTPException(
+                status_code=409,
+                detail="A request with this Idempotency-Key is still in progress",
+                headers={"Retry-After": "1"}
+            )
+        await asyncio.sleep(POLL_INTERVAL_SECONDS)
+
+    try:
+        response = await handler()
+    except BaseException:
+        await db.idempotency_keys.delete_one({"user_id": user_id, "key": key, "status": "pending"})
+        raise
+    await db.idempotency_keys.update_one(
+        {"user_id": user_id, "key": key},
+        {"$set": {"status": "done", "response": response, "completed_at": datetime.utcnow()}}
+    )
+    return response, False
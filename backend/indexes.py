@@ -0,0 +1,178 @@
+"""
+Declarative MongoDB index registry.
+
+Every query shape the API issues should be backed by an index listed here.
+`ensure_indexes` applies the registry idempotently (it runs at API startup),
+and `index_report` compares it with what the server actually has.
+
+Usage:
+    python indexes.py           # create missing indexes
+    python indexes.py --check   # report missing / extra / building indexes
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from idempotency import IDEMPOTENCY_KEY_TTL_HOURS
+from password_resets import RESET_TOKEN_EXPIRE_MINUTES, purge_legacy_reset_tokens
+from reservations import RESERVATION_TTL_GRACE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Server error codes for an existing index with the same keys but other options
+INDEX_CONFLICT_CODES = (85, 86)
+
+# collection -> list of (keys, options)
+INDEXES = {
+    "users": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("role", ASCENDING)], {}),
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("tokens_valid_after", ASCENDING)], {"sparse": True}),
+    ],
+    "products": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("category", ASCENDING), ("name", ASCENDING)], {}),
+        ([("brand", ASCENDING), ("name", ASCENDING)], {}),
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("stock_shards", ASCENDING)], {"sparse": True}),
+    ],
+    "stock_shards": [
+        ([("product_id", ASCENDING)], {}),
+    ],
+    "inventory_ledger": [
+        ([("product_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("order_id", ASCENDING)], {"sparse": True}),
+    ],
+    "carts": [
+        ([("user_id", ASCENDING)], {"unique": True}),
+    ],
+    "orders": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("driver_id", ASCENDING), ("status", ASCENDING), ("created_at", DESCENDING)], {}),
+        ([("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+        ([("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "addresses": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("user_id", ASCENDING), ("created_at", DESCENDING)], {}),
+    ],
+    "refresh_tokens": [
+        ([("token_hash", ASCENDING)], {"unique": True}),
+        ([("family_id", ASCENDING)], {}),
+        ([("user_id", ASCENDING)], {}),
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "password_resets": [
+        ([("token_hash", ASCENDING)], {"unique": True}),
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("created_at", ASCENDING)], {"expireAfterSeconds": RESET_TOKEN_EXPIRE_MINUTES * 60}),
+    ],
+    "reservations": [
+        ([("user_id", ASCENDING), ("product_id", ASCENDING)], {"unique": True}),
+        ([("release_id", ASCENDING)], {}),
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": RESERVATION_TTL_GRACE_SECONDS}),
+    ],
+    # Product stock leases are left behind once expired; drop them eventually
+    "leases": [
+        ([("expires_at", ASCENDING)], {"expireAfterSeconds": 86400}),
+    ],
+    "idempotency_keys": [
+        ([("user_id", ASCENDING), ("key", ASCENDING)], {"unique": True}),
+        ([("created_at", ASCENDING)], {"expireAfterSeconds": IDEMPOTENCY_KEY_TTL_HOURS * 3600}),
+    ],
+}
+
+
+def index_name(keys) -> str:
+    """Return the default name MongoDB gives an index with these keys."""
+    return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+
+async def ensure_indexes(db) -> dict:
+    """Create every registered index that does not exist yet.
+
+    Safe to run repeatedly. TTL changes are applied in place with collMod;
+    other conflicts and failed unique builds are logged and reported
+    instead of aborting startup.
+    """
+    errors = {}
+    for collection, specs in INDEXES.items():
+        for keys, options in specs:
+            name = index_name(keys)
+            try:
+                await db[collection].create_indexes([IndexModel(keys, name=name, **options)])
+            except OperationFailure as e:
+                if e.code in INDEX_CONFLICT_CODES and "expireAfterSeconds" in options:
+                    await db.command(
+                        "collMod", collection,
+                        index={"name": name, "expireAfterSeconds": options["expireAfterSeconds"]}
+                    )
+                    continue
+                logger.error("Could not create index %s.%s: %s", collection, name, e)
+                errors[f"{collection}.{name}"] = str(e)
+    return errors
+
+
+async def _building_indexes(db) -> list:
+    """Return in-progress index builds on this database."""
+    try:
+        ops = await db.client.admin.aggregate([
+            {"$currentOp": {"allUsers": True}},
+            {"$match": {"ns": {"$regex": f"^{db.name}\\."}, "command.createIndexes": {"$exists": True}}}
+        ]).to_list(None)
+    except OperationFailure:
+        # Needs the inprog privilege; report nothing rather than fail.
+        return []
+    building = []
+    for op in ops:
+        collection = op["command"]["createIndexes"]
+        for index in op["command"].get("indexes", []):
+            building.append(f"{collection}.{index.get('name')}")
+    return building
+
+
+async def index_report(db) -> dict:
+    """Compare the registry with the server's indexes."""
+    existing_collections = set(await db.list_collection_names())
+    missing, extra = [], []
+    for collection, specs in INDEXES.items():
+        declared = {index_name(keys) for keys, _ in specs}
+        existing = set()
+        if collection in existing_collections:
+            existing = set((await db[collection].index_information()).keys()) - {"_id_"}
+        missing += [f"{collection}.{name}" for name in sorted(declared - existing)]
+        extra += [f"{collection}.{name}" for name in sorted(existing - declared)]
+    return {"missing": missing, "extra": extra, "building": await _building_indexes(db)}
+
+
+async def main(check_only: bool) -> int:
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if not check_only:
+            print("🗂  Applying index registry...")
+            await purge_legacy_reset_tokens(db)
+            errors = await ensure_indexes(db)
+            for index, error in errors.items():
+                print(f"❌ {index}: {error}")
+        report = await index_report(db)
+        print(json.dumps(report, indent=2))
+        return 1 if report["missing"] else 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(check_only="--check" in sys.argv)))
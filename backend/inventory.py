@@ -0,0 +1,376 @@
+"""Sharded stock counters for hot products, and the inventory ledger.
+
+Every checkout for a product decrements the same `products.stock` field,
+so at peak, checkouts for one best-selling product queue up on a single
+document. A hot product can instead spread part of its stock over N
+`stock_shards` documents (`products.stock_shards = N`). Checkout takes
+units from a random shard with a guarded `$inc`, gathers them from
+several shards when one isn't enough, and takes only the rest from the
+product's own `stock` (the pool), so concurrent checkouts mostly touch
+different documents and any quantity the pool and shards hold together
+can be sold.
+
+Compaction runs every INVENTORY_COMPACT_SECONDS, in one worker at a time
+(see leases.py). It drains every shard back into `products.stock` and
+then re-splits the pool, leaving one share in the pool for reservations
+and large orders. Between compactions, a hot product's true stock is
+`stock` plus its shards; `add_sharded_stock` folds that in for reads.
+
+Compaction, resharding, a reservation refilling the pool and an admin
+setting the stock all move units
+between the pool and the shards in several writes, so each holds the
+product's stock lease while it runs and, on a replica set, writes in one
+transaction. On a standalone mongod a crash midway can still lose the
+units in flight; run a replica set in production.
+
+Every sale and every move between pool and shards is appended to
+`inventory_ledger`, double-entry style: each row's `delta` is the change
+to one `counter` ("pool" or a shard id), so summing a product's rows by
+counter shows where its units went. Rows are never updated, so writing
+them causes no contention.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+import random
+
+from pymongo import UpdateOne
+
+from cache import TTLCache
+from database import transactions_enabled
+from leases import LeaseBusyError, acquire_lease, hold_lease
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_COMPACT_SECONDS = float(os.environ.get("INVENTORY_COMPACT_SECONDS", "30"))
+MAX_STOCK_SHARDS = 64
+# Longest a compaction or stock update may hold a product's stock lease
+STOCK_LEASE_SECONDS = 30
+# How long an admin stock change waits for a running compaction
+STOCK_LEASE_WAIT_SECONDS = 5
+
+# product_id -> shard count (0 = not sharded). A stale entry is harmless: a
+# missing shard just sends checkout to the pool.
+shard_count_cache = TTLCache(maxsize=4096, ttl=float(os.environ.get("SHARD_COUNT_CACHE_TTL_SECONDS", "30")))
+
+
+def shard_id(product_id: str, shard: int) -> str:
+    return f"{product_id}:{shard}"
+
+
+def stock_lease(product_id: str) -> str:
+    return f"stock:{product_id}"
+
+
+async def _atomically(db, write):
+    """Run write(session) in a transaction where the deployment supports them."""
+    if not await transactions_enabled(db.client):
+        return await write(None)
+    async with await db.client.start_session() as session:
+        return await session.with_transaction(write)
+
+
+async def shard_counts(db, product_ids: List[str]) -> Dict[str, int]:
+    """Shard count per product, from the cache where possible."""
+    counts = {}
+    missing = []
+    for pid in product_ids:
+        cached = shard_count_cache.get(pid)
+        if cached is None:
+            missing.append(pid)
+        else:
+            counts[pid] = cached
+    if missing:
+        found = await db.products.find(
+            {"id": {"$in": missing}}, {"_id": 0, "id": 1, "stock_shards": 1}
+        ).to_list(len(missing))
+        by_id = {p["id"]: p.get("stock_shards", 0) for p in found}
+        for pid in missing:
+            counts[pid] = by_id.get(pid, 0)
+            shard_count_cache.set(pid, counts[pid])
+    return counts
+
+
+async def _gather_from_shards(db, product_id: str, quantity: int, session=None) -> Dict[str, int]:
+    """Take up to `quantity` units from whichever shards hold some; returns {shard_id: units}."""
+    parts = {}
+    shards = await db.stock_shards.find(
+        {"product_id": product_id, "available": {"$gt": 0}}, {"_id": 1, "available": 1}, session=session
+    ).to_list(None)
+    random.shuffle(shards)
+    for shard in shards:
+        units = min(shard["available"], quantity)
+        result = await db.stock_shards.update_one(
+            {"_id": shard["_id"], "available": {"$gte": units}},
+            {"$inc": {"available": -units}},
+            session=session
+        )
+        if result.modified_count:
+            parts[shard["_id"]] = units
+            quantity -= units
+            if not quantity:
+                break
+    return parts
+
+
+async def take_from_shards(db, quantities: Dict[str, int], counts: Dict[str, int],
+                           session=None) -> Dict[str, Dict[str, int]]:
+    """Take as much of each sharded product's quantity from its shards as they hold.
+
+    Returns {product_id: {shard_id: units}}. One random shard is tried for
+    the whole quantity first; if it can't cover it, units are gathered
+    from several shards. Whatever the shards don't cover
+    (`pool_quantities`) must come from the pool.
+    """
+    taken = {}
+    for pid, qty in quantities.items():
+        shards = counts.get(pid, 0)
+        if not shards or qty <= 0:
+            continue
+        target = shard_id(pid, random.randrange(shards))
+        result = await db.stock_shards.update_one(
+            {"_id": target, "available": {"$gte": qty}},
+            {"$inc": {"available": -qty}},
+            session=session
+        )
+        parts = {target: qty} if result.modified_count else await _gather_from_shards(db, pid, qty, session)
+        if parts:
+            taken[pid] = parts
+    return taken
+
+
+def pool_quantities(quantities: Dict[str, int], taken: Dict[str, Dict[str, int]]) -> Dict[str, int]:
+    """Units of each product the shards didn't cover."""
+    remaining = {pid: qty - sum(taken.get(pid, {}).values()) for pid, qty in quantities.items()}
+    return {pid: qty for pid, qty in remaining.items() if qty > 0}
+
+
+async def return_to_shards(db, taken: Dict[str, Dict[str, int]]):
+    """Undo take_from_shards for an order that could not be placed."""
+    ops = [
+        UpdateOne({"_id": target}, {"$inc": {"available": units}})
+        for parts in taken.values() for target, units in parts.items()
+    ]
+    if ops:
+        await db.stock_shards.bulk_write(ops, ordered=False)
+
+
+def sale_entries(order_id: str, quantities: Dict[str, int], taken: Dict[str, Dict[str, int]]) -> List[dict]:
+    """Ledger rows for an order's stock decrements, one per shard or pool it came from."""
+    now = datetime.utcnow()
+    pool = pool_quantities(quantities, taken)
+    sources = [
+        (pid, counter, units)
+        for pid in quantities
+        for counter, units in [*taken.get(pid, {}).items(), ("pool", pool.get(pid, 0))]
+        if units
+    ]
+    return [
+        {
+            "product_id": pid,
+            "delta": -units,
+            "reason": "sale",
+            "order_id": order_id,
+            "counter": counter,
+            "created_at": now
+        }
+        for pid, counter, units in sources
+    ]
+
+
+async def add_sharded_stock(db, products: List[dict]) -> List[dict]:
+    """Add units held in shards to `stock` for sharded products, in one query."""
+    sharded = [p["id"] for p in products if p.get("stock_shards")]
+    if not sharded:
+        return products
+    totals = await db.stock_shards.aggregate([
+        {"$match": {"product_id": {"$in": sharded}}},
+        {"$group": {"_id": "$product_id", "available": {"$sum": "$available"}}}
+    ]).to_list(None)
+    in_shards = {row["_id"]: row["available"] for row in totals}
+    for product in products:
+        if product.get("stock_shards"):
+            product["stock"] = product.get("stock", 0) + in_shards.get(product["id"], 0)
+    return products
+
+
+def _move_entries(product_id: str, reason: str, units: int, source: str, target: str) -> List[dict]:
+    """Ledger rows for moving `units` from one counter to another."""
+    now = datetime.utcnow()
+    return [
+        {"product_id": product_id, "delta": -units, "reason": reason, "counter": source, "created_at": now},
+        {"product_id": product_id, "delta": units, "reason": reason, "counter": target, "created_at": now},
+    ]
+
+
+async def _drain(db, product_id: str, session=None) -> List[dict]:
+    """Move every shard's units back into products.stock; returns the ledger rows."""
+    entries = []
+    shards = await db.stock_shards.find({"product_id": product_id}, {"_id": 1}, session=session).to_list(None)
+    for shard in shards:
+        before = await db.stock_shards.find_one_and_update(
+            {"_id": shard["_id"], "available": {"$gt": 0}}, {"$set": {"available": 0}}, session=session
+        )
+        if before:
+            await db.products.update_one(
+                {"id": product_id}, {"$inc": {"stock": before["available"]}}, session=session
+            )
+            entries += _move_entries(product_id, "shard_drain", before["available"], shard["_id"], "pool")
+    return entries
+
+
+async def _split(db, product_id: str, shards: int, session=None) -> List[dict]:
+    """Spread the pool over `shards` counters, keeping one share back; returns the ledger rows."""
+    product = await db.products.find_one({"id": product_id}, {"_id": 0, "stock": 1, "reserved": 1}, session=session)
+    free = (product or {}).get("stock", 0) - (product or {}).get("reserved", 0)
+    # One share stays in the pool for reservations and orders larger than a shard
+    per_shard = max(free, 0) // (shards + 1)
+    if not per_shard:
+        return []
+    taken = await db.products.update_one(
+        {"id": product_id, "$expr": {"$gte": [
+            {"$subtract": ["$stock", {"$ifNull": ["$reserved", 0]}]}, per_shard * shards
+        ]}},
+        {"$inc": {"stock": -per_shard * shards}},
+        session=session
+    )
+    if not taken.modified_count:
+        return []
+    await db.stock_shards.bulk_write([
+        UpdateOne(
+            {"_id": shard_id(product_id, n)},
+            {"$inc": {"available": per_shard}, "$setOnInsert": {"product_id": product_id, "shard": n}},
+            upsert=True
+        )
+        for n in range(shards)
+    ], ordered=False, session=session)
+    entries = []
+    for n in range(shards):
+        entries += _move_entries(product_id, "shard_allot", per_shard, "pool", shard_id(product_id, n))
+    return entries
+
+
+def _moved(entries: List[dict], reason: str) -> int:
+    """Units moved by the ledger rows for `reason`."""
+    return sum(e["delta"] for e in entries if e["reason"] == reason and e["delta"] > 0)
+
+
+async def _compact(db, product_id: str, session=None) -> dict:
+    product = await db.products.find_one({"id": product_id}, {"_id": 0, "stock_shards": 1}, session=session)
+    shards = (product or {}).get("stock_shards", 0)
+    entries = await _drain(db, product_id, session)
+    if shards:
+        entries += await _split(db, product_id, shards, session)
+    if entries:
+        await db.inventory_ledger.insert_many(entries, session=session)
+    return {"drained": _moved(entries, "shard_drain"), "allotted": _moved(entries, "shard_allot")}
+
+
+async def refill_pool(db, product_id: str, units: int) -> int:
+    """Move up to `units` from the product's shards into the pool; returns the units moved.
+
+    Reservations are counted against the pool only, so a hold larger than
+    the pool's share pulls the difference back from the shards first.
+    Raises LeaseBusyError if the stock lease stays taken.
+    """
+    async def write(session):
+        parts = await _gather_from_shards(db, product_id, units, session)
+        if not parts:
+            return 0
+        moved = sum(parts.values())
+        await db.products.update_one({"id": product_id}, {"$inc": {"stock": moved}}, session=session)
+        entries = []
+        for target, count in parts.items():
+            entries += _move_entries(product_id, "pool_refill", count, target, "pool")
+        await db.inventory_ledger.insert_many(entries, session=session)
+        return moved
+
+    async with hold_lease(db, stock_lease(product_id), STOCK_LEASE_SECONDS, wait=STOCK_LEASE_WAIT_SECONDS):
+        return await _atomically(db, write)
+
+
+async def compact_product(db, product_id: str, wait: float = STOCK_LEASE_WAIT_SECONDS) -> dict:
+    """Fold shard units into products.stock, then split the pool across shards again.
+
+    Raises LeaseBusyError if the product's stock lease stays taken for `wait` seconds.
+    """
+    async with hold_lease(db, stock_lease(product_id), STOCK_LEASE_SECONDS, wait=wait):
+        return await _atomically(db, lambda session: _compact(db, product_id, session))
+
+
+async def set_product_stock(db, product_id: str, fields: dict):
+    """Apply an admin product update that sets `stock` to a new total.
+
+    Shard units are pulled back first so they aren't counted on top of the
+    new figure; the next compaction spreads the stock out again.
+    """
+    async def write(session):
+        entries = await _drain(db, product_id, session)
+        before = await db.products.find_one_and_update(
+            {"id": product_id}, {"$set": fields}, projection={"_id": 0, "stock": 1}, session=session
+        )
+        if before and fields["stock"] != before.get("stock", 0):
+            entries.append({
+                "product_id": product_id,
+                "delta": fields["stock"] - before.get("stock", 0),
+                "reason": "adjustment",
+                "counter": "pool",
+                "created_at": datetime.utcnow()
+            })
+        if entries:
+            await db.inventory_ledger.insert_many(entries, session=session)
+
+    async with hold_lease(db, stock_lease(product_id), STOCK_LEASE_SECONDS, wait=STOCK_LEASE_WAIT_SECONDS):
+        await _atomically(db, write)
+
+
+async def delete_product(db, product_id: str) -> bool:
+    """Delete a product and its shards; False if it didn't exist."""
+    async with hold_lease(db, stock_lease(product_id), STOCK_LEASE_SECONDS, wait=STOCK_LEASE_WAIT_SECONDS):
+        result = await db.products.delete_one({"id": product_id})
+        await db.stock_shards.delete_many({"product_id": product_id})
+    return result.deleted_count > 0
+
+
+async def set_stock_shards(db, product_id: str, shards: int) -> dict:
+    """Turn sharding on (shards > 0), resize it, or turn it off (0) for a product."""
+    async def write(session):
+        await db.products.update_one({"id": product_id}, {"$set": {"stock_shards": shards}}, session=session)
+        # Drain everything first so removed shards don't keep units
+        entries = await _drain(db, product_id, session)
+        # Empty shards beyond the new count go; any refilled meanwhile are drained next compaction
+        await db.stock_shards.delete_many(
+            {"product_id": product_id, "shard": {"$gte": shards}, "available": 0}, session=session
+        )
+        if shards:
+            entries += await _split(db, product_id, shards, session)
+        if entries:
+            await db.inventory_ledger.insert_many(entries, session=session)
+        return {"drained": _moved(entries, "shard_drain"), "allotted": _moved(entries, "shard_allot")}
+
+    async with hold_lease(db, stock_lease(product_id), STOCK_LEASE_SECONDS, wait=STOCK_LEASE_WAIT_SECONDS):
+        moved = await _atomically(db, write)
+    # Only once the new count is stored, so a failed change never routes checkout to missing shards
+    shard_count_cache.set(product_id, shards)
+    return moved
+
+
+async def run_compaction_loop(db, interval: float = INVENTORY_COMPACT_SECONDS):
+    """Compact every sharded product forever, every `interval` seconds, in one worker."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # Whichever worker holds the job lease compacts; it outlives the sleep so the leader keeps it
+            if not await acquire_lease(db, "inventory_compaction", interval * 3):
+                continue
+            hot = await db.products.find({"stock_shards": {"$gt": 0}}, {"_id": 0, "id": 1}).to_list(None)
+            for product in hot:
+                try:
+                    await compact_product(db, product["id"], wait=0)
+                except LeaseBusyError:
+                    # An admin is changing this product's stock; catch it next round
+                    continue
+        except Exception:
+            logger.exception("Inventory compaction failed")
@@ -0,0 +1,63 @@
+"""Time-limited leases stored in Mongo.
+
+A lease is a `leases` document {_id: name, owner, expires_at}. Taking it
+is one find_one_and_update that only matches while the lease is free,
+expired or already ours; when another owner holds it, the upsert hits the
+unique _id and fails. A holder that crashes simply lets its lease expire.
+
+Background loops take a lease named after the job with this process as
+owner, so only one worker runs the job; the others keep checking and take
+over when the leader stops renewing.
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+import asyncio
+import os
+import socket
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+# Identifies this process as a lease owner for background jobs
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+LEASE_POLL_SECONDS = 0.05
+
+
+class LeaseBusyError(Exception):
+    """Raised when a lease is still held by someone else after waiting."""
+
+
+async def acquire_lease(db, name: str, seconds: float, owner: str = WORKER_ID) -> bool:
+    """Take or renew the lease for `seconds`; False if another owner holds it."""
+    now = datetime.utcnow()
+    try:
+        await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+async def release_lease(db, name: str, owner: str = WORKER_ID):
+    await db.leases.delete_one({"_id": name, "owner": owner})
+
+
+@asynccontextmanager
+async def hold_lease(db, name: str, seconds: float, wait: float = 0):
+    """Hold a lease for one operation, waiting up to `wait` seconds for it.
+
+    Raises LeaseBusyError if it can't be taken in time.
+    """
+    owner = str(uuid.uuid4())
+    deadline = asyncio.get_running_loop().time() + wait
+    while not await acquire_lease(db, name, seconds, owner):
+        if asyncio.get_running_loop().time() >= deadline:
+            raise LeaseBusyError(name)
+        await asyncio.sleep(LEASE_POLL_SECONDS)
+    try:
+        yield
+    finally:
+        await release_lease(db, name, owner)
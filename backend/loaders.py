@@ -0,0 +1,70 @@
+"""Request-scoped batch loaders.
+
+Order listings show customer details for every row. Looking each customer
+up individually costs one round trip per order (N+1). A loader collects
+the distinct ids and fetches them with one `$in` query, then serves
+repeat lookups within the same request from memory.
+
+Orders now carry a customer snapshot taken at checkout, so the loader is
+only consulted for orders created before snapshots existed.
+"""
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import Depends
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from dependencies import get_db
+
+# Only what order views display; never the password hash
+CUSTOMER_PROJECTION = {"_id": 0, "id": 1, "name": 1, "email": 1, "role": 1, "address": 1, "state": 1, "language": 1}
+
+
+class UserLoader:
+    """Batches user lookups by id for the lifetime of one request."""
+
+    def __init__(self, db: AsyncIOMotorDatabase, projection: dict = CUSTOMER_PROJECTION):
+        self._db = db
+        self._projection = projection
+        self._cache: Dict[str, Optional[dict]] = {}
+        self.queries = 0
+
+    async def load_many(self, user_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Return {user_id: user_doc or None}, fetching unseen ids in one query."""
+        wanted = {user_id for user_id in user_ids if user_id}
+        missing = [user_id for user_id in wanted if user_id not in self._cache]
+        if missing:
+            docs = await self._db.users.find(
+                {"id": {"$in": missing}}, self._projection
+            ).to_list(len(missing))
+            self.queries += 1
+            for user_id in missing:
+                self._cache[user_id] = None
+            for doc in docs:
+                self._cache[doc["id"]] = doc
+        return {user_id: self._cache[user_id] for user_id in wanted}
+
+    async def load(self, user_id: str) -> Optional[dict]:
+        """Return a single user document or None."""
+        return (await self.load_many([user_id])).get(user_id)
+
+
+def customer_snapshot(user: Optional[dict], phone: Optional[str] = None) -> Optional[dict]:
+    """Compact customer details as stored on an order."""
+    if not user:
+        return None
+    return {"id": user["id"], "name": user.get("name"), "email": user.get("email"), "phone": phone}
+
+
+async def order_customers(orders: List[dict], loader: UserLoader) -> List[Optional[dict]]:
+    """Customer details for each order, from its snapshot or, failing that, from users."""
+    legacy = [order["user_id"] for order in orders if not order.get("customer")]
+    users = await loader.load_many(legacy) if legacy else {}
+    return [
+        order.get("customer") or customer_snapshot(users.get(order["user_id"]), order.get("phone"))
+        for order in orders
+    ]
+
+
+def get_user_loader(db: AsyncIOMotorDatabase = Depends(get_db)) -> UserLoader:
+    """FastAPI dependency: a fresh loader per request."""
+    return UserLoader(db)
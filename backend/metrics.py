@@ -0,0 +1,35 @@
+"""Lightweight in-process metrics helpers."""
+from collections import deque
+import threading
+
+
+class LatencyStats:
+    """Rolling latency recorder (milliseconds) with count, mean, max and p95."""
+
+    def __init__(self, window: int = 1024):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float):
+        """Record one observation."""
+        with self._lock:
+            self._samples.append(elapsed_ms)
+            self.count += 1
+            self.total_ms += elapsed_ms
+            if elapsed_ms > self.max_ms:
+                self.max_ms = elapsed_ms
+
+    def stats(self) -> dict:
+        """Return a summary of recorded observations."""
+        with self._lock:
+            samples = sorted(self._samples)
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))] if samples else 0.0
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p95_ms": round(p95, 3),
+            "max_ms": round(self.max_ms, 3),
+        }
@@ -0,0 +1,108 @@
+"""
+Convert ISO-string timestamps to native BSON datetimes.
+
+Older documents stored `created_at` / `updated_at` as ISO strings. They
+sort as text, can't back TTL indexes or date-range queries, and needed a
+`fromisoformat` per row on every read. This migration rewrites them in
+batches with one bulk_write per chunk. Progress is checkpointed in the
+`migrations` collection, so an interrupted run resumes where it stopped.
+
+Usage:
+    python migrate_datetimes.py [--batch-size 1000]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# collection -> timestamp fields that may still hold strings
+TIMESTAMP_FIELDS = {
+    "users": ["created_at"],
+    "products": ["created_at"],
+    "orders": ["created_at"],
+    "addresses": ["created_at"],
+    "carts": ["updated_at"],
+}
+
+
+def parse_timestamp(value: str):
+    """Parse an ISO string to a naive UTC datetime, or None if unparseable."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+async def migrate_field(db, collection: str, field: str, batch_size: int) -> int:
+    """Convert one field across a collection, resuming from the last checkpoint."""
+    checkpoint_id = f"datetimes:{collection}.{field}"
+    checkpoint = await db.migrations.find_one({"_id": checkpoint_id})
+    last_id = checkpoint.get("last_id") if checkpoint else None
+    converted = 0
+
+    while True:
+        query = {field: {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = await db[collection].find(query, {"_id": 1, field: 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+
+        ops = []
+        for doc in docs:
+            parsed = parse_timestamp(doc[field])
+            if parsed is not None:
+                # Guard on the old value so concurrent writes are not clobbered
+                ops.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: parsed}}))
+        if ops:
+            result = await db[collection].bulk_write(ops, ordered=False)
+            converted += result.modified_count
+
+        last_id = docs[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        print(f"   {collection}.{field}: {converted} converted so far")
+
+    await db.migrations.update_one(
+        {"_id": checkpoint_id},
+        {"$set": {"completed_at": datetime.utcnow()}},
+        upsert=True
+    )
+    return converted
+
+
+async def migrate_datetimes(batch_size: int):
+    """Run the migration over every registered collection and field."""
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        for collection, fields in TIMESTAMP_FIELDS.items():
+            for field in fields:
+                converted = await migrate_field(db, collection, field, batch_size)
+                print(f"✅ {collection}.{field}: {converted} documents converted")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert ISO-string timestamps to BSON datetimes")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("🕒 Migrating timestamps to native datetimes...")
+    print("=" * 50)
+    asyncio.run(migrate_datetimes(args.batch_size))
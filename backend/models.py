@@ -26,6 +26,12 @@ class User(UserBase):
     role: Literal["client", "driver", "admin"] = "client"
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class TokenUser(BaseModel):
+    """Identity carried in signed access token claims."""
+    id: str
+    name: str
+    role: Literal["client", "driver", "admin"]
+
 class UserResponse(UserBase):
     id: str
     role: str
@@ -39,9 +45,14 @@ class ResetPasswordRequest(BaseModel):
     reset_token: str
     new_password: str
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 class TokenResponse(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    expires_in: int  # access token lifetime in seconds
+    refresh_token: str
     user: UserResponse
 
 # Product Models
@@ -83,6 +94,15 @@ class Cart(CartBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class CartOperation(BaseModel):
+    op: Literal["set", "add", "remove"]
+    product_id: str
+    size: str = "medium"
+    quantity: int = Field(1, ge=1, le=1000)  # Absolute for "set", increment for "add"; ignored for "remove"
+
+class CartPatchRequest(BaseModel):
+    operations: List[CartOperation] = Field(..., min_length=1, max_length=50)
+
 class CartResponse(BaseModel):
     id: str
     items: List[CartItem]
@@ -99,8 +119,16 @@ class OrderItem(BaseModel):
     size: str
     price: int  # XAF
 
+class CustomerSnapshot(BaseModel):
+    """Customer details copied onto an order at checkout."""
+    id: str
+    name: str
+    email: str
+    phone: Optional[str] = None
+
 class OrderBase(BaseModel):
     user_id: str
+    customer: Optional[CustomerSnapshot] = None
     items: List[OrderItem]
     subtotal: int  # XAF
     delivery_fee: int = 3500  # 3,500 FCFA
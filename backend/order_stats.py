@@ -0,0 +1,193 @@
+"""Order statistics for the admin and driver dashboards.
+
+Per-status counters and order values are kept in a single `stats`
+document and updated with atomic $inc whenever an order is created or
+changes status. The dashboard then needs only one point read, however many
+orders exist. A periodic reconciliation recomputes the document from
+`orders` to correct any drift (e.g. a crash between two writes). It runs
+in one worker at a time and only writes if no counter update landed while
+it was counting.
+
+The figures are eventually consistent. An order write and its counter
+$inc are two separate writes. If a recount reads the order between them,
+and its snapshot is written before the $inc lands, that order is
+counted twice. This applies to a new order or to a status change. The
+window is the gap between the two writes, normally milliseconds. The
+error lasts until the next reconciliation, at most
+STATS_RECONCILE_SECONDS. Admin dashboards can be briefly off by the few
+orders caught that way; nothing reads the counters for decisions.
+"""
+from datetime import datetime
+from typing import Optional
+import asyncio
+import logging
+import os
+
+from pymongo.errors import DuplicateKeyError
+
+from leases import acquire_lease
+
+logger = logging.getLogger(__name__)
+
+STATS_DOC_ID = "orders"
+STATS_RECONCILE_SECONDS = float(os.environ.get("STATS_RECONCILE_SECONDS", "300"))
+STATS_RECONCILE_ATTEMPTS = 5
+
+ORDER_STATUSES = ["en_attente", "en_preparation", "en_livraison", "livree", "annulee", "echouee"]
+
+# Dashboard key for each status, as read by AdminDashboard.js
+STATUS_KEYS = {
+    "en_attente": "pending",
+    "en_preparation": "preparing",
+    "en_livraison": "delivering",
+    "livree": "delivered",
+    "annulee": "cancelled",
+    "echouee": "failed",
+}
+
+# One pass over orders: count per status, plus order value per status.
+# Only the "livree" value is reported, as revenue.
+ORDER_STATS_PIPELINE = [
+    {"$group": {"_id": "$status", "count": {"$sum": 1}, "value": {"$sum": "$total"}}}
+]
+
+
+IN_PROGRESS_STATUSES = ["en_attente", "en_preparation", "en_livraison"]
+
+
+async def aggregate_order_counts(db, match: Optional[dict] = None) -> dict:
+    """Return {status: {"count", "value"}} for every status, in one aggregation.
+
+    `match` narrows the orders first, e.g. {"driver_id": ...}, which the
+    (driver_id, status, created_at) index serves.
+    """
+    pipeline = ([{"$match": match}] if match else []) + ORDER_STATS_PIPELINE
+    rows = await db.orders.aggregate(pipeline).to_list(None)
+    counts = {status: {"count": 0, "value": 0} for status in ORDER_STATUSES}
+    for row in rows:
+        if row["_id"] is None:
+            continue
+        counts[row["_id"]] = {"count": row["count"], "value": row["value"]}
+    return counts
+
+
+def format_stats(counts: dict, users: int, products: int) -> dict:
+    """Shape per-status counters into the /api/admin/stats response."""
+    orders = {"total": sum(c["count"] for c in counts.values())}
+    for status, key in STATUS_KEYS.items():
+        orders[key] = counts.get(status, {}).get("count", 0)
+    return {
+        "orders": orders,
+        "users": users,
+        "products": products,
+        "revenue": counts.get("livree", {}).get("value", 0)
+    }
+
+
+def format_driver_stats(counts: dict) -> dict:
+    """Shape a driver's per-status counters into the /api/driver/stats response."""
+    return {
+        "total_assigned": sum(c["count"] for c in counts.values()),
+        "delivered": counts["livree"]["count"],
+        "failed": counts["echouee"]["count"],
+        "in_progress": sum(counts[status]["count"] for status in IN_PROGRESS_STATUSES),
+        "total_delivered_value": counts["livree"]["value"]
+    }
+
+
+async def compute_admin_stats(db) -> dict:
+    """Build dashboard stats with the order aggregation and counts run concurrently."""
+    counts, users, products = await asyncio.gather(
+        aggregate_order_counts(db),
+        db.users.estimated_document_count(),
+        db.products.estimated_document_count(),
+    )
+    return format_stats(counts, users, products)
+
+
+async def record_order_created(db, status: str, total: int):
+    """Count a newly created order."""
+    await db.stats.update_one(
+        {"_id": STATS_DOC_ID},
+        {"$inc": {f"counts.{status}": 1, f"values.{status}": total, "version": 1}},
+        upsert=True
+    )
+
+
+async def record_status_change(db, old_status: str, new_status: str, total: int):
+    """Move an order's count and value from one status bucket to another."""
+    if old_status == new_status:
+        return
+    await db.stats.update_one(
+        {"_id": STATS_DOC_ID},
+        {"$inc": {
+            f"counts.{old_status}": -1,
+            f"values.{old_status}": -total,
+            f"counts.{new_status}": 1,
+            f"values.{new_status}": total,
+            "version": 1,
+        }},
+        upsert=True
+    )
+
+
+async def reconcile_order_stats(db, attempts: int = STATS_RECONCILE_ATTEMPTS) -> dict:
+    """Recompute the stats document from the orders collection.
+
+    The write only applies if no counter update landed since the
+    aggregation started (every $inc bumps `version`), so the recount never
+    wipes out a concurrent change; a lost race re-runs the aggregation.
+    An order the aggregation already saw, whose $inc only lands after this
+    write, is counted twice until the next round (see the module docstring).
+    """
+    for _ in range(attempts):
+        current = await db.stats.find_one({"_id": STATS_DOC_ID}, {"version": 1})
+        version = (current or {}).get("version")
+        counts = await aggregate_order_counts(db)
+        doc = {
+            "counts": {status: c["count"] for status, c in counts.items()},
+            "values": {status: c["value"] for status, c in counts.items()},
+            "reconciled_at": datetime.utcnow(),
+            "version": (version or 0) + 1
+        }
+        if current is None:
+            try:
+                await db.stats.insert_one({"_id": STATS_DOC_ID, **doc})
+                return doc
+            except DuplicateKeyError:
+                continue
+        # {"version": None} also matches a document written before versioning
+        result = await db.stats.update_one({"_id": STATS_DOC_ID, "version": version}, {"$set": doc})
+        if result.modified_count:
+            return doc
+    logger.warning("Order stats reconciliation kept losing to concurrent updates; will retry next round")
+    return doc
+
+
+async def read_admin_stats(db) -> dict:
+    """Build dashboard stats from the counters document with a single point read."""
+    doc, users, products = await asyncio.gather(
+        db.stats.find_one({"_id": STATS_DOC_ID}),
+        db.users.estimated_document_count(),
+        db.products.estimated_document_count(),
+    )
+    if doc is None or "reconciled_at" not in doc:
+        doc = await reconcile_order_stats(db)
+
+    counts = {
+        status: {"count": doc["counts"].get(status, 0), "value": doc.get("values", {}).get(status, 0)}
+        for status in set(ORDER_STATUSES) | set(doc["counts"])
+    }
+    return format_stats(counts, users, products)
+
+
+async def run_reconciliation_loop(db, interval: float = STATS_RECONCILE_SECONDS):
+    """Reconcile the stats document forever, every `interval` seconds, in one worker."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # The lease outlives the sleep, so the worker that has it keeps it
+            if await acquire_lease(db, "order_stats_reconcile", interval * 3):
+                await reconcile_order_stats(db)
+        except Exception:
+            logger.exception("Order stats reconciliation failed")
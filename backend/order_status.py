@@ -0,0 +1,120 @@
+"""Order status transitions, applied with compare-and-set.
+
+Each transition is one conditional `find_one_and_update`: the filter only
+matches while the order is still in a status that may move to the new
+one, so two drivers, or an admin and a driver, can never both apply a
+transition from the same starting status. The update returns the order
+as it was, which gives the previous status for the stats counters; the
+new document is that plus the fields just set.
+
+When the update matches nothing, one read tells the caller why: the order
+is gone (404), it is already in the requested status (a no-op), the
+transition is not allowed (400), or someone else moved the order first
+(409).
+"""
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from order_stats import record_status_change
+
+# A driver only moves an order forward along the delivery flow
+DRIVER_TRANSITIONS: Dict[str, List[str]] = {
+    "en_attente": ["en_preparation"],
+    "en_preparation": ["en_livraison"],
+    "en_livraison": ["livree", "echouee"],
+}
+
+# Admins also step orders back, cancel them, and reopen finished ones
+ADMIN_TRANSITIONS: Dict[str, List[str]] = {
+    "en_attente": ["en_preparation", "annulee"],
+    "en_preparation": ["en_attente", "en_livraison", "annulee"],
+    "en_livraison": ["en_preparation", "livree", "echouee", "annulee"],
+    # Reopen edges
+    "livree": ["en_attente"],
+    "annulee": ["en_attente", "en_preparation"],
+    "echouee": ["en_attente", "en_preparation", "en_livraison"],
+}
+
+
+# Set by the driver on a failed delivery; cleared when the order leaves "echouee"
+FAILURE_FIELDS = ("failure_reason", "failure_details")
+
+
+def sources_for(new_status: str, transitions: Dict[str, List[str]]) -> List[str]:
+    """Statuses from which `new_status` may be reached."""
+    return [status for status, targets in transitions.items() if new_status in targets]
+
+
+async def transition_order(
+    db,
+    query: dict,
+    new_status: str,
+    transitions: Dict[str, List[str]],
+    expected_status: Optional[str] = None,
+    extra: Optional[dict] = None,
+    not_found: str = "Order not found"
+) -> dict:
+    """Move the order matching `query` to `new_status`; returns the updated order.
+
+    With `expected_status` (the status the client last saw) the update only
+    applies if the order is still in that status; otherwise it applies from
+    any status allowed to move to `new_status`.
+    """
+    sources = sources_for(new_status, transitions)
+    if expected_status == new_status:
+        # Nothing to write; the read below reports a no-op or a conflict
+        sources = []
+    elif expected_status is not None:
+        if expected_status not in sources:
+            raise _invalid(expected_status, new_status, transitions)
+        sources = [expected_status]
+
+    fields = {"status": new_status, **(extra or {})}
+    update = {"$set": fields}
+    if new_status != "echouee":
+        update["$unset"] = {field: "" for field in FAILURE_FIELDS}
+    before = await db.orders.find_one_and_update(
+        {**query, "status": {"$in": sources}},
+        update,
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is not None:
+        await record_status_change(db, before["status"], new_status, before["total"])
+        updated = {**before, **fields}
+        for field in update.get("$unset", {}):
+            updated.pop(field, None)
+        return updated
+
+    current = await db.orders.find_one(query, {"_id": 0})
+    if current is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    if current["status"] == new_status:
+        # Already there (e.g. a retried request); nothing to change
+        return current
+    if expected_status is not None and current["status"] != expected_status:
+        raise _conflict(current["status"])
+    if new_status not in transitions.get(current["status"], []):
+        raise _invalid(current["status"], new_status, transitions)
+    # Allowed from where it is now, so it moved between our write and our read
+    raise _conflict(current["status"])
+
+
+def _invalid(current_status: str, new_status: str, transitions: Dict[str, List[str]]) -> HTTPException:
+    allowed = transitions.get(current_status, [])
+    return HTTPException(
+        status_code=400,
+        detail=f"Cannot change status from '{current_status}' to '{new_status}'. Allowed: {allowed}"
+    )
+
+
+def _conflict(current_status: str) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail={
+            "message": "Order status changed, please refresh",
+            "current_status": current_status
+        }
+    )
@@ -0,0 +1,110 @@
+"""Keyset (cursor) pagination for admin listings.
+
+Pages are ordered by (created_at desc, id desc) and continue from an
+opaque cursor that encodes the last row's sort key. Each page is a single
+index range scan, so page 500 costs the same as page 1, unlike skip/limit.
+Total counts are optional and cached briefly, since an exact count of a
+large collection on every page load is as slow as the skip it replaces.
+"""
+from datetime import datetime
+from typing import Optional, Tuple, Union
+import base64
+import json
+import os
+
+from fastapi import HTTPException
+
+from cache import TTLCache
+
+COUNT_CACHE_TTL_SECONDS = float(os.environ.get("COUNT_CACHE_TTL_SECONDS", "30"))
+count_cache = TTLCache(maxsize=256, ttl=COUNT_CACHE_TTL_SECONDS)
+
+KEYSET_SORT = [("created_at", -1), ("id", -1)]
+MAX_PAGE_SIZE = 200
+
+# created_at types a listing can hold, in descending sort order: BSON sorts
+# dates above strings, and strings above null/missing. Rows the datetime
+# migration hasn't reached yet keep ISO strings.
+CREATED_AT_KINDS = ["date", "string", "null"]
+_LOWER_KIND_FILTERS = {
+    "string": {"created_at": {"$type": "string"}},
+    "null": {"created_at": None},
+}
+
+
+def _created_at_kind(value) -> str:
+    if isinstance(value, datetime):
+        return "date"
+    if isinstance(value, str):
+        return "string"
+    if value is None:
+        return "null"
+    raise HTTPException(
+        status_code=500,
+        detail=f"Cannot paginate past a created_at of type {type(value).__name__}"
+    )
+
+
+def encode_cursor(doc: dict) -> str:
+    """Build an opaque cursor pointing just after `doc`."""
+    created_at = doc.get("created_at")
+    kind = _created_at_kind(created_at)
+    value = created_at.isoformat() if kind == "date" else created_at
+    payload = json.dumps([kind, value, doc["id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, Union[datetime, str, None], str]:
+    """Decode a cursor produced by encode_cursor into (kind, created_at, id)."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(base64.urlsafe_b64decode(padded))
+        if len(parts) == 2:
+            # Cursors issued before the kind was encoded always held a date
+            parts = ["date", *parts]
+        kind, created_at, doc_id = parts
+        if kind == "date":
+            created_at = datetime.fromisoformat(created_at)
+        elif kind not in CREATED_AT_KINDS:
+            raise ValueError(kind)
+        return kind, created_at, str(doc_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after_cursor(kind: str, created_at, doc_id: str) -> list:
+    """$or clauses matching every row that sorts after the cursor."""
+    clauses = [{"created_at": created_at, "id": {"$lt": doc_id}}]
+    if kind != "null":
+        clauses.insert(0, {"created_at": {"$lt": created_at}})
+    # Range operators only compare within a type, so lower types are listed explicitly
+    for lower in CREATED_AT_KINDS[CREATED_AT_KINDS.index(kind) + 1:]:
+        clauses.append(_LOWER_KIND_FILTERS[lower])
+    return clauses
+
+
+async def paginate(collection, query: dict, projection: dict, limit: int, cursor: Optional[str] = None):
+    """Return (docs, next_cursor) for one page of `collection` matching `query`."""
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    page_query = dict(query)
+    if cursor:
+        page_query["$or"] = _after_cursor(*decode_cursor(cursor))
+
+    # Fetch one extra row to learn whether another page exists
+    docs = await collection.find(page_query, projection).sort(KEYSET_SORT).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1])
+    return docs, next_cursor
+
+
+async def cached_count(collection, query: dict) -> int:
+    """Count matching documents, reusing a recent result for the same query."""
+    key = (collection.name, json.dumps(query, sort_keys=True, default=str))
+    total = count_cache.get(key)
+    if total is None:
+        total = await collection.count_documents(query)
+        count_cache.set(key, total)
+    return total
@@ -0,0 +1,50 @@
+"""Password reset tokens.
+
+Only a SHA-256 digest of each reset token is stored. Documents carry a
+native `created_at` datetime covered by a TTL index, so Mongo drops stale
+tokens on its own. Redeeming a token is a single `find_one_and_delete` on
+the unique `token_hash` index, so a token cannot be used twice.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+import os
+import uuid
+
+from auth import hash_secret_token
+
+RESET_TOKEN_EXPIRE_MINUTES = int(os.environ.get("RESET_TOKEN_EXPIRE_MINUTES", "60"))
+
+
+async def purge_legacy_reset_tokens(db):
+    """Delete rows from before hashing; they hold plaintext tokens and never expire."""
+    await db.password_resets.delete_many({"token_hash": {"$exists": False}})
+
+
+async def create_reset_token(db, email: str, user_id: str) -> str:
+    """Issue a reset token for a user, replacing any outstanding one."""
+    reset_token = str(uuid.uuid4())
+    await db.password_resets.replace_one(
+        {"email": email},
+        {
+            "email": email,
+            "user_id": user_id,
+            "token_hash": hash_secret_token(reset_token),
+            "created_at": datetime.utcnow()
+        },
+        upsert=True
+    )
+    return reset_token
+
+
+async def consume_reset_token(db, email: str, reset_token: str) -> Optional[dict]:
+    """Atomically redeem a reset token, returning its document if it was valid."""
+    # The TTL monitor only runs once a minute, so check freshness here too.
+    oldest = datetime.utcnow() - timedelta(minutes=RESET_TOKEN_EXPIRE_MINUTES)
+    return await db.password_resets.find_one_and_delete(
+        {
+            "token_hash": hash_secret_token(reset_token),
+            "email": email,
+            "created_at": {"$gt": oldest}
+        },
+        projection={"_id": 0, "user_id": 1}
+    )
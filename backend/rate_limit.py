@@ -0,0 +1,118 @@
+"""In-process token-bucket throttling for the credential endpoints.
+
+Every login or registration attempt costs a full bcrypt round, so a
+credential-stuffing burst turns directly into CPU load. These limiters run
+before any database or hashing work and reject over-budget callers with a
+429. State is a bounded LRU of (tokens, last_refill) pairs per key.
+"""
+from collections import OrderedDict
+from typing import Optional
+import math
+import os
+import time
+
+from fastapi import HTTPException, Request, status
+
+AUTH_EMAIL_BURST = int(os.environ.get("AUTH_EMAIL_BURST", "10"))
+AUTH_EMAIL_REFILL_PER_MINUTE = float(os.environ.get("AUTH_EMAIL_REFILL_PER_MINUTE", "5"))
+AUTH_IP_BURST = int(os.environ.get("AUTH_IP_BURST", "100"))
+AUTH_IP_REFILL_PER_MINUTE = float(os.environ.get("AUTH_IP_REFILL_PER_MINUTE", "60"))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "50000"))
+# Only enable behind a proxy that appends to X-Forwarded-For; otherwise clients can forge it
+RATE_LIMIT_TRUST_PROXY = os.environ.get("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+# Proxies in front of the API; each appends the address it received from
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "1"))
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets held in a size-bounded LRU."""
+
+    def __init__(self, capacity: int, refill_per_second: float, max_keys: int):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+
+    def try_acquire(self, key: str) -> float:
+        """Take one token for `key`.
+
+        Returns 0 if the call is allowed, otherwise the number of seconds
+        until a token becomes available.
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [float(self.capacity), now]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed += 1
+            return 0.0
+
+        self.rejected += 1
+        if self.refill_per_second <= 0:
+            return 60.0
+        return (1 - bucket[0]) / self.refill_per_second
+
+    def stats(self) -> dict:
+        """Return counters for monitoring."""
+        return {
+            "keys": len(self._buckets),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+        }
+
+
+email_limiter = TokenBucketLimiter(
+    AUTH_EMAIL_BURST, AUTH_EMAIL_REFILL_PER_MINUTE / 60, RATE_LIMIT_MAX_KEYS
+)
+ip_limiter = TokenBucketLimiter(
+    AUTH_IP_BURST, AUTH_IP_REFILL_PER_MINUTE / 60, RATE_LIMIT_MAX_KEYS
+)
+
+
+def get_client_ip(request: Request) -> str:
+    """Client address, honouring X-Forwarded-For behind trusted proxies.
+
+    Entries left of the ones our proxies appended come from the client and
+    can be anything, so the address is taken TRUSTED_PROXY_COUNT hops from
+    the right.
+    """
+    peer = request.client.host if request.client else "unknown"
+    if RATE_LIMIT_TRUST_PROXY and TRUSTED_PROXY_COUNT > 0:
+        forwarded = request.headers.get("x-forwarded-for")
+        hops = [hop.strip() for hop in forwarded.split(",")] if forwarded else []
+        if len(hops) >= TRUSTED_PROXY_COUNT and hops[-TRUSTED_PROXY_COUNT]:
+            return hops[-TRUSTED_PROXY_COUNT]
+    return peer
+
+
+def check_auth_rate_limit(request: Request, email: Optional[str]):
+    """Raise 429 if this IP or email has exhausted its credential budget."""
+    retry_after = ip_limiter.try_acquire(get_client_ip(request))
+    if not retry_after and email:
+        retry_after = email_limiter.try_acquire(email.lower())
+    if retry_after:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+
+def rate_limit_stats() -> dict:
+    """Return limiter counters; each rejection is one bcrypt round not spent."""
+    return {
+        "ip": ip_limiter.stats(),
+        "email": email_limiter.stats(),
+        "hashes_saved": ip_limiter.rejected + email_limiter.rejected,
+    }
@@ -0,0 +1,76 @@
+"""Rotating refresh tokens.
+
+Access tokens are short-lived and verified statelessly. Refresh tokens are
+opaque random strings; only their SHA-256 digest is stored, in a
+TTL-indexed `refresh_tokens` collection. Every refresh consumes the
+presented token and issues a new one in the same family. Presenting an
+already-rotated token is treated as theft, and the whole family is revoked.
+"""
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+import os
+import secrets
+import uuid
+
+from auth import hash_secret_token
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+
+async def issue_refresh_token(db, user_id: str, family_id: Optional[str] = None) -> str:
+    """Create and store a new refresh token, returning the plaintext value."""
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    await db.refresh_tokens.insert_one({
+        "token_hash": hash_secret_token(token),
+        "user_id": user_id,
+        "family_id": family_id or str(uuid.uuid4()),
+        "revoked": False,
+        "created_at": now,
+        "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    })
+    return token
+
+
+async def rotate_refresh_token(db, token: str) -> Optional[Tuple[str, str, str, datetime]]:
+    """Consume a refresh token and issue its successor.
+
+    Returns (user_id, new_refresh_token, family_id, issued_at of the consumed
+    token), or None if the token is unknown, expired or has already been used.
+    """
+    token_hash = hash_secret_token(token)
+    now = datetime.utcnow()
+    doc = await db.refresh_tokens.find_one_and_update(
+        {"token_hash": token_hash, "revoked": False, "expires_at": {"$gt": now}},
+        {"$set": {"revoked": True, "rotated_at": now}},
+        projection={"_id": 0, "user_id": 1, "family_id": 1, "created_at": 1}
+    )
+    if doc is None:
+        # Reuse of a rotated token: revoke every descendant of that login.
+        reused = await db.refresh_tokens.find_one(
+            {"token_hash": token_hash, "revoked": True},
+            {"_id": 0, "family_id": 1}
+        )
+        if reused:
+            await revoke_refresh_family(db, reused["family_id"])
+        return None
+
+    new_token = await issue_refresh_token(db, doc["user_id"], doc["family_id"])
+    return doc["user_id"], new_token, doc["family_id"], doc["created_at"]
+
+
+async def revoke_refresh_family(db, family_id: str):
+    """Delete every token descended from one login."""
+    await db.refresh_tokens.delete_many({"family_id": family_id})
+
+
+async def revoke_refresh_token(db, token: str):
+    """Log out one session: delete the presented token's whole family."""
+    doc = await db.refresh_tokens.find_one({"token_hash": hash_secret_token(token)}, {"_id": 0, "family_id": 1})
+    if doc:
+        await revoke_refresh_family(db, doc["family_id"])
+
+
+async def revoke_user_refresh_tokens(db, user_id: str):
+    """Delete every refresh token belonging to a user."""
+    await db.refresh_tokens.delete_many({"user_id": user_id})
@@ -0,0 +1,237 @@
+"""Time-boxed stock reservations.
+
+When a customer starts checkout, stock for each product in their cart is
+held for RESERVATION_MINUTES. A product's `reserved` counter tracks the
+units on hold, and available stock is `stock - reserved`. A hold is taken
+with one guarded `$inc`, so two customers can never hold the same unit.
+Holds only count against the pool (`stock`), so for a sharded product
+(see inventory.py) a hold the pool can't cover first moves the missing
+units back from the shards. Each hold is also a row in `reservations`,
+one per (user, product).
+
+Expired holds are released in bulk, by one worker at a time (see
+leases.py). The release job tags the expired rows, subtracts their
+quantities from `reserved` with one bulk_write, and then deletes them.
+Product reads and cart validation show `stock - reserved`. Checkout turns
+a user's holds into stock decrements in the same bulk_write that places
+the order (see checkout.py). Without a transaction it first claims the
+holds the same way, so a hold expiring mid-checkout is never subtracted
+from `reserved` twice.
+
+A TTL index on `expires_at`, with a generous grace period, removes rows
+the release job somehow missed. After each release round the same worker
+runs `reconcile_reserved`, which repairs counters that stay out of line
+with the remaining rows, e.g. after a crash between a hold's two writes.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List
+import asyncio
+import logging
+import os
+import uuid
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from inventory import refill_pool
+from leases import LeaseBusyError, acquire_lease
+
+logger = logging.getLogger(__name__)
+
+RESERVATION_MINUTES = int(os.environ.get("RESERVATION_MINUTES", "10"))
+RESERVATION_RELEASE_SECONDS = float(os.environ.get("RESERVATION_RELEASE_SECONDS", "60"))
+# TTL backstop only; the release loop frees holds long before this
+RESERVATION_TTL_GRACE_SECONDS = int(os.environ.get("RESERVATION_TTL_GRACE_SECONDS", "3600"))
+
+
+def available_at_least(quantity: int, held: int = 0) -> dict:
+    """Query clause: stock not held by others covers `quantity`, counting `held` of our own."""
+    return {"$expr": {"$gte": [
+        {"$add": [{"$subtract": ["$stock", {"$ifNull": ["$reserved", 0]}]}, held]},
+        quantity
+    ]}}
+
+
+def available_stock(product: dict, held: int = 0) -> int:
+    """Units a customer can buy: stock not held by others, plus `held` of their own."""
+    return product.get("stock", 0) - product.get("reserved", 0) + held
+
+
+def with_available_stock(products: List[dict]) -> List[dict]:
+    """Show customers only the stock nobody is holding."""
+    for product in products:
+        product["stock"] = max(available_stock(product), 0)
+        product.pop("reserved", None)
+    return products
+
+
+async def _reserve_units(db, product_id: str, quantity: int) -> bool:
+    result = await db.products.update_one(
+        {"id": product_id, **available_at_least(quantity)},
+        {"$inc": {"reserved": quantity}}
+    )
+    return result.modified_count > 0
+
+
+async def _hold(db, user_id: str, product_id: str, quantity: int, expires_at: datetime) -> bool:
+    if not await _reserve_units(db, product_id, quantity):
+        # Holds live in the pool; a sharded product may have the rest in its shards
+        product = await db.products.find_one(
+            {"id": product_id}, {"_id": 0, "stock": 1, "reserved": 1, "stock_shards": 1}
+        )
+        if not product or not product.get("stock_shards"):
+            return False
+        missing = quantity - available_stock(product)
+        try:
+            if missing > 0:
+                await refill_pool(db, product_id, missing)
+        except LeaseBusyError:
+            return False
+        if not await _reserve_units(db, product_id, quantity):
+            return False
+    try:
+        await db.reservations.insert_one({
+            "user_id": user_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "release_id": None,
+            "created_at": datetime.utcnow(),
+            "expires_at": expires_at
+        })
+    except DuplicateKeyError:
+        # A concurrent reserve for the same user won; give our units back
+        await db.products.update_one({"id": product_id}, {"$inc": {"reserved": -quantity}})
+        return False
+    return True
+
+
+async def _release(db, query: dict) -> int:
+    """Release every unclaimed hold matching `query`; returns holds released."""
+    release_id = str(uuid.uuid4())
+    claimed = await db.reservations.update_many(
+        {**query, "release_id": None}, {"$set": {"release_id": release_id}}
+    )
+    if claimed.modified_count == 0:
+        return 0
+
+    totals = await db.reservations.aggregate([
+        {"$match": {"release_id": release_id}},
+        {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}}
+    ]).to_list(None)
+    if totals:
+        await db.products.bulk_write([
+            UpdateOne({"id": row["_id"]}, {"$inc": {"reserved": -row["quantity"]}})
+            for row in totals
+        ], ordered=False)
+    await db.reservations.delete_many({"release_id": release_id})
+    return claimed.modified_count
+
+
+async def release_user_reservations(db, user_id: str) -> int:
+    """Drop all of a user's holds."""
+    return await _release(db, {"user_id": user_id})
+
+
+async def release_expired_reservations(db) -> int:
+    """Drop every hold past its expiry, in bulk."""
+    return await _release(db, {"expires_at": {"$lt": datetime.utcnow()}})
+
+
+async def reserve_quantities(db, user_id: str, quantities: Dict[str, int],
+                             minutes: int = RESERVATION_MINUTES) -> dict:
+    """Replace the user's holds with holds for `quantities` ({product_id: qty}).
+
+    Products that can't be held in full are left out and listed in
+    `unavailable`; checkout will still try them against free stock.
+    """
+    await release_user_reservations(db, user_id)
+    expires_at = datetime.utcnow() + timedelta(minutes=minutes)
+    product_ids = list(quantities)
+    held = await asyncio.gather(*(
+        _hold(db, user_id, pid, quantities[pid], expires_at) for pid in product_ids
+    ))
+    return {
+        "expires_at": expires_at,
+        "reserved": [{"product_id": pid, "quantity": quantities[pid]} for pid, ok in zip(product_ids, held) if ok],
+        "unavailable": [pid for pid, ok in zip(product_ids, held) if not ok]
+    }
+
+
+async def held_quantities(db, user_id: str, session=None) -> Dict[str, int]:
+    """The user's unreleased holds as {product_id: qty}."""
+    rows = await db.reservations.find(
+        {"user_id": user_id, "release_id": None}, {"_id": 0, "product_id": 1, "quantity": 1}, session=session
+    ).to_list(None)
+    return {row["product_id"]: row["quantity"] for row in rows}
+
+
+async def claim_held_quantities(db, user_id: str, product_ids: List[str], claim_id: str) -> Dict[str, int]:
+    """Claim the user's unreleased holds on `product_ids` for a checkout, as {product_id: qty}.
+
+    Claimed rows carry `claim_id` as their release_id, so the release job
+    skips them and only the claimer subtracts their units from `reserved`.
+    The claimer then deletes them (order placed) or unclaims them.
+    """
+    await db.reservations.update_many(
+        {"user_id": user_id, "product_id": {"$in": product_ids}, "release_id": None},
+        {"$set": {"release_id": claim_id}}
+    )
+    rows = await db.reservations.find(
+        {"release_id": claim_id}, {"_id": 0, "product_id": 1, "quantity": 1}
+    ).to_list(None)
+    return {row["product_id"]: row["quantity"] for row in rows}
+
+
+async def unclaim_held_quantities(db, claim_id: str):
+    """Hand holds claimed by a failed checkout back to the customer."""
+    await db.reservations.update_many({"release_id": claim_id}, {"$set": {"release_id": None}})
+
+
+async def reconcile_reserved(db, suspects: Dict[str, tuple]) -> Dict[str, tuple]:
+    """Repair `reserved` counters that disagree with the live holds.
+
+    A hold or release changes `reserved` and the `reservations` rows in
+    separate writes, so one look can catch it halfway. A product is only
+    repaired when it showed the same (reserved, held) mismatch last round,
+    and the write only applies if `reserved` still has that value. Returns
+    this round's new mismatches, to pass back in next round.
+    """
+    totals = await db.reservations.aggregate([
+        {"$group": {"_id": "$product_id", "quantity": {"$sum": "$quantity"}}}
+    ]).to_list(None)
+    held = {row["_id"]: row["quantity"] for row in totals}
+    products = await db.products.find(
+        {"$or": [{"id": {"$in": list(held)}}, {"reserved": {"$nin": [0, None]}}]},
+        {"_id": 0, "id": 1, "reserved": 1}
+    ).to_list(None)
+    mismatched = {
+        p["id"]: (p.get("reserved"), held.get(p["id"], 0))
+        for p in products if (p.get("reserved") or 0) != held.get(p["id"], 0)
+    }
+    repairs = [
+        UpdateOne({"id": pid, "reserved": reserved}, {"$set": {"reserved": quantity}})
+        for pid, (reserved, quantity) in mismatched.items() if suspects.get(pid) == (reserved, quantity)
+    ]
+    if repairs:
+        result = await db.products.bulk_write(repairs, ordered=False)
+        if result.modified_count:
+            logger.warning("Repaired reserved stock on %d products", result.modified_count)
+    return {pid: seen for pid, seen in mismatched.items() if suspects.get(pid) != seen}
+
+
+async def run_release_loop(db, interval: float = RESERVATION_RELEASE_SECONDS):
+    """Every `interval` seconds, release expired holds and repair drifted counters, in one worker."""
+    suspects = {}
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # The lease outlives the sleep, so the worker that has it keeps it
+            if not await acquire_lease(db, "reservation_release", interval * 3):
+                suspects = {}
+                continue
+            released = await release_expired_reservations(db)
+            if released:
+                logger.info("Released %d expired stock reservations", released)
+            suspects = await reconcile_reserved(db, suspects)
+        except Exception:
+            logger.exception("Stock reservation release failed")
@@ -0,0 +1,72 @@
+"""In-memory list of users whose older tokens must no longer be accepted.
+
+Role-gated routes authorize from signed token claims, so a demotion or ban
+has to be pushed out some other way. Users carry a `tokens_valid_after`
+timestamp; any token issued before it is rejected. The list is refreshed
+from Mongo every few seconds and only holds cutoffs recent enough to still
+matter for a live token.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+import asyncio
+import os
+import time
+
+from auth import ACCESS_TOKEN_EXPIRE_MINUTES
+
+REVOCATION_REFRESH_SECONDS = float(os.environ.get("REVOCATION_REFRESH_SECONDS", "30"))
+
+
+class RevocationList:
+    """Maps user ids to the time before which their tokens are invalid."""
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._cutoffs: Dict[str, datetime] = {}
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+        self.refreshes = 0
+        self.rejections = 0
+
+    async def refresh_if_stale(self, db):
+        """Reload cutoffs from Mongo if the local copy is older than the interval."""
+        if time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        if self._lock.locked():
+            # Another request is already refreshing; use the current copy.
+            return
+        async with self._lock:
+            since = datetime.utcnow() - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+            docs = await db.users.find(
+                {"tokens_valid_after": {"$gte": since}},
+                {"_id": 0, "id": 1, "tokens_valid_after": 1}
+            ).to_list(None)
+            self._cutoffs = {doc["id"]: doc["tokens_valid_after"] for doc in docs}
+            self._loaded_at = time.monotonic()
+            self.refreshes += 1
+
+    def is_revoked(self, user_id: str, issued_at: Optional[int]) -> bool:
+        """Return True if a token for this user issued at `issued_at` is revoked."""
+        cutoff = self._cutoffs.get(user_id)
+        if cutoff is None:
+            return False
+        if issued_at is None or datetime.utcfromtimestamp(issued_at) < cutoff:
+            self.rejections += 1
+            return True
+        return False
+
+    def add(self, user_id: str, cutoff: datetime):
+        """Record a cutoff locally without waiting for the next refresh."""
+        self._cutoffs[user_id] = cutoff
+
+    def stats(self) -> dict:
+        """Return counters for monitoring."""
+        return {
+            "entries": len(self._cutoffs),
+            "refreshes": self.refreshes,
+            "rejections": self.rejections,
+            "refresh_interval_seconds": self.refresh_interval,
+        }
+
+
+revocation_list = RevocationList(refresh_interval=REVOCATION_REFRESH_SECONDS)
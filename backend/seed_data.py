@@ -171,9 +171,7 @@ async def seed_products():
         products_to_insert = []
         for product_data in SAMPLE_PRODUCTS:
             product = Product(**product_data)
-            product_dict = product.model_dump()
-            product_dict['created_at'] = product_dict['created_at'].isoformat()
-            products_to_insert.append(product_dict)
+            products_to_insert.append(product.model_dump())
         
         result = await db.products.insert_many(products_to_insert)
         print(f"✅ Successfully seeded {len(result.inserted_ids)} products!")
@@ -1,7 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, status, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Header, Query, status, Depends
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import logging
 from pathlib import Path
@@ -9,43 +12,142 @@ from datetime import datetime, timedelta
 from typing import Optional
 import uuid
 
+# Load .env before local modules read their settings from the environment
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
 # Import local modules
 from models import (
     User, UserCreate, UserLogin, UserResponse, 
-    TokenResponse, ForgotPasswordRequest, ResetPasswordRequest,
-    AddToCartRequest, UpdateCartRequest, CheckoutRequest, Order, OrderItem,
-    Address, AddressCreate, AddressUpdate
+    TokenResponse, RefreshTokenRequest, ForgotPasswordRequest, ResetPasswordRequest,
+    AddToCartRequest, UpdateCartRequest, CartPatchRequest, CheckoutRequest, Order, OrderItem,
+    Address, AddressCreate, AddressUpdate, TokenUser, CustomerSnapshot
+)
+from auth import create_access_token, token_cache_stats, ACCESS_TOKEN_EXPIRE_MINUTES
+from hashing import password_hasher, HashQueueFullError
+from rate_limit import check_auth_rate_limit, rate_limit_stats
+from dependencies import (
+    get_current_user, get_token_user, set_database, invalidate_cached_user, revoke_user_tokens, user_cache
+)
+from revocation import revocation_list
+from refresh_tokens import (
+    issue_refresh_token, rotate_refresh_token, revoke_refresh_family, revoke_refresh_token, revoke_user_refresh_tokens
+)
+from password_resets import (
+    purge_legacy_reset_tokens, create_reset_token, consume_reset_token
 )
-from auth import (
-    verify_password, get_password_hash, 
-    create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from indexes import ensure_indexes, index_report
+from database import create_mongo_client, warm_up_pool, pool_listener
+from pagination import MAX_PAGE_SIZE, paginate, cached_count, count_cache
+from carts import (
+    add_cart_item, set_cart_item_quantity, remove_cart_item, apply_cart_operations,
+    reprice_cart_items, cart_totals, CartLineNotFoundError
 )
-from dependencies import get_current_user, set_database
+from checkout import place_order, order_quantities, InsufficientStockError
+from idempotency import run_idempotent
+from inventory import (
+    MAX_STOCK_SHARDS, add_sharded_stock, delete_product, set_product_stock, set_stock_shards, run_compaction_loop
+)
+from leases import LeaseBusyError
+from reservations import reserve_quantities, release_user_reservations, run_release_loop, with_available_stock
+from loaders import UserLoader, get_user_loader, order_customers
+from order_stats import (
+    ORDER_STATUSES, STATUS_KEYS, aggregate_order_counts, format_driver_stats, read_admin_stats, record_order_created, run_reconciliation_loop
+)
+from order_status import ADMIN_TRANSITIONS, DRIVER_TRANSITIONS, transition_order
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection, opened by the lifespan handler
+client: Optional[AsyncIOMotorClient] = None
+db: Optional[AsyncIOMotorDatabase] = None
 
-# Set database for dependencies
-set_database(db)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open and warm the Mongo pool before serving traffic; close it on shutdown."""
+    global client, db
+    client = create_mongo_client(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    
+    # Set database for dependencies
+    set_database(db)
+    
+    await warm_up_pool(client)
+    
+    # Apply the index registry so every query shape is index-backed.
+    # Legacy reset rows must go first or the unique token_hash index fails.
+    await purge_legacy_reset_tokens(db)
+    errors = await ensure_indexes(db)
+    if errors:
+        logger.warning("Index bootstrap incomplete: %s", errors)
+    
+    reconcile_task = asyncio.create_task(run_reconciliation_loop(db))
+    release_task = asyncio.create_task(run_release_loop(db))
+    compaction_task = asyncio.create_task(run_compaction_loop(db))
+    
+    yield
+    
+    reconcile_task.cancel()
+    release_task.cancel()
+    compaction_task.cancel()
+    client.close()
+    password_hasher.shutdown()
 
 # Create the main app without a prefix
-app = FastAPI(title="GAZ MAN API", version="1.0.0")
+app = FastAPI(title="GAZ MAN API", version="1.0.0", lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+@app.exception_handler(HashQueueFullError)
+async def hash_queue_full_handler(request: Request, exc: HashQueueFullError):
+    """Shed load quickly when the password hashing pool is saturated."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server busy, please retry shortly"},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(LeaseBusyError)
+async def lease_busy_handler(request: Request, exc: LeaseBusyError):
+    """A product's stock is being rebalanced; the change can simply be retried."""
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": "Stock is being updated, please retry shortly"},
+        headers={"Retry-After": "1"}
+    )
+
 # ============================================
 # Authentication Endpoints
 # ============================================
 
+async def issue_tokens(user: User, refresh_token: Optional[str] = None) -> TokenResponse:
+    """Create a short-lived access token, plus a refresh token unless one is given."""
+    access_token = create_access_token(
+        data={"sub": user.id, "role": user.role, "name": user.name},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    if refresh_token is None:
+        refresh_token = await issue_refresh_token(db, user.id)
+    
+    user_response = UserResponse(**user.model_dump())
+    return TokenResponse(
+        access_token=access_token,
+        expires_in=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        refresh_token=refresh_token,
+        user=user_response
+    )
+
 @api_router.post("/auth/register", response_model=TokenResponse, status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserCreate):
+async def register(user_data: UserCreate, request: Request):
     """Register a new user."""
+    check_auth_rate_limit(request, user_data.email)
+    
     # Check if user already exists
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
@@ -55,30 +157,24 @@ async def register(user_data: UserCreate):
         )
     
     # Create new user
+    password_hash = await password_hasher.hash(user_data.password)
     user = User(
         **user_data.model_dump(exclude={"password"}),
-        password_hash=get_password_hash(user_data.password),
+        password_hash=password_hash,
         role="client"
     )
     
     # Save to database
-    user_dict = user.model_dump()
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
-    await db.users.insert_one(user_dict)
-    
-    # Create access token
-    access_token = create_access_token(
-        data={"sub": user.id},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
+    await db.users.insert_one(user.model_dump())
     
-    # Return token and user info
-    user_response = UserResponse(**user.model_dump())
-    return TokenResponse(access_token=access_token, user=user_response)
+    # Return tokens and user info
+    return await issue_tokens(user)
 
 @api_router.post("/auth/login", response_model=TokenResponse)
-async def login(credentials: UserLogin):
+async def login(credentials: UserLogin, request: Request):
     """Login user and return JWT token."""
+    check_auth_rate_limit(request, credentials.email)
+    
     # Find user by email
     user_doc = await db.users.find_one({"email": credentials.email}, {"_id": 0})
     if not user_doc:
@@ -90,21 +186,58 @@ async def login(credentials: UserLogin):
     user = User(**user_doc)
     
     # Verify password
-    if not verify_password(credentials.password, user.password_hash):
+    valid, new_hash = await password_hasher.verify_and_update(credentials.password, user.password_hash)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
-    # Create access token
-    access_token = create_access_token(
-        data={"sub": user.id},
-        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    )
+    # Transparently re-hash at the calibrated bcrypt cost
+    if new_hash:
+        await db.users.update_one(
+            {"id": user.id, "password_hash": user.password_hash},
+            {"$set": {"password_hash": new_hash}}
+        )
+        invalidate_cached_user(user.id)
     
-    # Return token and user info
-    user_response = UserResponse(**user.model_dump())
-    return TokenResponse(access_token=access_token, user=user_response)
+    # Return tokens and user info
+    return await issue_tokens(user)
+
+@api_router.post("/auth/refresh", response_model=TokenResponse)
+async def refresh_access_token(request: RefreshTokenRequest):
+    """Exchange a refresh token for a new access token and refresh token."""
+    rotated = await rotate_refresh_token(db, request.refresh_token)
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token"
+        )
+    user_id, refresh_token, family_id, issued_at = rotated
+    
+    user_doc = await db.users.find_one({"id": user_id}, {"_id": 0})
+    if not user_doc:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found"
+        )
+    
+    # A refresh token from before the user's cutoff (role or password change) is revoked too
+    valid_after = user_doc.get("tokens_valid_after")
+    if valid_after and issued_at < valid_after:
+        await revoke_refresh_family(db, family_id)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has been revoked"
+        )
+    
+    return await issue_tokens(User(**user_doc), refresh_token)
+
+@api_router.post("/auth/logout")
+async def logout(request: RefreshTokenRequest):
+    """End a session by revoking its refresh token and every token rotated from it."""
+    await revoke_refresh_token(db, request.refresh_token)
+    return {"message": "Logged out"}
 
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_me(current_user: User = Depends(get_current_user)):
@@ -115,26 +248,13 @@ async def get_me(current_user: User = Depends(get_current_user)):
 async def forgot_password(request: ForgotPasswordRequest):
     """Initiate password reset process."""
     # Check if user exists
-    user_doc = await db.users.find_one({"email": request.email})
+    user_doc = await db.users.find_one({"email": request.email}, {"_id": 0, "id": 1})
     if not user_doc:
         # Don't reveal if email exists or not for security
         return {"message": "If the email exists, a password reset link has been sent"}
     
-    # Generate reset token (in production, this should be time-limited and stored)
-    reset_token = str(uuid.uuid4())
-    
-    # Store reset token in database with expiration
-    await db.password_resets.update_one(
-        {"email": request.email},
-        {
-            "$set": {
-                "reset_token": reset_token,
-                "created_at": None,  # Would be datetime.utcnow().isoformat() in production
-                "used": False
-            }
-        },
-        upsert=True
-    )
+    # Generate a reset token; only its hash is stored, and it expires via TTL index
+    reset_token = await create_reset_token(db, request.email, user_doc["id"])
     
     # In production, send email with reset link
     # For MVP, we'll just return the token
@@ -146,12 +266,11 @@ async def forgot_password(request: ForgotPasswordRequest):
 @api_router.post("/auth/reset-password")
 async def reset_password(request: ResetPasswordRequest):
     """Reset password using reset token."""
-    # Verify reset token
-    reset_doc = await db.password_resets.find_one({
-        "email": request.email,
-        "reset_token": request.reset_token,
-        "used": False
-    })
+    # Hash first: if hashing fails or the pool is full, the token stays usable
+    new_password_hash = await password_hasher.hash(request.new_password)
+    
+    # Verify and consume reset token in one step
+    reset_doc = await consume_reset_token(db, request.email, request.reset_token)
     
     if not reset_doc:
         raise HTTPException(
@@ -160,23 +279,19 @@ async def reset_password(request: ResetPasswordRequest):
         )
     
     # Update user password
-    new_password_hash = get_password_hash(request.new_password)
     result = await db.users.update_one(
-        {"email": request.email},
+        {"id": reset_doc["user_id"]},
         {"$set": {"password_hash": new_password_hash}}
     )
     
-    if result.modified_count == 0:
+    if result.matched_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
-    
-    # Mark token as used
-    await db.password_resets.update_one(
-        {"email": request.email, "reset_token": request.reset_token},
-        {"$set": {"used": True}}
-    )
+    # Sessions opened with the old password end, access tokens included
+    await revoke_user_tokens(db, reset_doc["user_id"])
+    await revoke_user_refresh_tokens(db, reset_doc["user_id"])
     
     return {"message": "Password reset successful"}
 
@@ -204,20 +319,24 @@ async def change_password(
         )
     
     # Verify current password
-    if not verify_password(current_password, user_doc["password_hash"]):
+    if not await password_hasher.verify(current_password, user_doc["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Current password is incorrect"
         )
     
     # Update password
-    new_password_hash = get_password_hash(new_password)
+    new_password_hash = await password_hasher.hash(new_password)
     await db.users.update_one(
         {"id": current_user.id},
         {"$set": {"password_hash": new_password_hash}}
     )
+    # Other sessions end; this one continues with the fresh tokens returned below
+    await revoke_user_tokens(db, current_user.id)
+    await revoke_user_refresh_tokens(db, current_user.id)
     
-    return {"message": "Password changed successfully"}
+    tokens = await issue_tokens(current_user)
+    return {"message": "Password changed successfully", **tokens.model_dump()}
 
 @api_router.get("/environment")
 async def get_environment():
@@ -241,7 +360,7 @@ async def get_products(
     sort_by: Optional[str] = "name",
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
-    limit: int = 50
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)
 ):
     """Get all products with optional filters and sorting."""
     query = {}
@@ -273,13 +392,7 @@ async def get_products(
     
     # Execute query
     products = await db.products.find(query, {"_id": 0}).sort(sort_field, sort_order).limit(limit).to_list(limit)
-    
-    # Convert ISO timestamps to datetime
-    for product in products:
-        if isinstance(product.get('created_at'), str):
-            product['created_at'] = datetime.fromisoformat(product['created_at'])
-    
-    return products
+    return with_available_stock(await add_sharded_stock(db, products))
 
 @api_router.get("/products/{product_id}")
 async def get_product(product_id: str):
@@ -288,10 +401,7 @@ async def get_product(product_id: str):
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    if isinstance(product.get('created_at'), str):
-        product['created_at'] = datetime.fromisoformat(product['created_at'])
-    
-    return product
+    return with_available_stock(await add_sharded_stock(db, [product]))[0]
 
 @api_router.get("/categories")
 async def get_categories():
@@ -319,31 +429,47 @@ async def get_brands():
 # ============================================
 
 @api_router.get("/cart")
-async def get_cart(current_user: User = Depends(get_current_user)):
-    """Get current user's cart with calculated totals."""
-    cart = await db.carts.find_one({"user_id": current_user.id}, {"_id": 0})
+async def get_cart(
+    validate: bool = False,
+    current_user: User = Depends(get_current_user)
+):
+    """Get current user's cart with calculated totals.
     
-    if not cart:
-        return {
-            "id": None,
-            "items": [],
-            "subtotal": 0,
-            "delivery_fee": 3500,
-            "total": 3500
-        }
-    
-    # Calculate totals (all in XAF - integers)
-    subtotal = sum(item["price"] * item["quantity"] for item in cart.get("items", []))
-    delivery_fee = 3500  # 3,500 FCFA
-    total = subtotal + delivery_fee
+    With validate=true, lines are re-priced against current products and
+    the response lists what changed since they were added.
+    """
+    cart = await db.carts.find_one({"user_id": current_user.id}, {"_id": 0})
+    if not validate or not cart or not cart.get("items"):
+        return cart_totals(cart)
     
-    return {
-        "id": cart.get("id"),
-        "items": cart.get("items", []),
-        "subtotal": subtotal,
-        "delivery_fee": delivery_fee,
-        "total": total
-    }
+    items, changes = await reprice_cart_items(db, cart["items"], current_user.id)
+    return {**cart_totals({**cart, "items": items}), "changes": changes}
+
+@api_router.patch("/cart")
+async def patch_cart(
+    request: CartPatchRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Apply a batch of set/add/remove operations in one write and return the updated cart."""
+    operations = [op.model_dump() for op in request.operations]
+    
+    # Product details for any line that may need creating, in one query
+    product_ids = list({op["product_id"] for op in operations if op["op"] == "add"})
+    products = {}
+    if product_ids:
+        found = await db.products.find(
+            {"id": {"$in": product_ids}},
+            {"_id": 0, "id": 1, "name": 1, "image_url": 1, "price": 1}
+        ).to_list(len(product_ids))
+        products = {p["id"]: p for p in found}
+        if len(products) < len(product_ids):
+            raise HTTPException(status_code=404, detail="Product not found")
+    
+    try:
+        cart = await apply_cart_operations(db, current_user.id, operations, products)
+    except CartLineNotFoundError:
+        raise HTTPException(status_code=404, detail="Item not found in cart")
+    return cart_totals(cart)
 
 @api_router.post("/cart/items")
 async def add_to_cart(
@@ -352,56 +478,23 @@ async def add_to_cart(
 ):
     """Add item to cart or update quantity if exists."""
     # Verify product exists
-    product = await db.products.find_one({"id": request.product_id}, {"_id": 0})
+    product = await db.products.find_one(
+        {"id": request.product_id},
+        {"_id": 0, "name": 1, "image_url": 1, "price": 1}
+    )
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get or create cart
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    
-    if not cart:
-        # Create new cart
-        cart_id = str(uuid.uuid4())
-        cart = {
-            "id": cart_id,
-            "user_id": current_user.id,
-            "items": [],
-            "updated_at": datetime.utcnow().isoformat()
-        }
-    
-    # Check if item already exists in cart
-    items = cart.get("items", [])
-    existing_item = None
-    for item in items:
-        if item["product_id"] == request.product_id and item["size"] == request.size:
-            existing_item = item
-            break
-    
-    if existing_item:
-        # Update quantity
-        existing_item["quantity"] += request.quantity
-    else:
-        # Add new item
-        items.append({
-            "product_id": request.product_id,
-            "product_name": product["name"],
-            "product_image": product["image_url"],
-            "quantity": request.quantity,
-            "size": request.size,
-            "price": product["price"]
-        })
-    
-    cart["items"] = items
-    cart["updated_at"] = datetime.utcnow().isoformat()
-    
-    # Upsert cart
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": cart},
-        upsert=True
-    )
+    cart_id = await add_cart_item(db, current_user.id, {
+        "product_id": request.product_id,
+        "product_name": product["name"],
+        "product_image": product["image_url"],
+        "quantity": request.quantity,
+        "size": request.size,
+        "price": product["price"]
+    })
     
-    return {"message": "Item added to cart", "cart_id": cart["id"]}
+    return {"message": "Item added to cart", "cart_id": cart_id}
 
 @api_router.put("/cart/items/{product_id}")
 async def update_cart_item(
@@ -410,33 +503,10 @@ async def update_cart_item(
     current_user: User = Depends(get_current_user)
 ):
     """Update item quantity in cart."""
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    items = cart.get("items", [])
-    item_found = False
-    
-    for item in items:
-        if item["product_id"] == product_id and item["size"] == request.size:
-            if request.quantity <= 0:
-                items.remove(item)
-            else:
-                item["quantity"] = request.quantity
-            item_found = True
-            break
-    
-    if not item_found:
+    found = await set_cart_item_quantity(db, current_user.id, product_id, request.size, request.quantity)
+    if not found:
         raise HTTPException(status_code=404, detail="Item not found in cart")
     
-    cart["items"] = items
-    cart["updated_at"] = datetime.utcnow().isoformat()
-    
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": cart}
-    )
-    
     return {"message": "Cart updated"}
 
 @api_router.delete("/cart/items/{product_id}")
@@ -446,33 +516,34 @@ async def remove_from_cart(
     current_user: User = Depends(get_current_user)
 ):
     """Remove item from cart."""
-    cart = await db.carts.find_one({"user_id": current_user.id})
-    if not cart:
-        raise HTTPException(status_code=404, detail="Cart not found")
-    
-    items = cart.get("items", [])
-    original_length = len(items)
-    items = [item for item in items if not (item["product_id"] == product_id and item["size"] == size)]
-    
-    if len(items) == original_length:
+    found = await remove_cart_item(db, current_user.id, product_id, size)
+    if not found:
         raise HTTPException(status_code=404, detail="Item not found in cart")
     
-    cart["items"] = items
-    cart["updated_at"] = datetime.utcnow().isoformat()
-    
-    await db.carts.update_one(
-        {"user_id": current_user.id},
-        {"$set": cart}
-    )
-    
     return {"message": "Item removed from cart"}
 
 @api_router.delete("/cart")
 async def clear_cart(current_user: User = Depends(get_current_user)):
     """Clear all items from cart."""
     await db.carts.delete_one({"user_id": current_user.id})
+    await release_user_reservations(db, current_user.id)
     return {"message": "Cart cleared"}
 
+@api_router.post("/cart/reserve")
+async def reserve_cart(current_user: User = Depends(get_current_user)):
+    """Hold stock for the cart's products while the customer checks out."""
+    cart = await db.carts.find_one({"user_id": current_user.id}, {"_id": 0, "items": 1})
+    if not cart or not cart.get("items"):
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    
+    return await reserve_quantities(db, current_user.id, order_quantities(cart["items"]))
+
+@api_router.delete("/cart/reserve")
+async def release_cart_reservation(current_user: User = Depends(get_current_user)):
+    """Give back any stock held for the current user."""
+    released = await release_user_reservations(db, current_user.id)
+    return {"message": "Reservation released", "released": released}
+
 # ============================================
 # Order Endpoints
 # ============================================
@@ -480,22 +551,55 @@ async def clear_cart(current_user: User = Depends(get_current_user)):
 @api_router.post("/orders")
 async def create_order(
     checkout_data: CheckoutRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None),
     current_user: User = Depends(get_current_user)
 ):
-    """Create order from cart and clear cart."""
+    """Create order from cart and clear cart.
+    
+    With an Idempotency-Key header, retries of the same checkout return the
+    original response instead of placing a second order.
+    """
+    if idempotency_key is None:
+        return await place_order_from_cart(checkout_data, current_user)
+    
+    result, replayed = await run_idempotent(
+        db, current_user.id, idempotency_key, checkout_data.model_dump(),
+        lambda: place_order_from_cart(checkout_data, current_user)
+    )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+async def place_order_from_cart(checkout_data: CheckoutRequest, current_user: User) -> dict:
+    """Turn the user's cart into an order."""
     # Get cart
     cart = await db.carts.find_one({"user_id": current_user.id}, {"_id": 0})
     if not cart or not cart.get("items"):
         raise HTTPException(status_code=400, detail="Cart is empty")
     
+    # Re-check every line against current products in one query
+    items, changes = await reprice_cart_items(db, cart["items"], current_user.id)
+    if changes:
+        # Store current prices so the customer reviews the real total before retrying
+        await db.carts.update_one(
+            {"user_id": current_user.id, "items": cart["items"]},
+            {"$set": {"items": items, "updated_at": datetime.utcnow()}}
+        )
+        raise HTTPException(status_code=409, detail={
+            "message": "Your cart has changed, please review it",
+            "changes": changes,
+            "cart": cart_totals({**cart, "items": items})
+        })
+    
     # Calculate totals
-    subtotal = sum(item["price"] * item["quantity"] for item in cart["items"])
+    subtotal = sum(item["price"] * item["quantity"] for item in items)
     delivery_fee = 0 if subtotal >= 20000 else 3500
     total = subtotal + delivery_fee
     
     # Create order items with product images
     order_items = []
-    for cart_item in cart["items"]:
+    for cart_item in items:
         order_items.append({
             "product_id": cart_item["product_id"],
             "product_name": cart_item["product_name"],
@@ -508,6 +612,12 @@ async def create_order(
     # Create order
     order = Order(
         user_id=current_user.id,
+        customer=CustomerSnapshot(
+            id=current_user.id,
+            name=current_user.name,
+            email=current_user.email,
+            phone=checkout_data.phone
+        ),
         items=order_items,
         subtotal=subtotal,
         delivery_fee=delivery_fee,
@@ -518,20 +628,12 @@ async def create_order(
         status="en_attente"
     )
     
-    # Save order
-    order_dict = order.model_dump()
-    order_dict['created_at'] = order_dict['created_at'].isoformat()
-    await db.orders.insert_one(order_dict)
-    
-    # Update stock for each product
-    for item in order_items:
-        await db.products.update_one(
-            {"id": item["product_id"]},
-            {"$inc": {"stock": -item["quantity"]}}
-        )
-    
-    # Clear cart
-    await db.carts.delete_one({"user_id": current_user.id})
+    # Decrement stock, save the order and clear the cart atomically
+    try:
+        await place_order(client, db, order.model_dump())
+    except InsufficientStockError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    await record_order_created(db, order.status, total)
     
     return {
         "message": "Order created successfully",
@@ -547,11 +649,6 @@ async def get_orders(current_user: User = Depends(get_current_user)):
         {"_id": 0}
     ).sort("created_at", -1).to_list(100)
     
-    # Convert ISO timestamps
-    for order in orders:
-        if isinstance(order.get('created_at'), str):
-            order['created_at'] = datetime.fromisoformat(order['created_at'])
-    
     return orders
 
 @api_router.get("/orders/{order_id}")
@@ -568,9 +665,6 @@ async def get_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    if isinstance(order.get('created_at'), str):
-        order['created_at'] = datetime.fromisoformat(order['created_at'])
-    
     return order
 
 # ============================================
@@ -613,6 +707,7 @@ async def update_profile(
     
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    invalidate_cached_user(current_user.id)
     
     # Get updated user
     updated_user = await db.users.find_one({"id": current_user.id}, {"_id": 0})
@@ -654,9 +749,7 @@ async def create_address(
         user_id=current_user.id
     )
     
-    address_dict = address.model_dump()
-    address_dict['created_at'] = address_dict['created_at'].isoformat()
-    await db.addresses.insert_one(address_dict)
+    await db.addresses.insert_one(address.model_dump())
     
     return {"message": "Address created successfully", "id": address.id}
 
@@ -774,7 +867,7 @@ async def set_default_address(
 # Admin Endpoints
 # ============================================
 
-async def get_admin_user(current_user: User = Depends(get_current_user)):
+async def get_admin_user(current_user: TokenUser = Depends(get_token_user)):
     """Dependency to verify admin role."""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -784,38 +877,39 @@ async def get_admin_user(current_user: User = Depends(get_current_user)):
 @api_router.get("/admin/orders")
 async def admin_get_orders(
     status: Optional[str] = None,
-    limit: int = 50,
-    skip: int = 0,
-    admin: User = Depends(get_admin_user)
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    admin: TokenUser = Depends(get_admin_user),
+    users: UserLoader = Depends(get_user_loader)
 ):
-    """Get all orders (admin only)."""
+    """Get all orders, newest first, one keyset page at a time (admin only)."""
     query = {}
     if status:
         query["status"] = status
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    total = await db.orders.count_documents(query)
+    orders, next_cursor = await paginate(db.orders, query, {"_id": 0}, limit, cursor)
+    total = await cached_count(db.orders, query) if include_total else None
     
-    # Enrich with user info
-    for order in orders:
-        user = await db.users.find_one({"id": order["user_id"]}, {"_id": 0, "password_hash": 0})
-        order["user"] = user
+    # Customer info comes from the order snapshot; older orders are batch-loaded
+    for order, customer in zip(orders, await order_customers(orders, users)):
+        order["user"] = customer
     
-    return {"orders": orders, "total": total}
+    return {"orders": orders, "total": total, "next_cursor": next_cursor}
 
 @api_router.get("/admin/orders/{order_id}")
 async def admin_get_order(
     order_id: str,
-    admin: User = Depends(get_admin_user)
+    admin: TokenUser = Depends(get_admin_user),
+    users: UserLoader = Depends(get_user_loader)
 ):
     """Get single order details (admin only)."""
     order = await db.orders.find_one({"id": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Enrich with user info
-    user = await db.users.find_one({"id": order["user_id"]}, {"_id": 0, "password_hash": 0})
-    order["user"] = user
+    # Customer info comes from the order snapshot; older orders fall back to users
+    order["user"] = (await order_customers([order], users))[0]
     
     return order
 
@@ -823,30 +917,26 @@ async def admin_get_order(
 async def admin_update_order_status(
     order_id: str,
     status_update: dict,
-    admin: User = Depends(get_admin_user)
+    admin: TokenUser = Depends(get_admin_user)
 ):
     """Update order status (admin only)."""
-    valid_statuses = ["en_attente", "en_preparation", "en_livraison", "livree", "annulee", "echouee"]
     new_status = status_update.get("status")
     
-    if not new_status or new_status not in valid_statuses:
-        raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
+    if not new_status or new_status not in ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {ORDER_STATUSES}")
     
-    result = await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"status": new_status}}
+    await transition_order(
+        db, {"id": order_id}, new_status, ADMIN_TRANSITIONS,
+        expected_status=status_update.get("expected_status")
     )
     
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
     return {"message": "Order status updated", "new_status": new_status}
 
 @api_router.put("/admin/orders/{order_id}/assign-driver")
 async def admin_assign_driver(
     order_id: str,
     assignment: dict,
-    admin: User = Depends(get_admin_user)
+    admin: TokenUser = Depends(get_admin_user)
 ):
     """Assign a driver to an order (admin only)."""
     driver_id = assignment.get("driver_id")
@@ -875,7 +965,7 @@ async def admin_assign_driver(
     return {"message": "Driver assigned to order", "driver": {"id": driver_id, "name": driver["name"]}}
 
 @api_router.get("/admin/drivers")
-async def admin_get_drivers(admin: User = Depends(get_admin_user)):
+async def admin_get_drivers(admin: TokenUser = Depends(get_admin_user)):
     """Get all drivers (admin only)."""
     drivers = await db.users.find(
         {"role": "driver"}, 
@@ -886,19 +976,21 @@ async def admin_get_drivers(admin: User = Depends(get_admin_user)):
 # Admin Products
 @api_router.get("/admin/products")
 async def admin_get_products(
-    limit: int = 50,
-    skip: int = 0,
-    admin: User = Depends(get_admin_user)
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    admin: TokenUser = Depends(get_admin_user)
 ):
-    """Get all products with full details (admin only)."""
-    products = await db.products.find({}, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
-    total = await db.products.count_documents({})
-    return {"products": products, "total": total}
+    """Get all products with full details, newest first (admin only)."""
+    products, next_cursor = await paginate(db.products, {}, {"_id": 0}, limit, cursor)
+    total = await cached_count(db.products, {}) if include_total else None
+    await add_sharded_stock(db, products)
+    return {"products": products, "total": total, "next_cursor": next_cursor}
 
 @api_router.post("/admin/products")
 async def admin_create_product(
     product_data: dict,
-    admin: User = Depends(get_admin_user)
+    admin: TokenUser = Depends(get_admin_user)
 ):
     """Create a new product (admin only)."""
     required_fields = ["name", "brand", "price", "stock", "category"]
@@ -920,7 +1012,7 @@ async def admin_create_product(
         "description": product_data.get("description", ""),
         "rating": product_data.get("rating", 4.5),
         "delivery_time": product_data.get("delivery_time", "15-20 min"),
-        "created_at": datetime.utcnow().isoformat()
+        "created_at": datetime.utcnow()
     }
     
     await db.products.insert_one(product)
@@ -933,7 +1025,7 @@ async def admin_create_product(
 async def admin_update_product(
     product_id: str,
     product_data: dict,
-    admin: User = Depends(get_admin_user)
+    admin: TokenUser = Depends(get_admin_user)
 ):
     """Update a product (admin only)."""
     # Check if product exists
@@ -955,77 +1047,114 @@ async def admin_update_product(
             else:
                 update_fields[field] = product_data[field]
     
-    if update_fields:
+    if "stock" in update_fields:
+        # The new figure is the total; shard units are pulled back so they aren't counted twice
+        await set_product_stock(db, product_id, update_fields)
+    elif update_fields:
         await db.products.update_one({"id": product_id}, {"$set": update_fields})
     
     # Return updated product
     updated = await db.products.find_one({"id": product_id}, {"_id": 0})
-    return {"message": "Product updated", "product": updated}
+    return {"message": "Product updated", "product": (await add_sharded_stock(db, [updated]))[0]}
+
+@api_router.put("/admin/products/{product_id}/stock-shards")
+async def admin_set_stock_shards(
+    product_id: str,
+    shard_data: dict,
+    admin: TokenUser = Depends(get_admin_user)
+):
+    """Spread a hot product's stock over N counters to cut checkout contention; 0 turns it off (admin only)."""
+    try:
+        shards = int(shard_data.get("shards", 0))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="shards must be an integer")
+    if not 0 <= shards <= MAX_STOCK_SHARDS:
+        raise HTTPException(status_code=400, detail=f"shards must be between 0 and {MAX_STOCK_SHARDS}")
+    
+    if not await db.products.find_one({"id": product_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Product not found")
+    
+    result = await set_stock_shards(db, product_id, shards)
+    return {"message": "Stock sharding updated", "shards": shards, **result}
 
 @api_router.delete("/admin/products/{product_id}")
 async def admin_delete_product(
     product_id: str,
-    admin: User = Depends(get_admin_user)
+    admin: TokenUser = Depends(get_admin_user)
 ):
     """Delete a product (admin only)."""
-    result = await db.products.delete_one({"id": product_id})
-    if result.deleted_count == 0:
+    if not await delete_product(db, product_id):
         raise HTTPException(status_code=404, detail="Product not found")
     return {"message": "Product deleted"}
 
 # Admin Users
 @api_router.get("/admin/users")
 async def admin_get_users(
-    limit: int = 50,
-    skip: int = 0,
-    admin: User = Depends(get_admin_user)
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    include_total: bool = True,
+    admin: TokenUser = Depends(get_admin_user)
+):
+    """Get all users, newest first (admin only, read-only)."""
+    users, next_cursor = await paginate(db.users, {}, {"_id": 0, "password_hash": 0}, limit, cursor)
+    total = await cached_count(db.users, {}) if include_total else None
+    return {"users": users, "total": total, "next_cursor": next_cursor}
+
+@api_router.put("/admin/users/{user_id}/role")
+async def admin_update_user_role(
+    user_id: str,
+    role_update: dict,
+    admin: TokenUser = Depends(get_admin_user)
 ):
-    """Get all users (admin only, read-only)."""
-    users = await db.users.find({}, {"_id": 0, "password_hash": 0}).skip(skip).limit(limit).to_list(limit)
-    total = await db.users.count_documents({})
-    return {"users": users, "total": total}
+    """Change a user's role (admin only); their existing tokens stop working."""
+    valid_roles = ["client", "driver", "admin"]
+    new_role = role_update.get("role")
+    
+    if new_role not in valid_roles:
+        raise HTTPException(status_code=400, detail=f"Invalid role. Must be one of: {valid_roles}")
+    if user_id == admin.id:
+        raise HTTPException(status_code=400, detail="You cannot change your own role")
+    
+    result = await db.users.update_one({"id": user_id}, {"$set": {"role": new_role}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Access tokens carry the role as a signed claim, so the old ones must go
+    await revoke_user_tokens(db, user_id)
+    await revoke_user_refresh_tokens(db, user_id)
+    
+    return {"message": "User role updated", "role": new_role}
 
 # Admin Stats
 @api_router.get("/admin/stats")
-async def admin_get_stats(admin: User = Depends(get_admin_user)):
+async def admin_get_stats(admin: TokenUser = Depends(get_admin_user)):
     """Get dashboard statistics (admin only)."""
-    total_orders = await db.orders.count_documents({})
-    pending_orders = await db.orders.count_documents({"status": "en_attente"})
-    preparing_orders = await db.orders.count_documents({"status": "en_preparation"})
-    delivering_orders = await db.orders.count_documents({"status": "en_livraison"})
-    delivered_orders = await db.orders.count_documents({"status": "livree"})
-    cancelled_orders = await db.orders.count_documents({"status": "annulee"})
-    
-    total_users = await db.users.count_documents({})
-    total_products = await db.products.count_documents({})
-    
-    # Calculate revenue from delivered orders
-    pipeline = [
-        {"$match": {"status": "livree"}},
-        {"$group": {"_id": None, "total_revenue": {"$sum": "$total"}}}
-    ]
-    revenue_result = await db.orders.aggregate(pipeline).to_list(1)
-    total_revenue = revenue_result[0]["total_revenue"] if revenue_result else 0
-    
+    return await read_admin_stats(db)
+
+# Admin Metrics
+@api_router.get("/admin/metrics")
+async def admin_get_metrics(admin: TokenUser = Depends(get_admin_user)):
+    """Get in-process performance counters for this worker (admin only)."""
     return {
-        "orders": {
-            "total": total_orders,
-            "pending": pending_orders,
-            "preparing": preparing_orders,
-            "delivering": delivering_orders,
-            "delivered": delivered_orders,
-            "cancelled": cancelled_orders
-        },
-        "users": total_users,
-        "products": total_products,
-        "revenue": total_revenue
+        "user_cache": user_cache.stats(),
+        "token_cache": token_cache_stats(),
+        "revocations": revocation_list.stats(),
+        "password_hashing": password_hasher.stats(),
+        "auth_rate_limit": rate_limit_stats(),
+        "mongo_pool": pool_listener.stats(),
+        "count_cache": count_cache.stats()
     }
 
+@api_router.get("/admin/indexes")
+async def admin_get_indexes(admin: TokenUser = Depends(get_admin_user)):
+    """Report missing, extra and building indexes against the registry (admin only)."""
+    return await index_report(db)
+
 # ============================================
 # Driver Endpoints
 # ============================================
 
-async def get_driver_user(current_user: User = Depends(get_current_user)):
+async def get_driver_user(current_user: TokenUser = Depends(get_token_user)):
     """Dependency to verify driver role."""
     if current_user.role != "driver":
         raise HTTPException(status_code=403, detail="Driver access required")
@@ -1042,53 +1171,42 @@ FAILURE_REASONS = [
 ]
 
 @api_router.get("/driver/failure-reasons")
-async def get_failure_reasons(driver: User = Depends(get_driver_user)):
+async def get_failure_reasons(driver: TokenUser = Depends(get_driver_user)):
     """Get predefined delivery failure reasons."""
     return {"reasons": FAILURE_REASONS}
 
 @api_router.get("/driver/orders")
 async def driver_get_orders(
     status: Optional[str] = None,
-    driver: User = Depends(get_driver_user)
+    driver: TokenUser = Depends(get_driver_user),
+    users: UserLoader = Depends(get_user_loader)
 ):
     """Get orders assigned to the current driver."""
     query = {"driver_id": driver.id}
     if status:
         query["status"] = status
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
+    # Tab counts cover all of the driver's orders, counted server-side
+    orders, counts = await asyncio.gather(
+        db.orders.find(query, {"_id": 0}).sort("created_at", -1).to_list(100),
+        aggregate_order_counts(db, {"driver_id": driver.id})
+    )
     
-    # Enrich with customer info
-    for order in orders:
-        customer = await db.users.find_one(
-            {"id": order["user_id"]}, 
-            {"_id": 0, "password_hash": 0}
-        )
-        if customer:
-            # Only include name and email
-            order["customer"] = {
-                "name": customer.get("name"),
-                "email": customer.get("email")
-            }
-        else:
-            order["customer"] = None
-    
-    # Count by status
-    stats = {
-        "total": len(orders),
-        "pending": len([o for o in orders if o["status"] == "en_attente"]),
-        "preparing": len([o for o in orders if o["status"] == "en_preparation"]),
-        "delivering": len([o for o in orders if o["status"] == "en_livraison"]),
-        "delivered": len([o for o in orders if o["status"] == "livree"]),
-        "failed": len([o for o in orders if o["status"] == "echouee"]),
-    }
+    # Customer info comes from the order snapshot; older orders are batch-loaded
+    for order, customer in zip(orders, await order_customers(orders, users)):
+        order["customer"] = customer
+    
+    stats = {"total": sum(c["count"] for c in counts.values())}
+    for order_status, key in STATUS_KEYS.items():
+        stats[key] = counts[order_status]["count"]
     
     return {"orders": orders, "stats": stats}
 
 @api_router.get("/driver/orders/{order_id}")
 async def driver_get_order(
     order_id: str,
-    driver: User = Depends(get_driver_user)
+    driver: TokenUser = Depends(get_driver_user),
+    users: UserLoader = Depends(get_user_loader)
 ):
     """Get single order details (driver only sees assigned orders)."""
     order = await db.orders.find_one(
@@ -1098,12 +1216,8 @@ async def driver_get_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found or not assigned to you")
     
-    # Enrich with customer info
-    customer = await db.users.find_one(
-        {"id": order["user_id"]}, 
-        {"_id": 0, "password_hash": 0}
-    )
-    order["customer"] = customer
+    # Customer info comes from the order snapshot; older orders fall back to users
+    order["customer"] = (await order_customers([order], users))[0]
     
     return order
 
@@ -1111,36 +1225,14 @@ async def driver_get_order(
 async def driver_update_order_status(
     order_id: str,
     status_update: dict,
-    driver: User = Depends(get_driver_user)
+    driver: TokenUser = Depends(get_driver_user)
 ):
     """Update order status (driver only for assigned orders)."""
-    # Get the current order
-    order = await db.orders.find_one({"id": order_id, "driver_id": driver.id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found or not assigned to you")
-    
-    current_status = order["status"]
     new_status = status_update.get("status")
     failure_reason = status_update.get("failure_reason")
     failure_details = status_update.get("failure_details")
     
-    # Define valid status transitions for drivers
-    valid_transitions = {
-        "en_attente": ["en_preparation"],
-        "en_preparation": ["en_livraison"],
-        "en_livraison": ["livree", "echouee"],
-    }
-    
-    # Check if transition is valid
-    allowed = valid_transitions.get(current_status, [])
-    if new_status not in allowed:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Cannot change status from '{current_status}' to '{new_status}'. Allowed: {allowed}"
-        )
-    
-    # Build update
-    update_data = {"status": new_status}
+    extra = {}
     
     # Handle failure case
     if new_status == "echouee":
@@ -1151,30 +1243,25 @@ async def driver_update_order_status(
         if failure_reason not in valid_reason_codes:
             raise HTTPException(status_code=400, detail=f"Invalid failure reason. Must be one of: {valid_reason_codes}")
         
-        update_data["failure_reason"] = failure_reason
+        extra["failure_reason"] = failure_reason
         if failure_reason == "autre" and failure_details:
-            update_data["failure_details"] = failure_details
-    
-    await db.orders.update_one({"id": order_id}, {"$set": update_data})
+            extra["failure_details"] = failure_details
+    
+    # One conditional write: only applies while the order is in a status the driver may move on from
+    await transition_order(
+        db, {"id": order_id, "driver_id": driver.id}, new_status, DRIVER_TRANSITIONS,
+        expected_status=status_update.get("expected_status"),
+        extra=extra,
+        not_found="Order not found or not assigned to you"
+    )
     
     return {"message": "Order status updated", "new_status": new_status}
 
 @api_router.get("/driver/stats")
-async def driver_get_stats(driver: User = Depends(get_driver_user)):
-    """Get driver statistics."""
-    orders = await db.orders.find({"driver_id": driver.id}, {"_id": 0, "status": 1, "total": 1}).to_list(1000)
-    
-    delivered = [o for o in orders if o["status"] == "livree"]
-    failed = [o for o in orders if o["status"] == "echouee"]
-    in_progress = [o for o in orders if o["status"] in ["en_attente", "en_preparation", "en_livraison"]]
-    
-    return {
-        "total_assigned": len(orders),
-        "delivered": len(delivered),
-        "failed": len(failed),
-        "in_progress": len(in_progress),
-        "total_delivered_value": sum(o["total"] for o in delivered)
-    }
+async def driver_get_stats(driver: TokenUser = Depends(get_driver_user)):
+    """Get driver statistics, counted by a single aggregation over all assigned orders."""
+    counts = await aggregate_order_counts(db, {"driver_id": driver.id})
+    return format_driver_stats(counts)
 
 # ============================================
 # Health Check Endpoints
@@ -1195,14 +1282,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
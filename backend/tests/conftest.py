@@ -0,0 +1,257 @@
+"""
+Shared in-memory stand-ins for Motor collections, used by the unit tests
+that don't need a running MongoDB. They understand just the query and
+update operators the backend uses; pipeline updates are recorded but not
+evaluated.
+"""
+from collections import Counter, namedtuple
+import os
+import sys
+
+import pytest
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+Call = namedtuple("Call", "method query update kwargs")
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def to_list(self, length):
+        return self.docs[:length] if length else self.docs
+
+
+class FakeResult:
+    def __init__(self, matched=0, modified=0, deleted=0):
+        self.matched_count = matched
+        self.modified_count = modified
+        self.deleted_count = deleted
+
+
+def _get(doc, path):
+    for key in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+def _parent(doc, path):
+    *parents, leaf = path.split(".")
+    for key in parents:
+        doc = doc.setdefault(key, {})
+    return doc, leaf
+
+
+def _is_operator(cond):
+    return isinstance(cond, dict) and cond and all(key.startswith("$") for key in cond)
+
+
+def evaluate(doc, expr):
+    """Aggregation expression value, for the arithmetic used in stock guards."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get(doc, expr[1:])
+    if not _is_operator(expr):
+        return expr
+    (op, args), = expr.items()
+    values = [evaluate(doc, arg) for arg in args]
+    if op == "$ifNull":
+        return values[0] if values[0] is not None else values[1]
+    if op == "$add":
+        return sum(values)
+    if op == "$subtract":
+        return values[0] - values[1]
+    if op == "$gte":
+        return values[0] >= values[1]
+    raise NotImplementedError(op)
+
+
+def matches(doc, query):
+    """Whether `doc` matches `query`, for equality and the operators used in the backend."""
+    for field, cond in query.items():
+        if field == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+            continue
+        if field == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+            continue
+        if field == "$expr":
+            if not evaluate(doc, cond):
+                return False
+            continue
+        value = _get(doc, field)
+        if not _is_operator(cond):
+            if value != cond:
+                return False
+            continue
+        for op, arg in cond.items():
+            if op == "$in" and value not in arg:
+                return False
+            if op == "$nin" and value in arg:
+                return False
+            if op == "$ne" and value == arg:
+                return False
+            if op == "$exists" and (value is not None) != arg:
+                return False
+            if op == "$elemMatch" and not any(matches(item, arg) for item in value or []):
+                return False
+            if op in ("$lt", "$lte", "$gt", "$gte"):
+                if value is None:
+                    return False
+                if not {"$lt": value < arg, "$lte": value <= arg, "$gt": value > arg, "$gte": value >= arg}[op]:
+                    return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return dict(doc)
+    included = {key for key, keep in projection.items() if keep}
+    if included:
+        keep = included | ({"_id"} if projection.get("_id", 1) else set())
+        return {key: value for key, value in doc.items() if key in keep}
+    return {key: value for key, value in doc.items() if key not in projection}
+
+
+def apply_update(doc, update, inserting=False):
+    if isinstance(update, list):
+        # Aggregation pipeline updates aren't evaluated
+        return
+    for path, value in update.get("$set", {}).items():
+        target, leaf = _parent(doc, path)
+        target[leaf] = value
+    for path, amount in update.get("$inc", {}).items():
+        target, leaf = _parent(doc, path)
+        target[leaf] = target.get(leaf, 0) + amount
+    for path in update.get("$unset", {}):
+        target, leaf = _parent(doc, path)
+        target.pop(leaf, None)
+    if inserting:
+        for path, value in update.get("$setOnInsert", {}).items():
+            target, leaf = _parent(doc, path)
+            target[leaf] = value
+
+
+class FakeCollection:
+    """In-memory collection recording every call in `log` and counting them in `calls`."""
+
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+        self.calls = Counter()
+        self.log = []
+
+    def _record(self, method, query=None, update=None, **kwargs):
+        self.calls[method] += 1
+        self.log.append(Call(method, query, update, kwargs))
+
+    @property
+    def updates(self):
+        """Update documents passed to the write methods, in order."""
+        return [call.update for call in self.log if call.update is not None]
+
+    def _first(self, query):
+        return next((doc for doc in self.docs if matches(doc, query)), None)
+
+    def apply(self, query, update, upsert=False):
+        """Apply `update` to the first match, synchronously; returns (before, after)."""
+        doc = self._first(query)
+        if doc is not None:
+            before = dict(doc)
+            apply_update(doc, update)
+            return before, doc
+        if not upsert:
+            return None, None
+        doc = {key: value for key, value in query.items() if not key.startswith("$") and not _is_operator(value)}
+        if "_id" in doc and any(d.get("_id") == doc["_id"] for d in self.docs):
+            raise DuplicateKeyError("E11000 duplicate key")
+        apply_update(doc, update, inserting=True)
+        self.docs.append(doc)
+        return None, doc
+
+    def find(self, query, projection=None, session=None):
+        self._record("find", query)
+        return FakeCursor([project(doc, projection) for doc in self.docs if matches(doc, query)])
+
+    async def find_one(self, query, projection=None, session=None):
+        self._record("find_one", query)
+        doc = self._first(query)
+        return project(doc, projection) if doc is not None else None
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        self._record("find_one_and_update", query, update, upsert=upsert, **kwargs)
+        before, after = self.apply(query, update, upsert)
+        result = after if return_document == ReturnDocument.AFTER else before
+        return project(result, projection) if result is not None else None
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        self._record("update_one", query, update, upsert=upsert, **kwargs)
+        before, after = self.apply(query, update, upsert)
+        return FakeResult(matched=int(before is not None), modified=int(after is not None))
+
+    async def update_many(self, query, update, session=None):
+        self._record("update_many", query, update)
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        for doc in matched:
+            apply_update(doc, update)
+        return FakeResult(matched=len(matched), modified=len(matched))
+
+    async def bulk_write(self, requests, ordered=True, session=None):
+        """UpdateOne requests only, applied in order."""
+        modified = 0
+        for request in requests:
+            self._record("bulk_write", request._filter, request._doc, upsert=request._upsert)
+            before, after = self.apply(request._filter, request._doc, request._upsert)
+            modified += int(after is not None)
+        return FakeResult(matched=modified, modified=modified)
+
+    async def insert_one(self, doc, session=None):
+        self._record("insert_one", update=doc)
+        if "_id" in doc and any(d.get("_id") == doc["_id"] for d in self.docs):
+            raise DuplicateKeyError("E11000 duplicate key")
+        self.docs.append(dict(doc))
+
+    async def insert_many(self, docs, session=None):
+        for doc in docs:
+            await self.insert_one(doc)
+
+    async def delete_one(self, query, session=None):
+        self._record("delete_one", query)
+        doc = self._first(query)
+        if doc is not None:
+            self.docs.remove(doc)
+        return FakeResult(deleted=int(doc is not None))
+
+    async def delete_many(self, query, session=None):
+        self._record("delete_many", query)
+        doomed = [doc for doc in self.docs if matches(doc, query)]
+        self.docs = [doc for doc in self.docs if doc not in doomed]
+        return FakeResult(deleted=len(doomed))
+
+    def aggregate(self, pipeline):
+        raise NotImplementedError("Subclass FakeCollection to fake an aggregation")
+
+
+class FakeDb:
+    """Collections by attribute; unnamed ones start empty."""
+
+    def __init__(self, **collections):
+        for name, value in collections.items():
+            setattr(self, name, value if isinstance(value, FakeCollection) else FakeCollection(value))
+
+    def __getattr__(self, name):
+        collection = FakeCollection()
+        setattr(self, name, collection)
+        return collection
+
+
+@pytest.fixture
+def fake_db():
+    """Factory for a FakeDb: fake_db(users=[...], orders=FakeCollection subclass, ...)."""
+    return FakeDb
@@ -7,6 +7,9 @@ import pytest
 import requests
 import os
 import uuid
+from collections import deque
+
+from order_status import ADMIN_TRANSITIONS
 
 BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://gazman-ecommerce.preview.emergentagent.com').rstrip('/')
 API = f"{BASE_URL}/api"
@@ -16,6 +19,23 @@ ADMIN_EMAIL = "admin@gazman.cm"
 ADMIN_PASSWORD = "Admin123!"
 
 
+def admin_path(start, goal):
+    """Shortest chain of admin transitions from `start` to `goal`, as (from, to) pairs."""
+    previous = {start: None}
+    queue = deque([start])
+    while queue:
+        status = queue.popleft()
+        for target in ADMIN_TRANSITIONS.get(status, []):
+            if target not in previous:
+                previous[target] = status
+                queue.append(target)
+    steps = []
+    while goal != start:
+        steps.append((previous[goal], goal))
+        goal = previous[goal]
+    return steps[::-1]
+
+
 @pytest.fixture(scope="module")
 def admin_token():
     """Get admin authentication token"""
@@ -176,6 +196,33 @@ class TestAdminOrders:
         
         print(f"✓ Orders list retrieved: {data['total']} total orders")
     
+    def test_get_orders_cursor_pagination(self, admin_headers):
+        """Test GET /api/admin/orders pages with next_cursor without overlap"""
+        first = requests.get(f"{API}/admin/orders?limit=2", headers=admin_headers)
+        assert first.status_code == 200, f"Expected 200, got {first.status_code}"
+        
+        data = first.json()
+        assert "next_cursor" in data, "Response should contain next_cursor"
+        if not data["next_cursor"]:
+            pytest.skip("Not enough orders to test a second page")
+        
+        second = requests.get(
+            f"{API}/admin/orders?limit=2&include_total=false&cursor={data['next_cursor']}",
+            headers=admin_headers
+        )
+        assert second.status_code == 200
+        assert second.json()["total"] is None, "Total should be omitted when include_total=false"
+        
+        first_ids = {o["id"] for o in data["orders"]}
+        second_ids = {o["id"] for o in second.json()["orders"]}
+        assert not first_ids & second_ids, "Pages should not overlap"
+        print(f"✓ Cursor pagination returned {len(second_ids)} orders on page 2")
+    
+    def test_get_orders_invalid_cursor(self, admin_headers):
+        """Test a malformed cursor returns 400"""
+        response = requests.get(f"{API}/admin/orders?cursor=not-a-cursor", headers=admin_headers)
+        assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+    
     def test_get_orders_with_status_filter(self, admin_headers):
         """Test GET /api/admin/orders with status filter"""
         response = requests.get(f"{API}/admin/orders?status=en_attente", headers=admin_headers)
@@ -224,19 +271,14 @@ class TestAdminOrders:
         order_id = order["id"]
         original_status = order["status"]
         
-        # Determine new status based on current status
-        status_flow = ["en_attente", "en_preparation", "en_livraison", "livree"]
-        if original_status in status_flow:
-            current_idx = status_flow.index(original_status)
-            new_status = status_flow[(current_idx + 1) % len(status_flow)]
-        else:
-            new_status = "en_preparation"
+        # Any status the admin table allows from here
+        new_status = ADMIN_TRANSITIONS[original_status][0]
         
         # Update status
         response = requests.put(
             f"{API}/admin/orders/{order_id}/status",
             headers=admin_headers,
-            json={"status": new_status}
+            json={"status": new_status, "expected_status": original_status}
         )
         
         assert response.status_code == 200, f"Expected 200, got {response.status_code}"
@@ -251,12 +293,17 @@ class TestAdminOrders:
         
         print(f"✓ Order status updated: {original_status} -> {new_status}")
         
-        # Restore original status
-        requests.put(
-            f"{API}/admin/orders/{order_id}/status",
-            headers=admin_headers,
-            json={"status": original_status}
-        )
+        # Restore original status through allowed transitions
+        for step_from, step_to in admin_path(new_status, original_status):
+            response = requests.put(
+                f"{API}/admin/orders/{order_id}/status",
+                headers=admin_headers,
+                json={"status": step_to, "expected_status": step_from}
+            )
+            assert response.status_code == 200, f"Restoring {step_from} -> {step_to} failed: {response.text}"
+        
+        verify_response = requests.get(f"{API}/admin/orders/{order_id}", headers=admin_headers)
+        assert verify_response.json()["status"] == original_status, "Order should be back in its original status"
     
     def test_update_order_invalid_status(self, admin_headers):
         """Test PUT /api/admin/orders/{order_id}/status with invalid status returns 400"""
@@ -277,7 +324,31 @@ class TestAdminOrders:
         
         assert response.status_code == 400, f"Expected 400, got {response.status_code}"
         print("✓ Invalid status correctly rejected")
-    
+
+    def test_update_order_status_stale_expected_status(self, admin_headers):
+        """Test PUT /api/admin/orders/{order_id}/status returns 409 when the order moved on"""
+        list_response = requests.get(f"{API}/admin/orders?limit=1", headers=admin_headers)
+
+        if list_response.status_code != 200 or not list_response.json().get("orders"):
+            pytest.skip("No orders available for testing")
+
+        order = list_response.json()["orders"][0]
+        # A legal transition whose starting status the order is no longer in
+        stale_status, new_status = next(
+            pair for pair in [("en_preparation", "en_livraison"), ("en_livraison", "livree"), ("en_attente", "en_preparation")]
+            if order["status"] not in pair
+        )
+
+        response = requests.put(
+            f"{API}/admin/orders/{order['id']}/status",
+            headers=admin_headers,
+            json={"status": new_status, "expected_status": stale_status}
+        )
+
+        assert response.status_code == 409, f"Expected 409, got {response.status_code}"
+        assert response.json()["detail"]["current_status"] == order["status"]
+        print("✓ Stale status update rejected with 409")
+
     def test_orders_non_admin_access(self, regular_user_headers):
         """Test admin orders endpoints require admin role"""
         response = requests.get(f"{API}/admin/orders", headers=regular_user_headers)
@@ -469,7 +540,7 @@ class TestAdminProducts:
 
 
 class TestAdminUsers:
-    """Test admin users list endpoint (read-only)"""
+    """Test admin users endpoints"""
     
     def test_get_users_list(self, admin_headers):
         """Test GET /api/admin/users returns users list"""
@@ -498,6 +569,64 @@ class TestAdminUsers:
         
         assert response.status_code == 403, f"Expected 403, got {response.status_code}"
         print("✓ Users endpoint requires admin role")
+    
+    def test_role_change_revokes_tokens(self, admin_headers):
+        """Test PUT /api/admin/users/{user_id}/role ends the user's existing sessions"""
+        unique_id = str(uuid.uuid4())[:8]
+        email = f"TEST_role_{unique_id}@test.com"
+        register = requests.post(f"{API}/auth/register", json={
+            "name": f"Role User {unique_id}",
+            "email": email,
+            "password": "TestPass123!",
+            "phone": "+237600000000"
+        })
+        if register.status_code != 201:
+            pytest.skip(f"Failed to create user: {register.text}")
+        data = register.json()
+        old_headers = {"Authorization": f"Bearer {data['access_token']}"}
+        
+        response = requests.put(
+            f"{API}/admin/users/{data['user']['id']}/role",
+            headers=admin_headers,
+            json={"role": "driver"}
+        )
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        
+        # The old token carries the old role claim and must stop working
+        me = requests.get(f"{API}/auth/me", headers=old_headers)
+        assert me.status_code == 401, f"Expected 401, got {me.status_code}"
+        refresh = requests.post(f"{API}/auth/refresh", json={"refresh_token": data["refresh_token"]})
+        assert refresh.status_code == 401, f"Expected 401, got {refresh.status_code}"
+        
+        login = requests.post(f"{API}/auth/login", json={"email": email, "password": "TestPass123!"})
+        assert login.status_code == 200
+        assert login.json()["user"]["role"] == "driver"
+        print("✓ Role change revoked existing tokens")
+
+
+class TestAdminMetrics:
+    """Test admin in-process metrics endpoint"""
+    
+    def test_user_cache_counts_hits(self, admin_headers):
+        """Test repeated authenticated calls are served from the user cache"""
+        before = requests.get(f"{API}/admin/metrics", headers=admin_headers)
+        assert before.status_code == 200, f"Expected 200, got {before.status_code}"
+        assert "user_cache" in before.json(), "Response should contain user_cache stats"
+        
+        for _ in range(3):
+            requests.get(f"{API}/auth/me", headers=admin_headers)
+        
+        after = requests.get(f"{API}/admin/metrics", headers=admin_headers).json()["user_cache"]
+        # Workers keep separate caches, so only assert the counters moved forward
+        assert after["hits"] + after["misses"] > before.json()["user_cache"]["hits"] + before.json()["user_cache"]["misses"]
+        print(f"✓ User cache stats: {after}")
+    
+    def test_metrics_non_admin_access(self, regular_user_headers):
+        """Test metrics endpoint requires admin role"""
+        response = requests.get(f"{API}/admin/metrics", headers=regular_user_headers)
+        
+        assert response.status_code == 403, f"Expected 403, got {response.status_code}"
+        print("✓ Metrics endpoint requires admin role")
 
 
 class TestOrderStatusFlow:
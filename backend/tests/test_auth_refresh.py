@@ -0,0 +1,112 @@
+"""
+Refresh Token Tests for GAZ MAN E-commerce App
+Tests: Short-lived access tokens, refresh token rotation, reuse detection and revocation
+"""
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://gazman-ecommerce.preview.emergentagent.com').rstrip('/')
+API = f"{BASE_URL}/api"
+
+
+@pytest.fixture
+def registered_user():
+    """Register a unique user and return the token response"""
+    unique_email = f"test_refresh_{uuid.uuid4().hex[:8]}@test.com"
+    response = requests.post(f"{API}/auth/register", json={
+        "email": unique_email,
+        "password": "TestPass123!",
+        "name": "Test Refresh User"
+    })
+    assert response.status_code == 201, f"Registration failed: {response.text}"
+    return response.json()
+
+
+class TestRefreshTokens:
+    """Refresh token rotation tests"""
+
+    def test_register_returns_refresh_token(self, registered_user):
+        """Test registration issues both an access token and a refresh token"""
+        assert registered_user.get("access_token")
+        assert registered_user.get("refresh_token")
+        assert registered_user.get("expires_in", 0) > 0
+        print(f"✓ Access token expires in {registered_user['expires_in']}s")
+
+    def test_refresh_rotates_token(self, registered_user):
+        """Test POST /api/auth/refresh returns a new working token pair"""
+        response = requests.post(f"{API}/auth/refresh", json={
+            "refresh_token": registered_user["refresh_token"]
+        })
+        assert response.status_code == 200, f"Refresh failed: {response.text}"
+
+        data = response.json()
+        assert data["refresh_token"] != registered_user["refresh_token"], "Refresh token should rotate"
+
+        me = requests.get(f"{API}/auth/me", headers={"Authorization": f"Bearer {data['access_token']}"})
+        assert me.status_code == 200
+        assert me.json()["id"] == registered_user["user"]["id"]
+        print("✓ Refresh token rotated and new access token works")
+
+    def test_reused_refresh_token_revokes_family(self, registered_user):
+        """Test replaying a rotated refresh token fails and kills its successor"""
+        first = requests.post(f"{API}/auth/refresh", json={
+            "refresh_token": registered_user["refresh_token"]
+        })
+        assert first.status_code == 200
+
+        replay = requests.post(f"{API}/auth/refresh", json={
+            "refresh_token": registered_user["refresh_token"]
+        })
+        assert replay.status_code == 401, f"Expected 401, got {replay.status_code}"
+
+        successor = requests.post(f"{API}/auth/refresh", json={
+            "refresh_token": first.json()["refresh_token"]
+        })
+        assert successor.status_code == 401, "Successor token should be revoked after reuse"
+        print("✓ Refresh token reuse detected")
+
+    def test_logout_revokes_refresh_token(self, registered_user):
+        """Test POST /api/auth/logout stops the session's refresh tokens working"""
+        rotated = requests.post(f"{API}/auth/refresh", json={
+            "refresh_token": registered_user["refresh_token"]
+        })
+        assert rotated.status_code == 200
+
+        logout = requests.post(f"{API}/auth/logout", json={
+            "refresh_token": rotated.json()["refresh_token"]
+        })
+        assert logout.status_code == 200
+
+        response = requests.post(f"{API}/auth/refresh", json={
+            "refresh_token": rotated.json()["refresh_token"]
+        })
+        assert response.status_code == 401, f"Expected 401, got {response.status_code}"
+        print("✓ Logout revoked the refresh token family")
+
+    def test_password_change_blocks_refresh(self, registered_user):
+        """Test refresh tokens issued before a password change stop working"""
+        change = requests.post(
+            f"{API}/auth/change-password",
+            headers={"Authorization": f"Bearer {registered_user['access_token']}"},
+            json={"current_password": "TestPass123!", "new_password": "NewPass123!"}
+        )
+        assert change.status_code == 200, f"Password change failed: {change.text}"
+
+        old = requests.post(f"{API}/auth/refresh", json={"refresh_token": registered_user["refresh_token"]})
+        assert old.status_code == 401, f"Expected 401, got {old.status_code}"
+
+        new = requests.post(f"{API}/auth/refresh", json={"refresh_token": change.json()["refresh_token"]})
+        assert new.status_code == 200, f"Fresh refresh token should work: {new.text}"
+        print("✓ Password change revoked older refresh tokens")
+
+    def test_invalid_refresh_token(self):
+        """Test an unknown refresh token is rejected"""
+        response = requests.post(f"{API}/auth/refresh", json={"refresh_token": "not-a-real-token"})
+        assert response.status_code == 401
+        print("✓ Invalid refresh token rejected")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
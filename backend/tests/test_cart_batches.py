@@ -0,0 +1,66 @@
+"""
+Cart Batch Tests
+Tests: a batch `set` only applies to lines the cart already holds, and only
+a batch with an `add` may create the cart
+"""
+import asyncio
+
+import pytest
+
+from carts import CartLineNotFoundError, apply_cart_operations, required_lines
+
+
+def op(kind, product_id="p1", quantity=1):
+    return {"op": kind, "product_id": product_id, "size": "medium", "quantity": quantity}
+
+
+PRODUCTS = {
+    "p1": {"name": "Gas 12kg", "image_url": "", "price": 6500},
+    "p2": {"name": "Gas 6kg", "image_url": "", "price": 3500},
+}
+
+
+class TestRequiredLines:
+    """Lines a batch needs from the stored cart"""
+
+    def test_set_needs_existing_line(self):
+        """A lone set requires its line; a set after an add of it doesn't"""
+        assert required_lines([op("set")]) == [{"product_id": "p1", "size": "medium"}]
+        assert required_lines([op("add"), op("set", quantity=4)]) == []
+        print("✓ Set requires an existing line unless the batch added it")
+
+    def test_set_after_remove_rejected(self):
+        """Setting a line the batch just removed can't succeed"""
+        with pytest.raises(CartLineNotFoundError):
+            required_lines([op("remove"), op("set")])
+        print("✓ Set after remove rejected")
+
+
+class TestApplyOperations:
+    """Upsert only when the batch can create lines"""
+
+    def test_remove_only_does_not_upsert(self, fake_db):
+        """A remove-only batch never creates an empty cart"""
+        db = fake_db()
+        assert asyncio.run(apply_cart_operations(db, "u1", [op("remove")], {})) is None
+        assert db.carts.log[0].kwargs["upsert"] is False
+        assert db.carts.docs == []
+        print("✓ Remove-only batch doesn't upsert")
+
+    def test_add_upserts(self, fake_db):
+        """An add creates the cart on first use"""
+        db = fake_db()
+        asyncio.run(apply_cart_operations(db, "u1", [op("add")], PRODUCTS))
+        assert db.carts.log[0].kwargs["upsert"] is True
+        print("✓ Add batch upserts")
+
+    def test_set_on_missing_line_not_found(self, fake_db):
+        """A set whose line isn't in the cart matches nothing and is reported"""
+        db = fake_db()
+        with pytest.raises(CartLineNotFoundError):
+            asyncio.run(apply_cart_operations(db, "u1", [op("add", "p2"), op("set")], PRODUCTS))
+        call = db.carts.log[0]
+        assert call.query["$and"] == [{"items": {"$elemMatch": {"product_id": "p1", "size": "medium"}}}]
+        assert call.kwargs["upsert"] is False
+        assert db.carts.docs == []
+        print("✓ Set on a missing line reported, nothing upserted")
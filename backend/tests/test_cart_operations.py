@@ -275,6 +275,103 @@ class TestCartOperations:
         cart = self.session.get(f"{BASE_URL}/api/cart").json()
         assert len(cart["items"]) == 0
         print("✓ Cart cleared successfully")
+    
+    def test_09_concurrent_adds_are_not_lost(self):
+        """Test parallel adds of the same line all count (no lost updates)"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        def add_one(_):
+            return requests.post(f"{BASE_URL}/api/cart/items", json={
+                "product_id": TEST_PRODUCT_ID,
+                "quantity": 1,
+                "size": "medium"
+            }, headers={"Authorization": f"Bearer {self.token}"}).status_code
+        
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            statuses = list(pool.map(add_one, range(10)))
+        assert statuses == [200] * 10
+        
+        cart = self.session.get(f"{BASE_URL}/api/cart").json()
+        lines = [i for i in cart["items"] if i["product_id"] == TEST_PRODUCT_ID and i["size"] == "medium"]
+        assert len(lines) == 1, "Concurrent adds should not duplicate the line"
+        assert lines[0]["quantity"] == 10, f"Expected quantity 10, got {lines[0]['quantity']}"
+        print("✓ 10 concurrent adds combined into quantity 10")
+    
+    def test_10_patch_cart_applies_batch(self):
+        """Test PATCH /api/cart applies several operations and returns the new cart"""
+        response = self.session.patch(f"{BASE_URL}/api/cart", json={"operations": [
+            {"op": "add", "product_id": TEST_PRODUCT_ID, "size": "medium", "quantity": 2},
+            {"op": "add", "product_id": TEST_PRODUCT_ID_2, "size": "medium", "quantity": 1},
+            {"op": "add", "product_id": TEST_PRODUCT_ID, "size": "medium", "quantity": 1},
+            {"op": "set", "product_id": TEST_PRODUCT_ID_2, "size": "medium", "quantity": 4},
+        ]})
+        assert response.status_code == 200, f"Patch failed: {response.text}"
+        
+        cart = response.json()
+        quantities = {i["product_id"]: i["quantity"] for i in cart["items"]}
+        assert quantities == {TEST_PRODUCT_ID: 3, TEST_PRODUCT_ID_2: 4}
+        assert cart["subtotal"] == sum(i["price"] * i["quantity"] for i in cart["items"])
+        
+        response = self.session.patch(f"{BASE_URL}/api/cart", json={"operations": [
+            {"op": "remove", "product_id": TEST_PRODUCT_ID, "size": "medium"},
+            {"op": "remove", "product_id": TEST_PRODUCT_ID_2, "size": "medium"},
+        ]})
+        assert response.status_code == 200
+        assert response.json()["items"] == []
+        print("✓ PATCH /api/cart applied batch and returned recalculated cart")
+    
+    def test_11_patch_cart_unknown_product(self):
+        """Test PATCH /api/cart rejects the whole batch for an unknown product"""
+        response = self.session.patch(f"{BASE_URL}/api/cart", json={"operations": [
+            {"op": "add", "product_id": TEST_PRODUCT_ID, "size": "medium", "quantity": 1},
+            {"op": "add", "product_id": "nonexistent-product", "size": "medium", "quantity": 1},
+        ]})
+        assert response.status_code == 404
+        
+        cart = self.session.get(f"{BASE_URL}/api/cart").json()
+        assert cart["items"] == [], "No operation should apply when one is rejected"
+        print("✓ Unknown product rejects the whole batch")
+
+
+    def test_12_patch_set_missing_line(self):
+        """Test PATCH /api/cart set on a line not in the cart is a 404, like PUT"""
+        self.session.post(f"{BASE_URL}/api/cart/items", json={
+            "product_id": TEST_PRODUCT_ID, "quantity": 1, "size": "medium"
+        })
+        response = self.session.patch(f"{BASE_URL}/api/cart", json={"operations": [
+            {"op": "add", "product_id": TEST_PRODUCT_ID, "size": "medium", "quantity": 1},
+            {"op": "set", "product_id": TEST_PRODUCT_ID_2, "size": "medium", "quantity": 3},
+        ]})
+        assert response.status_code == 404
+        
+        cart = self.session.get(f"{BASE_URL}/api/cart").json()
+        assert [(i["product_id"], i["quantity"]) for i in cart["items"]] == [(TEST_PRODUCT_ID, 1)]
+        
+        # A set after an add of the same line in the batch is fine
+        response = self.session.patch(f"{BASE_URL}/api/cart", json={"operations": [
+            {"op": "add", "product_id": TEST_PRODUCT_ID_2, "size": "medium", "quantity": 1},
+            {"op": "set", "product_id": TEST_PRODUCT_ID_2, "size": "medium", "quantity": 3},
+        ]})
+        assert response.status_code == 200
+        print("✓ Set on a missing line rejected, set after add accepted")
+    
+    def test_13_patch_remove_only_creates_no_cart(self):
+        """Test a remove-only PATCH on a user without a cart doesn't create one"""
+        response = self.session.patch(f"{BASE_URL}/api/cart", json={"operations": [
+            {"op": "remove", "product_id": TEST_PRODUCT_ID, "size": "medium"},
+        ]})
+        assert response.status_code == 200
+        assert response.json()["id"] is None, "Remove-only batch should not upsert a cart"
+        print("✓ Remove-only PATCH leaves no cart behind")
+    
+    def test_14_patch_quantity_bounds(self):
+        """Test PATCH /api/cart rejects zero, negative and huge quantities"""
+        for quantity in (0, -3, 10**9):
+            response = self.session.patch(f"{BASE_URL}/api/cart", json={"operations": [
+                {"op": "add", "product_id": TEST_PRODUCT_ID, "size": "medium", "quantity": quantity},
+            ]})
+            assert response.status_code == 422, f"quantity={quantity} should be rejected"
+        print("✓ Out-of-range quantities rejected")
 
 
 class TestCartWithoutAuth:
@@ -0,0 +1,83 @@
+"""
+Cart Re-pricing Tests
+Tests: cart lines are validated against current products with one query,
+reporting price changes, removed products and stock shortfalls
+"""
+import asyncio
+
+from carts import reprice_cart_items
+
+
+def line(product_id, price, quantity=1, size="medium"):
+    return {
+        "product_id": product_id,
+        "product_name": f"Old {product_id}",
+        "product_image": "old.png",
+        "quantity": quantity,
+        "size": size,
+        "price": price
+    }
+
+
+def product(product_id, price, stock=100, reserved=0):
+    return {
+        "id": product_id, "name": f"Gas {product_id}", "image_url": "new.png",
+        "price": price, "stock": stock, "reserved": reserved
+    }
+
+
+class TestCartRepricing:
+    """Checkout-time validation of cart lines"""
+
+    def test_unchanged_cart_has_no_changes(self, fake_db):
+        """A cart matching current products validates cleanly in one query"""
+        db = fake_db(products=[product("p1", 6000), product("p2", 9000)])
+        lines, changes = asyncio.run(reprice_cart_items(db, [line("p1", 6000), line("p2", 9000, 2)]))
+
+        assert changes == []
+        assert [l["price"] for l in lines] == [6000, 9000]
+        assert db.products.calls["find"] == 1
+        print("✓ Unchanged cart validated with 1 products query")
+
+    def test_price_change_reported_and_applied(self, fake_db):
+        """A changed price is reported and the line carries the new price"""
+        db = fake_db(products=[product("p1", 6500)])
+        lines, changes = asyncio.run(reprice_cart_items(db, [line("p1", 6000)]))
+
+        assert lines[0]["price"] == 6500
+        assert lines[0]["product_name"] == "Gas p1"
+        assert changes == [{
+            "product_id": "p1", "size": "medium", "product_name": "Old p1",
+            "change": "price", "old_price": 6000, "price": 6500
+        }]
+        print("✓ Price change reported")
+
+    def test_deleted_product_dropped(self, fake_db):
+        """Lines for deleted products are removed and reported"""
+        db = fake_db(products=[product("p1", 6000)])
+        lines, changes = asyncio.run(reprice_cart_items(db, [line("p1", 6000), line("gone", 5000)]))
+
+        assert [l["product_id"] for l in lines] == ["p1"]
+        assert changes[0]["product_id"] == "gone"
+        assert changes[0]["change"] == "removed"
+        print("✓ Deleted product removed from cart")
+
+    def test_stock_checked_across_sizes(self, fake_db):
+        """Stock covers the product's total quantity over all its lines"""
+        db = fake_db(products=[product("p1", 6000, stock=3)])
+        items = [line("p1", 6000, 2, "small"), line("p1", 6000, 2, "large")]
+        lines, changes = asyncio.run(reprice_cart_items(db, items))
+
+        assert len(lines) == 2
+        assert {c["change"] for c in changes} == {"stock"}
+        assert all(c["available"] == 3 for c in changes)
+        print("✓ Stock shortfall across sizes reported")
+
+    def test_stock_held_by_others_not_available(self, fake_db):
+        """Units other customers hold don't count towards the cart"""
+        db = fake_db(products=[product("p1", 6000, stock=5, reserved=4)])
+        lines, changes = asyncio.run(reprice_cart_items(db, [line("p1", 6000, 2)]))
+
+        assert changes[0]["change"] == "stock"
+        assert changes[0]["available"] == 1
+        print("✓ Reserved stock excluded from availability")
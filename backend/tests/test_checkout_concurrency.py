@@ -0,0 +1,275 @@
+"""
+Checkout Concurrency Tests
+Tests: many parallel checkouts against limited stock never oversell, with
+and without transactions; stock reservations hold units for their owner and
+are released in bulk on expiry; sharded stock counters don't oversell either.
+
+Runs against two servers; the tests for one are skipped, saying what was
+missing, when nothing or the wrong kind of server answers at its URL:
+- a replica set at CHECKOUT_TEST_MONGO_URL, for transactional checkouts and
+  for the non-transactional path on a replica set;
+- a standalone mongod at CHECKOUT_TEST_STANDALONE_URL, where transactions
+  are unavailable and only the guarded fallback can be used.
+Both can be started locally with:
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+    mongod --dbpath /tmp/standalone --port 27018
+Set CHECKOUT_TEST_REQUIRE_MONGO=1 (e.g. in CI) to fail instead of skipping
+when either server is unavailable.
+"""
+import asyncio
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import uri_parser
+
+from checkout import InsufficientStockError, place_order
+from database import supports_transactions
+from inventory import add_sharded_stock, set_stock_shards, shard_count_cache
+from reservations import release_expired_reservations, reserve_quantities
+
+MONGO_URLS = {
+    "replica_set": os.environ.get(
+        "CHECKOUT_TEST_MONGO_URL", "mongodb://localhost:27017/?replicaSet=rs0&directConnection=true"
+    ),
+    "standalone": os.environ.get("CHECKOUT_TEST_STANDALONE_URL", "mongodb://localhost:27018"),
+}
+MONGO_URL_VARS = {"replica_set": "CHECKOUT_TEST_MONGO_URL", "standalone": "CHECKOUT_TEST_STANDALONE_URL"}
+TOPOLOGY_NAMES = {"replica_set": "a replica set", "standalone": "a standalone mongod"}
+REQUIRE_MONGO = os.environ.get("CHECKOUT_TEST_REQUIRE_MONGO", "").lower() in ("1", "true", "yes")
+# topology -> why it can't be used, so later tests skip without waiting for the timeout again
+unavailable = {}
+STOCK = 10
+BUYERS = 100
+
+# (use_transaction, topology) pairs a checkout path can run on
+CHECKOUT_PATHS = [(True, "replica_set"), (False, "replica_set"), (False, "standalone")]
+PATH_IDS = ["transaction", "fallback-replica-set", "fallback-standalone"]
+
+
+async def unavailable_reason(topology: str) -> str:
+    """What is missing at the topology's URL: any server at all, or a server of that kind."""
+    url = MONGO_URLS[topology]
+    host, port = uri_parser.parse_uri(url)["nodelist"][0]
+    # Asked directly, so a replicaSet option in the URL can't mask what actually answers
+    probe = AsyncIOMotorClient(host, port, directConnection=True, serverSelectionTimeoutMS=2000)
+    try:
+        hello = await probe.admin.command("hello")
+    except Exception:
+        found = "no MongoDB server is listening"
+    else:
+        found = f"replica set {hello['setName']!r} answers" if "setName" in hello else "a standalone mongod answers"
+    finally:
+        probe.close()
+    return f"needs {TOPOLOGY_NAMES[topology]} at {MONGO_URL_VARS[topology]}={url}, but {found} on {host}:{port}"
+
+
+async def connect(use_transaction: bool, topology: str = "replica_set"):
+    """Client and a throwaway database, or skip saying what was unavailable."""
+    reason = unavailable.get(topology)
+    if reason is None:
+        client = AsyncIOMotorClient(MONGO_URLS[topology], serverSelectionTimeoutMS=2000)
+        try:
+            usable = await supports_transactions(client) == (topology == "replica_set")
+        except Exception:
+            usable = False
+        if usable:
+            return client, client[f"checkout_test_{uuid.uuid4().hex[:8]}"]
+        client.close()
+        reason = unavailable[topology] = await unavailable_reason(topology)
+    if REQUIRE_MONGO:
+        pytest.fail(reason)
+    pytest.skip(reason)
+
+
+async def checkout(client, db, user_id: str, product_id: str, quantity: int, use_transaction: bool) -> bool:
+    """Place a one-line order; False if stock ran out."""
+    await db.carts.update_one({"user_id": user_id}, {"$set": {"items": []}}, upsert=True)
+    order = {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "items": [{"product_id": product_id, "quantity": quantity}],
+    }
+    try:
+        await place_order(client, db, order, use_transaction=use_transaction)
+        return True
+    except InsufficientStockError:
+        return False
+
+
+async def run_checkouts(use_transaction: bool, topology: str):
+    """Race BUYERS single-item checkouts for a product with STOCK units."""
+    client, db = await connect(use_transaction, topology)
+    try:
+        product_id = str(uuid.uuid4())
+        await db.products.insert_one({"id": product_id, "name": "Test gas 12kg", "stock": STOCK})
+
+        results = await asyncio.gather(*(
+            checkout(client, db, f"buyer-{i}", product_id, 1, use_transaction) for i in range(BUYERS)
+        ))
+        product = await db.products.find_one({"id": product_id})
+        orders = await db.orders.count_documents({})
+        carts = await db.carts.count_documents({})
+        return sum(results), product, orders, carts
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+class TestCheckoutConcurrency:
+    """No overselling under parallel checkouts"""
+
+    def test_transactional_checkout_never_oversells(self):
+        """Exactly STOCK checkouts succeed inside transactions"""
+        succeeded, product, orders, carts = asyncio.run(run_checkouts(True, "replica_set"))
+        assert succeeded == STOCK
+        assert product["stock"] == 0
+        assert orders == STOCK
+        # Carts are cleared only for successful checkouts
+        assert carts == BUYERS - STOCK
+        print(f"✓ {BUYERS} parallel checkouts, {succeeded} succeeded, stock 0")
+
+    @pytest.mark.parametrize("topology", ["replica_set", "standalone"])
+    def test_fallback_never_oversells(self, topology):
+        """Guarded bulk_write alone also stops at zero stock"""
+        succeeded, product, orders, carts = asyncio.run(run_checkouts(False, topology))
+        assert succeeded == STOCK
+        assert product["stock"] == 0
+        assert product.get("stock_holds", []) == []
+        assert orders == STOCK
+        assert carts == BUYERS - STOCK
+        print(f"✓ {BUYERS} parallel checkouts without transactions on {topology}, {succeeded} succeeded")
+
+
+async def run_reserved_checkouts(use_transaction: bool, topology: str):
+    """One customer holds most of the stock while BUYERS others race for the rest."""
+    client, db = await connect(use_transaction, topology)
+    try:
+        product_id = str(uuid.uuid4())
+        await db.products.insert_one({"id": product_id, "name": "Test gas 12kg", "stock": STOCK})
+        hold = await reserve_quantities(db, "holder", {product_id: STOCK - 2})
+        assert hold["unavailable"] == []
+
+        results = await asyncio.gather(*(
+            checkout(client, db, f"buyer-{i}", product_id, 1, use_transaction) for i in range(BUYERS)
+        ))
+        holder_ok = await checkout(client, db, "holder", product_id, STOCK - 2, use_transaction)
+        product = await db.products.find_one({"id": product_id})
+        holds = await db.reservations.count_documents({})
+        return sum(results), holder_ok, product, holds
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+async def run_expired_release():
+    """Expired holds give their stock back in one release pass."""
+    client, db = await connect(use_transaction=False)
+    try:
+        product_id = str(uuid.uuid4())
+        await db.products.insert_one({"id": product_id, "name": "Test gas 12kg", "stock": STOCK})
+        for i in range(3):
+            await reserve_quantities(db, f"browser-{i}", {product_id: 2}, minutes=0)
+        before = (await db.products.find_one({"id": product_id}))["reserved"]
+        released = await release_expired_reservations(db)
+        after = await db.products.find_one({"id": product_id})
+        return before, released, after, await db.reservations.count_documents({})
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+class TestStockReservations:
+    """Held stock is kept for its holder and released on expiry"""
+
+    @pytest.mark.parametrize("use_transaction,topology", CHECKOUT_PATHS, ids=PATH_IDS)
+    def test_held_stock_not_sold_to_others(self, use_transaction, topology):
+        """Other buyers only get unheld units; the holder still checks out"""
+        succeeded, holder_ok, product, holds = asyncio.run(run_reserved_checkouts(use_transaction, topology))
+        assert succeeded == 2
+        assert holder_ok
+        assert product["stock"] == 0
+        assert product["reserved"] == 0
+        assert holds == 0
+        print(f"✓ {BUYERS} racing buyers got 2 units, holder got {STOCK - 2}")
+
+    def test_expired_holds_released_in_bulk(self):
+        """release_expired_reservations frees every expired hold at once"""
+        before, released, product, holds = asyncio.run(run_expired_release())
+        assert before == 6
+        assert released == 3
+        assert product["reserved"] == 0
+        assert product["stock"] == STOCK
+        assert holds == 0
+        print("✓ 3 expired holds released in one pass")
+
+
+async def run_sharded_checkouts(use_transaction: bool, topology: str):
+    """Race BUYERS checkouts for a product whose stock is spread over shards."""
+    client, db = await connect(use_transaction, topology)
+    try:
+        product_id = str(uuid.uuid4())
+        await db.products.insert_one({"id": product_id, "name": "Test gas 12kg", "stock": STOCK})
+        shard_count_cache.clear()
+        split = await set_stock_shards(db, product_id, 4)
+
+        results = await asyncio.gather(*(
+            checkout(client, db, f"buyer-{i}", product_id, 1, use_transaction) for i in range(BUYERS)
+        ))
+        product = (await add_sharded_stock(db, [await db.products.find_one({"id": product_id})]))[0]
+        sales = await db.inventory_ledger.count_documents({"reason": "sale"})
+        return split, sum(results), product, sales
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+async def run_large_sharded_checkouts(use_transaction: bool, topology: str, quantity: int):
+    """One order larger than any shard, then BUYERS racing orders of `quantity` units."""
+    client, db = await connect(use_transaction, topology)
+    try:
+        product_id = str(uuid.uuid4())
+        await db.products.insert_one({"id": product_id, "name": "Test gas 12kg", "stock": 5 * STOCK})
+        shard_count_cache.clear()
+        await set_stock_shards(db, product_id, 4)
+
+        first = await checkout(client, db, "first", product_id, quantity, use_transaction)
+        results = await asyncio.gather(*(
+            checkout(client, db, f"buyer-{i}", product_id, quantity, use_transaction) for i in range(BUYERS)
+        ))
+        product = (await add_sharded_stock(db, [await db.products.find_one({"id": product_id})]))[0]
+        sold = -sum(row["delta"] for row in await db.inventory_ledger.find({"reason": "sale"}).to_list(None))
+        return first, sum(results), product, sold
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+class TestShardedStock:
+    """Sharded stock counters for hot products"""
+
+    @pytest.mark.parametrize("use_transaction,topology", CHECKOUT_PATHS, ids=PATH_IDS)
+    def test_sharded_stock_never_oversells(self, use_transaction, topology):
+        """Every unit, in shards or pool, sells exactly once"""
+        split, succeeded, product, sales = asyncio.run(run_sharded_checkouts(use_transaction, topology))
+        assert split["allotted"] == 8  # 4 shards of 10 // 5, two units stay in the pool
+        assert succeeded == STOCK
+        assert product["stock"] == 0
+        assert sales == STOCK
+        print(f"✓ {BUYERS} parallel checkouts over 4 shards, {succeeded} succeeded, stock 0")
+
+    @pytest.mark.parametrize("use_transaction,topology", CHECKOUT_PATHS, ids=PATH_IDS)
+    def test_line_larger_than_a_shard(self, use_transaction, topology):
+        """Stock 50 over 4 shards of 10 and a pool of 10 sells orders of 12 without overselling"""
+        first, succeeded, product, sold = asyncio.run(run_large_sharded_checkouts(use_transaction, topology, 12))
+        assert first, "An order of 12 must succeed while 50 units are in stock"
+        assert (1 + succeeded) * 12 == sold
+        assert sold + product["stock"] == 5 * STOCK
+        assert product["stock"] >= 0
+        print(f"✓ {1 + succeeded} orders of 12 from 50 units over 4 shards, {product['stock']} left")
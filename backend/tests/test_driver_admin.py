@@ -130,6 +130,18 @@ class TestDriverEndpoints:
         assert "stats" in data
         assert isinstance(data["orders"], list)
     
+    def test_driver_order_counts_match_stats(self, driver_token):
+        """Tab counts on /driver/orders agree with /driver/stats"""
+        headers = {"Authorization": f"Bearer {driver_token}"}
+        orders = requests.get(f"{BASE_URL}/api/driver/orders", headers=headers).json()
+        stats = requests.get(f"{BASE_URL}/api/driver/stats", headers=headers).json()
+        
+        counts = orders["stats"]
+        assert counts["total"] == stats["total_assigned"]
+        assert counts["delivered"] == stats["delivered"]
+        assert counts["failed"] == stats["failed"]
+        assert counts["pending"] + counts["preparing"] + counts["delivering"] == stats["in_progress"]
+    
     def test_driver_failure_reasons_endpoint(self, driver_token):
         """Test GET /api/driver/failure-reasons returns predefined failure reasons"""
         response = requests.get(
@@ -0,0 +1,92 @@
+"""
+Sharded Stock Tests
+Tests: a line larger than any one shard is gathered from several shards
+and the pool, recorded per source in the ledger, and returned on failure;
+a failed shard count change doesn't reach the cache
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import inventory
+from inventory import (
+    pool_quantities, return_to_shards, sale_entries, set_stock_shards, shard_count_cache, shard_id,
+    stock_lease, take_from_shards
+)
+from leases import LeaseBusyError
+
+
+def shards(product_id, *available):
+    return [
+        {"_id": shard_id(product_id, n), "product_id": product_id, "shard": n, "available": units}
+        for n, units in enumerate(available)
+    ]
+
+
+class TestTakeFromShards:
+    """Taking a line's quantity from shards before the pool"""
+
+    def test_one_shard_covers_small_line(self, fake_db):
+        """A quantity one shard holds is a single guarded write"""
+        db = fake_db(stock_shards=shards("p1", 10, 10, 10, 10))
+        taken = asyncio.run(take_from_shards(db, {"p1": 3}, {"p1": 4}))
+        assert sum(taken["p1"].values()) == 3
+        assert len(taken["p1"]) == 1
+        assert db.stock_shards.calls["update_one"] == 1
+        print("✓ Small line taken from one shard")
+
+    def test_large_line_gathered_from_several_shards(self, fake_db):
+        """Stock 50 as 4 shards of 10 plus 10 in the pool sells a line of 12"""
+        db = fake_db(stock_shards=shards("p1", 10, 10, 10, 10))
+        taken = asyncio.run(take_from_shards(db, {"p1": 12}, {"p1": 4}))
+        assert sum(taken["p1"].values()) == 12
+        assert len(taken["p1"]) == 2
+        assert sum(s["available"] for s in db.stock_shards.docs) == 28
+        assert pool_quantities({"p1": 12}, taken) == {}
+        print("✓ Line of 12 gathered from two shards")
+
+    def test_rest_comes_from_pool(self, fake_db):
+        """What the shards can't cover is left for the pool"""
+        db = fake_db(stock_shards=shards("p1", 10, 0, 5, 0))
+        taken = asyncio.run(take_from_shards(db, {"p1": 20, "p2": 4}, {"p1": 4}))
+        assert sum(taken["p1"].values()) == 15
+        assert pool_quantities({"p1": 20, "p2": 4}, taken) == {"p1": 5, "p2": 4}
+        print("✓ Remainder and unsharded products go to the pool")
+
+    def test_ledger_rows_per_source(self, fake_db):
+        """Each shard and the pool get their own sale row, summing to the line"""
+        taken = {"p1": {shard_id("p1", 0): 10, shard_id("p1", 2): 5}}
+        entries = sale_entries("o1", {"p1": 20, "p2": 4}, taken)
+        by_counter = {(e["product_id"], e["counter"]): e["delta"] for e in entries}
+        assert by_counter == {
+            ("p1", shard_id("p1", 0)): -10,
+            ("p1", shard_id("p1", 2)): -5,
+            ("p1", "pool"): -5,
+            ("p2", "pool"): -4,
+        }
+        print("✓ Sale rows recorded per counter")
+
+    def test_return_to_shards(self, fake_db):
+        """A failed checkout gives every shard back what it took"""
+        db = fake_db(stock_shards=shards("p1", 10, 10, 10, 10))
+        taken = asyncio.run(take_from_shards(db, {"p1": 25}, {"p1": 4}))
+        asyncio.run(return_to_shards(db, taken))
+        assert [s["available"] for s in db.stock_shards.docs] == [10, 10, 10, 10]
+        print("✓ Shard units returned")
+
+
+class TestSetStockShards:
+    """Changing a product's shard count"""
+
+    def test_cache_untouched_when_lease_busy(self, fake_db, monkeypatch):
+        """A change that can't get the stock lease leaves the cached shard count alone"""
+        monkeypatch.setattr(inventory, "STOCK_LEASE_WAIT_SECONDS", 0)
+        db = fake_db(leases=[
+            {"_id": stock_lease("p1"), "owner": "compactor", "expires_at": datetime.utcnow() + timedelta(seconds=30)}
+        ])
+        shard_count_cache.set("p1", 0)
+        with pytest.raises(LeaseBusyError):
+            asyncio.run(set_stock_shards(db, "p1", 8))
+        assert shard_count_cache.get("p1") == 0
+        print("✓ Shard count cache unchanged by a failed change")
@@ -0,0 +1,63 @@
+"""
+Lease Tests
+Tests: a lease has one holder at a time, renews for its owner and can be
+taken over once it expires
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from leases import LeaseBusyError, acquire_lease, hold_lease, release_lease
+
+
+def lease(db, name):
+    return next((doc for doc in db.leases.docs if doc["_id"] == name), None)
+
+
+class TestLeases:
+    """Mongo-backed leases for background jobs and per-product stock changes"""
+
+    def test_one_holder_at_a_time(self, fake_db):
+        """A second owner can't take a live lease; the holder can renew it"""
+        db = fake_db()
+        assert asyncio.run(acquire_lease(db, "job", 60, owner="w1"))
+        assert not asyncio.run(acquire_lease(db, "job", 60, owner="w2"))
+        assert asyncio.run(acquire_lease(db, "job", 60, owner="w1"))
+        print("✓ Lease held by one worker")
+
+    def test_expired_lease_taken_over(self, fake_db):
+        """A lease its holder stopped renewing goes to the next worker"""
+        db = fake_db()
+        asyncio.run(acquire_lease(db, "job", 60, owner="w1"))
+        lease(db, "job")["expires_at"] = datetime.utcnow() - timedelta(seconds=1)
+        assert asyncio.run(acquire_lease(db, "job", 60, owner="w2"))
+        assert lease(db, "job")["owner"] == "w2"
+        print("✓ Expired lease taken over")
+
+    def test_release_only_by_owner(self, fake_db):
+        """Releasing someone else's lease does nothing"""
+        db = fake_db()
+        asyncio.run(acquire_lease(db, "job", 60, owner="w1"))
+        asyncio.run(release_lease(db, "job", owner="w2"))
+        assert lease(db, "job")
+        asyncio.run(release_lease(db, "job", owner="w1"))
+        assert lease(db, "job") is None
+        print("✓ Lease released by its owner only")
+
+    def test_hold_lease_busy(self, fake_db):
+        """hold_lease gives up with LeaseBusyError while another holder has it"""
+        db = fake_db()
+
+        async def run():
+            async with hold_lease(db, "stock:p1", 30):
+                with pytest.raises(LeaseBusyError):
+                    async with hold_lease(db, "stock:p1", 30, wait=0.1):
+                        pass
+            # Released on exit, so it can be taken again
+            async with hold_lease(db, "stock:p1", 30):
+                pass
+
+        asyncio.run(run())
+        assert db.leases.docs == []
+        print("✓ Busy lease reported, released on exit")
@@ -0,0 +1,98 @@
+"""
+Order Status Transition Tests
+Tests: each transition is a single conditional find_one_and_update; lost
+races get 409, disallowed transitions 400, missing orders 404
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from order_status import ADMIN_TRANSITIONS, DRIVER_TRANSITIONS, transition_order
+
+
+def order(status, driver_id="d1"):
+    return {"id": "o1", "status": status, "driver_id": driver_id, "total": 6000}
+
+
+def transition(db, new_status, transitions=DRIVER_TRANSITIONS, **kwargs):
+    return asyncio.run(transition_order(db, {"id": "o1", "driver_id": "d1"}, new_status, transitions, **kwargs))
+
+
+class TestOrderTransitions:
+    """Compare-and-set status changes shared by admin and driver endpoints"""
+
+    def test_transition_returns_new_document(self, fake_db):
+        """A valid transition is one write and returns the updated order"""
+        db = fake_db(orders=[order("en_livraison")])
+        updated = transition(db, "echouee", extra={"failure_reason": "client_absent"})
+
+        assert updated["status"] == "echouee"
+        assert "previous_status" not in db.orders.docs[0]
+        assert updated["failure_reason"] == "client_absent"
+        assert db.orders.calls["find_one_and_update"] == 1
+        assert db.stats.updates[0]["$inc"]["counts.en_livraison"] == -1
+        print("✓ Transition applied in one write")
+
+    def test_second_driver_loses_race(self, fake_db):
+        """Once the order has moved on, a transition from its old status gets 409"""
+        db = fake_db(orders=[order("en_livraison")])
+        transition(db, "livree", expected_status="en_livraison")
+
+        with pytest.raises(HTTPException) as exc:
+            transition(db, "echouee", expected_status="en_livraison")
+        assert exc.value.status_code == 409
+        assert exc.value.detail["current_status"] == "livree"
+        assert len(db.stats.updates) == 1
+        print("✓ Lost race rejected with 409")
+
+    def test_disallowed_transition(self, fake_db):
+        """Skipping a step is rejected with 400 and nothing is written"""
+        db = fake_db(orders=[order("en_attente")])
+        with pytest.raises(HTTPException) as exc:
+            transition(db, "livree")
+        assert exc.value.status_code == 400
+        assert db.orders.docs[0]["status"] == "en_attente"
+        print("✓ Disallowed transition rejected with 400")
+
+    def test_unassigned_order_not_found(self, fake_db):
+        """A driver cannot move an order assigned to someone else"""
+        db = fake_db(orders=[order("en_attente", driver_id="d2")])
+        with pytest.raises(HTTPException) as exc:
+            transition(db, "en_preparation")
+        assert exc.value.status_code == 404
+        print("✓ Unassigned order reported as not found")
+
+    def test_admin_can_reopen(self, fake_db):
+        """Admins may move an order back, e.g. to reopen a delivered one"""
+        db = fake_db(orders=[order("livree")])
+        updated = transition(db, "en_attente", ADMIN_TRANSITIONS, expected_status="livree")
+        assert updated["status"] == "en_attente"
+        print("✓ Admin reopened delivered order")
+
+    def test_reopened_failure_cleared(self, fake_db):
+        """Reopening a failed delivery drops its failure reason"""
+        db = fake_db(orders=[{**order("echouee"), "failure_reason": "autre", "failure_details": "Gate locked"}])
+        updated = transition(db, "en_attente", ADMIN_TRANSITIONS, expected_status="echouee")
+        assert "failure_reason" not in updated
+        assert "failure_reason" not in db.orders.docs[0]
+        assert "failure_details" not in db.orders.docs[0]
+        print("✓ Failure reason cleared on reopen")
+
+    def test_admin_transitions_checked(self, fake_db):
+        """Admins can't jump an order to any status, e.g. cancel a delivered one"""
+        db = fake_db(orders=[order("livree")])
+        with pytest.raises(HTTPException) as exc:
+            transition(db, "annulee", ADMIN_TRANSITIONS)
+        assert exc.value.status_code == 400
+        print("✓ Admin transition outside the table rejected")
+
+    def test_same_status_is_noop(self, fake_db):
+        """Setting the status an order already has succeeds without a write or stats change"""
+        db = fake_db(orders=[order("en_preparation")])
+        updated = transition(db, "en_preparation", ADMIN_TRANSITIONS, expected_status="en_preparation")
+        assert updated["status"] == "en_preparation"
+        updated = transition(db, "en_preparation", ADMIN_TRANSITIONS)
+        assert updated["status"] == "en_preparation"
+        assert db.stats.updates == []
+        print("✓ Same status treated as a no-op")
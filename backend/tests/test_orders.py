@@ -239,6 +239,64 @@ class TestFullOrderFlow:
         print(f"Order status '{order['status']}' is valid")
 
 
+class TestOrderIdempotency:
+    """Test Idempotency-Key on POST /api/orders"""
+    
+    def test_retry_with_same_key_returns_original_order(self, auth_headers):
+        """A retried checkout returns the first order instead of creating another"""
+        products = requests.get(f"{API}/products").json()
+        if not products:
+            pytest.skip("No products available")
+        requests.post(f"{API}/cart/items", headers=auth_headers, json={
+            "product_id": products[0]["id"],
+            "quantity": 1,
+            "size": "medium"
+        })
+        
+        checkout = {
+            "delivery_address": "123 Test Street, Douala",
+            "phone": "+237600000000",
+            "payment_method": "cash"
+        }
+        headers = {**auth_headers, "Idempotency-Key": str(uuid.uuid4())}
+        first = requests.post(f"{API}/orders", headers=headers, json=checkout)
+        assert first.status_code == 200, f"Checkout failed: {first.text}"
+        
+        # The cart is now empty, so only a replay can succeed
+        retry = requests.post(f"{API}/orders", headers=headers, json=checkout)
+        assert retry.status_code == 200
+        assert retry.json()["order_id"] == first.json()["order_id"]
+        assert retry.headers.get("Idempotent-Replayed") == "true"
+        
+        orders = requests.get(f"{API}/orders", headers=auth_headers).json()
+        assert sum(1 for o in orders if o["id"] == first.json()["order_id"]) == 1
+        print("✓ Retry with same Idempotency-Key replayed the original order")
+    
+    def test_same_key_different_request_rejected(self, auth_headers):
+        """Reusing a key for a different checkout is rejected"""
+        key = str(uuid.uuid4())
+        headers = {**auth_headers, "Idempotency-Key": key}
+        products = requests.get(f"{API}/products").json()
+        if not products:
+            pytest.skip("No products available")
+        requests.post(f"{API}/cart/items", headers=auth_headers, json={
+            "product_id": products[0]["id"],
+            "quantity": 1,
+            "size": "medium"
+        })
+        first = requests.post(f"{API}/orders", headers=headers, json={
+            "delivery_address": "1 First Street, Douala",
+            "phone": "+237600000000"
+        })
+        assert first.status_code == 200
+        
+        second = requests.post(f"{API}/orders", headers=headers, json={
+            "delivery_address": "2 Other Street, Douala",
+            "phone": "+237600000000"
+        })
+        assert second.status_code == 422
+
+
 class TestOrderSecurity:
     """Test order security - users can only access their own orders"""
     
@@ -0,0 +1,60 @@
+"""
+Keyset Pagination Tests
+Tests: cursors round-trip for native and legacy string timestamps, and
+bad page sizes are rejected before reaching Mongo
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pagination import decode_cursor, encode_cursor, paginate
+
+
+class TestCursors:
+    """Opaque cursors over (created_at, id)"""
+
+    def test_datetime_round_trip(self):
+        """A native datetime cursor decodes to the same key"""
+        created_at = datetime(2026, 3, 1, 12, 30, 15, 250000)
+        assert decode_cursor(encode_cursor({"created_at": created_at, "id": "o1"})) == ("date", created_at, "o1")
+        print("✓ Datetime cursor round-trips")
+
+    def test_legacy_string_round_trip(self):
+        """A row still holding an ISO string gets a cursor instead of a 500"""
+        cursor = encode_cursor({"created_at": "2025-12-01T08:00:00", "id": "o2"})
+        assert decode_cursor(cursor) == ("string", "2025-12-01T08:00:00", "o2")
+        print("✓ Legacy string cursor round-trips")
+
+    def test_old_cursor_format_accepted(self):
+        """Cursors issued before the kind was encoded still work"""
+        payload = json.dumps(["2026-03-01T12:30:15", "o1"]).encode()
+        cursor = base64.urlsafe_b64encode(payload).decode().rstrip("=")
+        assert decode_cursor(cursor) == ("date", datetime(2026, 3, 1, 12, 30, 15), "o1")
+        print("✓ Old cursor format decoded")
+
+    def test_garbage_cursor_rejected(self):
+        """A malformed cursor is a 400"""
+        with pytest.raises(HTTPException) as exc:
+            decode_cursor("not-a-cursor")
+        assert exc.value.status_code == 400
+        print("✓ Invalid cursor rejected")
+
+
+class TestPageSize:
+    """Page size validation"""
+
+    @pytest.mark.parametrize("limit", [0, -5, 201])
+    def test_out_of_range_limit_rejected(self, limit):
+        """limit=0, negative or huge limits are a 400, not an IndexError or a Mongo error"""
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(paginate(None, {}, {}, limit))
+        assert exc.value.status_code == 400
+        print(f"✓ limit={limit} rejected")
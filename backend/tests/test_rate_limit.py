@@ -0,0 +1,82 @@
+"""
+Auth Rate Limit Tests
+Tests: token buckets refill and reject, and the client IP can't be forged
+through X-Forwarded-For
+"""
+import os
+import sys
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rate_limit
+from rate_limit import TokenBucketLimiter, check_auth_rate_limit, get_client_ip
+
+
+def request(peer="10.0.0.1", forwarded=None):
+    headers = {"x-forwarded-for": forwarded} if forwarded else {}
+    return SimpleNamespace(headers=headers, client=SimpleNamespace(host=peer))
+
+
+@pytest.fixture
+def behind_proxy(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_TRUST_PROXY", True)
+    monkeypatch.setattr(rate_limit, "TRUSTED_PROXY_COUNT", 1)
+
+
+class TestTokenBucket:
+    """Per-key token buckets"""
+
+    def test_burst_then_reject(self):
+        """A key gets `capacity` calls, then a retry delay"""
+        limiter = TokenBucketLimiter(3, 1.0, 100)
+        assert [limiter.try_acquire("k") for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert limiter.try_acquire("k") > 0
+        assert limiter.try_acquire("other") == 0.0
+        assert limiter.stats()["rejected"] == 1
+        print("✓ Burst allowed, then rejected")
+
+    def test_keys_bounded(self):
+        """The least recently used key is evicted past max_keys"""
+        limiter = TokenBucketLimiter(1, 1.0, 2)
+        for key in ("a", "b", "c"):
+            limiter.try_acquire(key)
+        assert limiter.stats()["keys"] == 2
+        print("✓ Key count bounded")
+
+
+class TestClientIp:
+    """Client address used as the per-IP rate limit key"""
+
+    def test_forwarded_ignored_by_default(self):
+        """Without a trusted proxy, X-Forwarded-For is ignored"""
+        assert not rate_limit.RATE_LIMIT_TRUST_PROXY
+        assert get_client_ip(request(forwarded="1.2.3.4")) == "10.0.0.1"
+        print("✓ X-Forwarded-For ignored by default")
+
+    def test_spoofed_entry_ignored(self, behind_proxy):
+        """A client-supplied entry left of the proxy's is not used"""
+        assert get_client_ip(request(forwarded="6.6.6.6, 203.0.113.7")) == "203.0.113.7"
+        print("✓ Spoofed X-Forwarded-For entry ignored")
+
+    def test_two_proxies(self, behind_proxy, monkeypatch):
+        """With two proxies the client is two hops from the right"""
+        monkeypatch.setattr(rate_limit, "TRUSTED_PROXY_COUNT", 2)
+        assert get_client_ip(request(forwarded="6.6.6.6, 203.0.113.7, 10.1.1.1")) == "203.0.113.7"
+        # Fewer entries than proxies: the header didn't come through them all
+        assert get_client_ip(request(forwarded="203.0.113.7")) == "10.0.0.1"
+        print("✓ Client taken TRUSTED_PROXY_COUNT hops from the right")
+
+    def test_rotating_spoofed_header_still_limited(self, behind_proxy, monkeypatch):
+        """A fresh forged X-Forwarded-For per request doesn't reset the IP budget"""
+        monkeypatch.setattr(rate_limit, "ip_limiter", TokenBucketLimiter(3, 0.0, 100))
+        for _ in range(3):
+            check_auth_rate_limit(request(forwarded=f"{uuid.uuid4()}, 203.0.113.7"), None)
+        with pytest.raises(HTTPException) as exc:
+            check_auth_rate_limit(request(forwarded=f"{uuid.uuid4()}, 203.0.113.7"), None)
+        assert exc.value.status_code == 429
+        print("✓ Rotating forged headers still rate limited")
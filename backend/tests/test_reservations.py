@@ -0,0 +1,148 @@
+"""
+Stock Reservation Tests
+Tests: a hold on a sharded product can use the units in its shards, not
+just the pool's share; drifted `reserved` counters are repaired only once
+the drift has lasted a whole round
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+import inventory
+from conftest import FakeCollection, FakeCursor
+from inventory import shard_id
+from reservations import reconcile_reserved, reserve_quantities
+
+
+async def no_transactions(client):
+    return False
+
+
+@pytest.fixture
+def standalone(monkeypatch):
+    monkeypatch.setattr(inventory, "transactions_enabled", no_transactions)
+
+
+def sharded_product(fake_db, pool, *shards):
+    return fake_db(
+        products=[{"id": "p1", "name": "Gas 12kg", "stock": pool, "reserved": 0, "stock_shards": len(shards)}],
+        stock_shards=[
+            {"_id": shard_id("p1", n), "product_id": "p1", "shard": n, "available": units}
+            for n, units in enumerate(shards)
+        ]
+    )
+
+
+class TestShardedReservations:
+    """Holds against the pool plus the shards"""
+
+    def test_hold_larger_than_pool_refills_it(self, fake_db, standalone):
+        """Stock 50 as a pool of 10 and 4 shards of 10 can hold 25 units"""
+        db = sharded_product(fake_db, 10, 10, 10, 10, 10)
+        result = asyncio.run(reserve_quantities(db, "u1", {"p1": 25}))
+
+        assert result["unavailable"] == []
+        product = db.products.docs[0]
+        assert product["reserved"] == 25
+        assert product["stock"] == 25
+        assert sum(s["available"] for s in db.stock_shards.docs) == 25
+        refills = [e for e in db.inventory_ledger.docs if e["reason"] == "pool_refill"]
+        assert sum(e["delta"] for e in refills if e["counter"] == "pool") == 15
+        assert db.leases.docs == []
+        print("✓ 25 units held after refilling the pool from shards")
+
+    def test_hold_beyond_total_unavailable(self, fake_db, standalone):
+        """More than the pool and shards hold together is still refused"""
+        db = sharded_product(fake_db, 10, 10, 10)
+        result = asyncio.run(reserve_quantities(db, "u1", {"p1": 31}))
+        assert result["unavailable"] == ["p1"]
+        assert db.products.docs[0]["reserved"] == 0
+        print("✓ Hold beyond total stock refused")
+
+    def test_unsharded_product_not_refilled(self, fake_db, standalone):
+        """Without shards a short pool is simply unavailable"""
+        db = fake_db(products=[{"id": "p1", "name": "Gas 6kg", "stock": 3, "reserved": 0}])
+        result = asyncio.run(reserve_quantities(db, "u1", {"p1": 5}, minutes=1))
+        assert result["unavailable"] == ["p1"]
+        assert db.stock_shards.calls["find"] == 0
+        print("✓ Unsharded product not refilled")
+
+    def test_busy_stock_lease_means_unavailable(self, fake_db, standalone, monkeypatch):
+        """While a compaction holds the product, the hold is refused rather than waiting forever"""
+        monkeypatch.setattr(inventory, "STOCK_LEASE_WAIT_SECONDS", 0)
+        db = sharded_product(fake_db, 10, 10, 10)
+        db.leases.docs.append(
+            {"_id": inventory.stock_lease("p1"), "owner": "compactor",
+             "expires_at": datetime.utcnow() + timedelta(seconds=30)}
+        )
+        result = asyncio.run(reserve_quantities(db, "u1", {"p1": 15}))
+        assert result["unavailable"] == ["p1"]
+        assert db.products.docs[0]["stock"] == 10
+        print("✓ Busy stock lease reported as unavailable")
+
+
+class Holds(FakeCollection):
+    """db.reservations with the per-product quantity aggregation."""
+
+    def aggregate(self, pipeline):
+        totals = {}
+        for row in self.docs:
+            totals[row["product_id"]] = totals.get(row["product_id"], 0) + row["quantity"]
+        return FakeCursor([{"_id": pid, "quantity": qty} for pid, qty in totals.items()])
+
+
+def drifted_db(fake_db):
+    return fake_db(
+        products=[
+            {"id": "p1", "stock": 10, "reserved": 5},  # 3 held: a crash lost a release
+            {"id": "p2", "stock": 10, "reserved": 0},  # 2 held: a checkout consumed them, rows not deleted yet
+            {"id": "p3", "stock": 10, "reserved": 4},
+        ],
+        reservations=Holds([
+            {"user_id": "u1", "product_id": "p1", "quantity": 3},
+            {"user_id": "u2", "product_id": "p2", "quantity": 2},
+            {"user_id": "u3", "product_id": "p3", "quantity": 4},
+        ])
+    )
+
+
+class TestReconcileReserved:
+    """Drift repair run by the release loop"""
+
+    def test_drift_repaired_on_second_sighting(self, fake_db):
+        """The first round only notes a mismatch; the second repairs it"""
+        db = drifted_db(fake_db)
+        suspects = asyncio.run(reconcile_reserved(db, {}))
+        assert set(suspects) == {"p1", "p2"}
+        assert [p["reserved"] for p in db.products.docs] == [5, 0, 4]
+
+        suspects = asyncio.run(reconcile_reserved(db, suspects))
+        assert [p["reserved"] for p in db.products.docs] == [3, 2, 4]
+        assert suspects == {}
+        print("✓ Lasting drift repaired on the second round")
+
+    def test_transient_mismatch_left_alone(self, fake_db):
+        """A mismatch that resolved itself between rounds is never written"""
+        db = drifted_db(fake_db)
+        suspects = asyncio.run(reconcile_reserved(db, {}))
+        # The in-flight checkout on p2 deletes its claimed rows before the next round
+        db.reservations.docs = [row for row in db.reservations.docs if row["product_id"] != "p2"]
+
+        suspects = asyncio.run(reconcile_reserved(db, suspects))
+        assert db.products.docs[1]["reserved"] == 0
+        assert set(suspects) == set()
+        assert db.products.docs[0]["reserved"] == 3
+        print("✓ Transient mismatch not overwritten")
+
+    def test_changed_counter_not_overwritten(self, fake_db):
+        """A counter that moved since the last round is re-checked, not overwritten"""
+        db = drifted_db(fake_db)
+        suspects = asyncio.run(reconcile_reserved(db, {}))
+        db.products.docs[0]["reserved"] = 8
+        db.reservations.docs.append({"user_id": "u4", "product_id": "p1", "quantity": 3})
+
+        suspects = asyncio.run(reconcile_reserved(db, suspects))
+        assert db.products.docs[0]["reserved"] == 8
+        assert suspects["p1"] == (8, 6)
+        print("✓ Counter that moved is only re-checked")
@@ -0,0 +1,39 @@
+"""
+Token Revocation Tests
+Tests: tokens issued before a user's cutoff are rejected, tokens issued in
+the same second or later are not
+"""
+import calendar
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from revocation import RevocationList
+
+
+def iat(moment: datetime) -> int:
+    """The whole-second iat claim a token issued at `moment` carries."""
+    return calendar.timegm(moment.utctimetuple())
+
+
+class TestRevocationList:
+    """Per-user token cutoffs"""
+
+    def test_older_token_revoked(self):
+        """A token issued before the cutoff is rejected"""
+        revocations = RevocationList(refresh_interval=30)
+        cutoff = datetime.utcnow().replace(microsecond=0)
+        revocations.add("u1", cutoff)
+        assert revocations.is_revoked("u1", iat(cutoff - timedelta(seconds=1)))
+        assert not revocations.is_revoked("u2", iat(cutoff - timedelta(seconds=1)))
+        print("✓ Token older than the cutoff revoked")
+
+    def test_token_in_cutoff_second_accepted(self):
+        """A token issued right after revocation, in the same second, still works"""
+        revocations = RevocationList(refresh_interval=30)
+        cutoff = datetime.utcnow().replace(microsecond=0)
+        revocations.add("u1", cutoff)
+        assert not revocations.is_revoked("u1", iat(cutoff + timedelta(microseconds=900000)))
+        print("✓ Token from the cutoff second accepted")
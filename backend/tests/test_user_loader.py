@@ -0,0 +1,89 @@
+"""
+UserLoader Tests
+Tests: order-list customer enrichment issues one users query per request,
+not one per order
+"""
+import asyncio
+
+from loaders import UserLoader, order_customers
+
+
+def users(count):
+    return [
+        {"id": f"u{i}", "name": f"User {i}", "email": f"u{i}@example.com", "password_hash": "x"}
+        for i in range(count)
+    ]
+
+
+class TestUserLoader:
+    """Query counts for batched customer lookups"""
+
+    def test_page_of_orders_costs_one_query(self, fake_db):
+        """50 orders from 10 customers resolve with a single $in query"""
+        db = fake_db(users=users(10))
+        loader = UserLoader(db)
+        orders = [{"user_id": f"u{i % 10}"} for i in range(50)]
+
+        customers = asyncio.run(loader.load_many(o["user_id"] for o in orders))
+
+        assert db.users.calls["find"] == 1
+        assert loader.queries == 1
+        assert len(customers) == 10
+        assert customers["u3"]["name"] == "User 3"
+        print("✓ 50 orders enriched with 1 users query")
+
+    def test_repeat_lookups_served_from_memory(self, fake_db):
+        """Ids already loaded in this request are not fetched again"""
+        db = fake_db(users=users(5))
+        loader = UserLoader(db)
+
+        async def run():
+            await loader.load_many(["u0", "u1"])
+            await loader.load("u1")
+            await loader.load("u0")
+            await loader.load_many(["u1", "u2"])
+
+        asyncio.run(run())
+        assert db.users.calls["find"] == 2
+        print("✓ Cached ids skipped, only u2 fetched on second query")
+
+    def test_missing_user_is_none_and_cached(self, fake_db):
+        """Unknown ids map to None and are not re-queried"""
+        db = fake_db(users=users(1))
+        loader = UserLoader(db)
+
+        async def run():
+            first = await loader.load("ghost")
+            second = await loader.load("ghost")
+            return first, second
+
+        assert asyncio.run(run()) == (None, None)
+        assert db.users.calls["find"] == 1
+        print("✓ Missing user cached as None")
+
+    def test_projection_excludes_password_hash(self, fake_db):
+        """Enrichment never returns the password hash"""
+        loader = UserLoader(fake_db(users=users(1)))
+        user = asyncio.run(loader.load("u0"))
+        assert "password_hash" not in user
+        assert user["email"] == "u0@example.com"
+        print("✓ password_hash not projected")
+
+    def test_snapshot_orders_skip_users_query(self, fake_db):
+        """Orders carrying a customer snapshot never touch users"""
+        db = fake_db(users=users(3))
+        loader = UserLoader(db)
+        orders = [
+            {"user_id": "u0", "phone": "600", "customer": {"id": "u0", "name": "Snap", "email": "s@example.com", "phone": "600"}},
+            {"user_id": "u1", "phone": "601"},
+        ]
+
+        customers = asyncio.run(order_customers(orders, loader))
+
+        assert customers[0]["name"] == "Snap"
+        assert customers[1] == {"id": "u1", "name": "User 1", "email": "u1@example.com", "phone": "601"}
+        assert db.users.calls["find"] == 1
+
+        asyncio.run(order_customers(orders[:1], UserLoader(db)))
+        assert db.users.calls["find"] == 1
+        print("✓ Snapshot orders served without a users query")
@@ -6,11 +6,68 @@ const AuthContext = createContext(null);
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// Refresh tokens live next to the access token, in whichever storage login picked
+const getTokenStorage = () =>
+  sessionStorage.getItem('refresh_token') ? sessionStorage : localStorage;
+
+// Shared across concurrent 401s so a single refresh call rotates the token
+let refreshPromise = null;
+
+const refreshAccessToken = () => {
+  if (!refreshPromise) {
+    const storage = getTokenStorage();
+    const refreshToken = storage.getItem('refresh_token');
+    refreshPromise = (refreshToken
+      ? axios.post(`${API}/auth/refresh`, { refresh_token: refreshToken })
+          .then((response) => {
+            const { access_token, refresh_token } = response.data;
+            storage.setItem('token', access_token);
+            storage.setItem('refresh_token', refresh_token);
+            return access_token;
+          })
+      : Promise.reject(new Error('No refresh token'))
+    ).finally(() => {
+      refreshPromise = null;
+    });
+  }
+  return refreshPromise;
+};
+
 export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [token, setToken] = useState(localStorage.getItem('token'));
   const [loading, setLoading] = useState(true);
 
+  useEffect(() => {
+    // Access tokens are short-lived: on a 401, refresh once and replay the request
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const isAuthCall = original?.url?.includes('/auth/refresh') || original?.url?.includes('/auth/login');
+        if (error.response?.status !== 401 || !original || original._retried || isAuthCall) {
+          return Promise.reject(error);
+        }
+        original._retried = true;
+        try {
+          const newToken = await refreshAccessToken();
+          setToken(newToken);
+          original.headers.Authorization = `Bearer ${newToken}`;
+          return axios(original);
+        } catch (refreshError) {
+          localStorage.removeItem('token');
+          localStorage.removeItem('refresh_token');
+          sessionStorage.removeItem('token');
+          sessionStorage.removeItem('refresh_token');
+          setToken(null);
+          setUser(null);
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   useEffect(() => {
     // Check if user is logged in on mount
     const initAuth = async () => {
@@ -21,7 +78,7 @@ export const AuthProvider = ({ children }) => {
             headers: { Authorization: `Bearer ${savedToken}` }
           });
           setUser(response.data);
-          setToken(savedToken);
+          setToken(localStorage.getItem('token'));
         } catch (error) {
           console.error('Auth initialization failed:', error);
           localStorage.removeItem('token');
@@ -41,12 +98,14 @@ export const AuthProvider = ({ children }) => {
         password
       });
       
-      const { access_token, user: userData } = response.data;
+      const { access_token, refresh_token, user: userData } = response.data;
       
       if (rememberMe) {
         localStorage.setItem('token', access_token);
+        localStorage.setItem('refresh_token', refresh_token);
       } else {
         sessionStorage.setItem('token', access_token);
+        sessionStorage.setItem('refresh_token', refresh_token);
       }
       
       setToken(access_token);
@@ -65,9 +124,10 @@ export const AuthProvider = ({ children }) => {
     try {
       const response = await axios.post(`${API}/auth/register`, userData);
       
-      const { access_token, user: newUser } = response.data;
+      const { access_token, refresh_token, user: newUser } = response.data;
       
       localStorage.setItem('token', access_token);
+      localStorage.setItem('refresh_token', refresh_token);
       setToken(access_token);
       setUser(newUser);
       
@@ -81,8 +141,15 @@ export const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    // End the session server-side too, so the refresh token can't be replayed
+    const refreshToken = getTokenStorage().getItem('refresh_token');
+    if (refreshToken) {
+      axios.post(`${API}/auth/logout`, { refresh_token: refreshToken }).catch(() => {});
+    }
     localStorage.removeItem('token');
+    localStorage.removeItem('refresh_token');
     sessionStorage.removeItem('token');
+    sessionStorage.removeItem('refresh_token');
     setToken(null);
     setUser(null);
   };
@@ -1,10 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '@/contexts/AuthContext';
 import { useLanguage } from '@/contexts/LanguageContext';
 import axios from 'axios';
 import { ArrowLeft, MapPin, Phone, CreditCard, AlertCircle, ChevronDown, Plus, Star } from 'lucide-react';
 import { formatCurrency } from '@/utils/currency';
+import { newIdempotencyKey } from '@/utils/idempotency';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -16,6 +17,8 @@ const Checkout = () => {
   const [cart, setCart] = useState(null);
   const [loading, setLoading] = useState(true);
   const [processing, setProcessing] = useState(false);
+  // One key per checkout, reused by retries so a flaky network can't place two orders
+  const idempotencyKey = useRef(null);
   const [savedAddresses, setSavedAddresses] = useState([]);
   const [selectedAddressId, setSelectedAddressId] = useState(null);
   const [showAddressPicker, setShowAddressPicker] = useState(false);
@@ -33,7 +36,7 @@ const Checkout = () => {
     const loadData = async () => {
       // Fetch cart
       try {
-        const cartResponse = await axios.get(`${API}/cart`, {
+        const cartResponse = await axios.get(`${API}/cart?validate=true`, {
           headers: { Authorization: `Bearer ${token}` }
         });
         
@@ -43,6 +46,12 @@ const Checkout = () => {
         }
         
         setCart(cartResponse.data);
+        
+        // Hold stock while the customer fills in delivery details; checkout
+        // still validates stock, so a failed hold is not fatal
+        axios.post(`${API}/cart/reserve`, null, {
+          headers: { Authorization: `Bearer ${token}` }
+        }).catch(error => console.error('Error reserving stock:', error));
       } catch (error) {
         console.error('Error fetching cart:', error);
         navigate('/cart');
@@ -131,17 +140,28 @@ const Checkout = () => {
         phone: `+237 ${formData.phone}`
       };
       
+      // Created on first submit, not every render
+      if (!idempotencyKey.current) {
+        idempotencyKey.current = newIdempotencyKey();
+      }
       const response = await axios.post(
         `${API}/orders`,
         orderData,
-        { headers: { Authorization: `Bearer ${token}` } }
+        { headers: { Authorization: `Bearer ${token}`, 'Idempotency-Key': idempotencyKey.current } }
       );
       
       // Navigate to success page with order ID
       navigate(`/order-success/${response.data.order_id}`);
     } catch (error) {
       console.error('Error creating order:', error);
-      alert(t('error.generic'));
+      const detail = error.response?.data?.detail;
+      if (error.response?.status === 409 && detail?.cart) {
+        // Prices or availability changed; show the updated cart for review
+        setCart(detail.cart);
+        alert(detail.message);
+      } else {
+        alert(t('error.generic'));
+      }
       setProcessing(false);
     }
   };
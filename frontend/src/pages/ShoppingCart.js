@@ -40,12 +40,12 @@ const ShoppingCart = () => {
     
     setUpdating(true);
     try {
-      await axios.put(
-        `${API}/cart/items/${productId}`,
-        { quantity: newQuantity, size },
+      const response = await axios.patch(
+        `${API}/cart`,
+        { operations: [{ op: 'set', product_id: productId, size, quantity: newQuantity }] },
         { headers: { Authorization: `Bearer ${token}` } }
       );
-      await fetchCart();
+      setCart(response.data);
     } catch (error) {
       console.error('Error updating quantity:', error);
       alert(t('cart.updateError'));
@@ -58,12 +58,12 @@ const ShoppingCart = () => {
     
     setUpdating(true);
     try {
-      // Use URL query string directly for better compatibility
-      const encodedSize = encodeURIComponent(size);
-      await axios.delete(`${API}/cart/items/${productId}?size=${encodedSize}`, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
-      await fetchCart();
+      const response = await axios.patch(
+        `${API}/cart`,
+        { operations: [{ op: 'remove', product_id: productId, size }] },
+        { headers: { Authorization: `Bearer ${token}` } }
+      );
+      setCart(response.data);
     } catch (error) {
       console.error('Error removing item:', error);
       alert(t('cart.removeError'));
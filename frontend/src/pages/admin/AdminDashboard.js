@@ -31,7 +31,7 @@ const AdminDashboard = () => {
       try {
         const [statsRes, ordersRes] = await Promise.all([
           axios.get(`${API}/admin/stats`, { headers: { Authorization: `Bearer ${token}` } }),
-          axios.get(`${API}/admin/orders?limit=5`, { headers: { Authorization: `Bearer ${token}` } })
+          axios.get(`${API}/admin/orders?limit=5&include_total=false`, { headers: { Authorization: `Bearer ${token}` } })
         ]);
         setStats(statsRes.data);
         setRecentOrders(ordersRes.data.orders);
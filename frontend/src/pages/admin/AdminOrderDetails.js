@@ -102,13 +102,20 @@ const AdminOrderDetails = () => {
     try {
       await axios.put(
         `${API}/admin/orders/${orderId}/status`,
-        { status: newStatus },
+        { status: newStatus, expected_status: order.status },
         { headers: { Authorization: `Bearer ${token}` } }
       );
       setOrder(prev => ({ ...prev, status: newStatus }));
     } catch (error) {
       console.error('Error updating status:', error);
-      alert(t('Erreur lors de la mise à jour', 'Error updating status'));
+      const detail = error.response?.data?.detail;
+      if (error.response?.status === 409 && detail?.current_status) {
+        // Someone else moved the order first; show where it is now
+        setOrder(prev => ({ ...prev, status: detail.current_status }));
+        alert(t('Le statut de la commande a changé entre-temps', 'The order status changed in the meantime'));
+      } else {
+        alert(typeof detail === 'string' ? detail : t('Erreur lors de la mise à jour', 'Error updating status'));
+      }
     } finally {
       setUpdating(false);
     }
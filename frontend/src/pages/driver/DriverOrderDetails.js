@@ -75,6 +75,17 @@ const DriverOrderDetails = () => {
     }).format(date);
   };
 
+  const handleUpdateError = (error) => {
+    const detail = error.response?.data?.detail;
+    if (error.response?.status === 409 && detail?.current_status) {
+      // Someone else moved the order first; show where it is now
+      setOrder(prev => ({ ...prev, status: detail.current_status }));
+      alert(t('Le statut de la commande a changé entre-temps', 'The order status changed in the meantime'));
+      return;
+    }
+    alert(detail || t('Erreur lors de la mise à jour', 'Error updating status'));
+  };
+
   const updateStatus = async (newStatus) => {
     if (newStatus === 'echouee') {
       setShowFailureModal(true);
@@ -85,14 +96,13 @@ const DriverOrderDetails = () => {
     try {
       await axios.put(
         `${API}/driver/orders/${orderId}/status`,
-        { status: newStatus },
+        { status: newStatus, expected_status: order.status },
         { headers: { Authorization: `Bearer ${token}` } }
       );
       setOrder(prev => ({ ...prev, status: newStatus }));
     } catch (error) {
       console.error('Error updating status:', error);
-      const message = error.response?.data?.detail || t('Erreur lors de la mise à jour', 'Error updating status');
-      alert(message);
+      handleUpdateError(error);
     } finally {
       setUpdating(false);
     }
@@ -110,6 +120,7 @@ const DriverOrderDetails = () => {
         `${API}/driver/orders/${orderId}/status`,
         { 
           status: 'echouee',
+          expected_status: order.status,
           failure_reason: failureReason,
           failure_details: failureReason === 'autre' ? failureDetails : undefined
         },
@@ -124,8 +135,7 @@ const DriverOrderDetails = () => {
       setShowFailureModal(false);
     } catch (error) {
       console.error('Error submitting failure:', error);
-      const message = error.response?.data?.detail || t('Erreur lors de la mise à jour', 'Error updating status');
-      alert(message);
+      handleUpdateError(error);
     } finally {
       setUpdating(false);
     }